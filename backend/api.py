@@ -2,185 +2,717 @@
 API proxy and health check endpoints for Michael's Chat server
 """
 import json
+import logging
 import requests
 import base64
 import os
+import time
 from datetime import datetime
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, after_this_request
 from config_manager import ConfigurationManager
+from request_errors import ChatRequestError
+import json_codec
+from json_codec import extract_delta_content
+from upstream_pool import UpstreamPool, AsyncUpstreamPool
+from sse import iter_response_events, parse_events, format_text_frame, format_delta_event, DONE_EVENT
+from stream_coalescer import coalesce_settings, coalesce_deltas
+from conversation_store import ConversationStore, make_user_turn
+from context_budget import ContextAssembler, context_settings
+from image_pipeline import ImagePipeline, image_settings
+from blob_store import BlobStore
+from response_cache import ResponseCache, cache_settings, cache_key, replay_chunks
+from health_monitor import HealthMonitor
+from hedging import Hedger, hedge_settings
+from jobs import JobQueue
+from stream_registry import stream_registry_from_env
+from structured_logging import configure_logging, get_logger
+from metrics import Metrics, StreamTimer, chat_labels
+from stage_timing import StageTimer, SpanFileExporter
 
 api_blueprint = Blueprint('api_blueprint', __name__)
+
+# Sampled, redacted logging, formatted and written on a background thread (LOG_* settings)
+configure_logging()
+request_log = get_logger('request')
+upstream_log = get_logger('upstream')
+stream_log = get_logger('stream')
+health_log = get_logger('health')
 config_manager = ConfigurationManager()
 
-# Global dictionary to track active streaming requests
-active_streams = {}
+# Keep-alive upstream sessions keyed by (scheme, host, port), shared by every outbound call
+upstream_pool = UpstreamPool.from_env()
+async_upstream_pool = AsyncUpstreamPool.from_env(pool_size=int(os.environ.get('ASYNC_MAX_CONNECTIONS', '1000')))
+
+# Server-side conversation history, so clients only send the new turn
+conversation_store = ConversationStore(os.environ.get('CONVERSATION_DIR', 'conversations'))
+
+# Trims history to each configuration's token budget (token counts and summaries are cached)
+context_assembler = ContextAssembler()
+
+# Downscales and re-encodes chat images on a shared worker pool
+image_pipeline = ImagePipeline.from_env()
+
+# Uploaded images, stored once by content hash and referenced from chat requests
+blob_store = BlobStore.from_env()
+
+# Opt-in exact-match cache of completed replies (memory tier, plus disk when RESPONSE_CACHE_DIR is set)
+response_cache = ResponseCache.from_env()
+
+# Probes every stored configuration in the background (started by app.py / the ASGI lifespan)
+health_monitor = HealthMonitor.from_env(
+    lambda config, **options: probe_configuration(config, **options),
+    lambda: config_manager.get_all_configurations()
+)
+
+# Slow probes triggered by saving a configuration run here instead of inside the request
+job_queue = JobQueue.from_env()
+
+# Response header marking chat replies served from (HIT) or stored to (MISS) the response cache
+CACHE_STATUS_HEADER = 'X-Cache'
+
+# Response header reporting how many bytes image normalization removed from the upstream request
+IMAGE_BYTES_SAVED_HEADER = 'X-Image-Bytes-Saved'
+
+# Response header with the stage timings of non-streaming responses (streams end with a timing event)
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+# Prometheus metrics served at /metrics (aggregated across workers when METRICS_DIR is set)
+metrics = Metrics.from_env()
+
+# Races a second upstream request when the first event is late, for configurations that opt in
+hedger = Hedger.from_env(metrics)
+
+# Per-request stage timings also go to an OTLP/JSON span file when TRACE_FILE is set
+span_exporter = SpanFileExporter.from_env()
+
+# Cancel flags of active streaming requests (shared between workers unless STREAM_REGISTRY=local)
+stream_registry = stream_registry_from_env()
+# Metric labels of the streams this process is relaying, for the active-streams gauge
+stream_labels = {}
+
+SYSTEM_PROMPT = 'You are a helpful and knowledgeable assistant. All your responses must be formatted using Markdown. When providing code, you MUST follow this EXACT format:\n\n```language\ncode here\n```\n\nFor example:\n\n```python\nfor i in range(10):\n    print("Hello")\n```\n\nCRITICAL RULES:\n1. Always start with ``` followed immediately by the language name\n2. Add a newline after the language name\n3. Write your code with proper indentation\n4. Add a newline before the closing ```\n5. End with ``` on its own line\n\nNever write ```python on the same line as code. Never omit the language name. This formatting is essential for proper code display.'
+
+SUMMARY_PROMPT = 'Summarize the conversation below for use as context in a continuing chat. Keep facts, decisions, names, code identifiers and open questions. Reply with the summary only.'
+
+
+def history_image_urls(images, normalize=None):
+    """Return data URLs for history images that are still in the blob store
+
+    With image settings in `normalize`, the normalized copies are sent
+    instead, made once per image and kept in the blob store.
+    """
+    hashes = [img['hash'] for img in images if img.get('hash')]
+    if normalize and hashes:
+        hashes, stats = image_pipeline.normalize_stored(hashes, normalize, blob_store)
+        if stats['images']:
+            report_image_stats(stats)
+    urls = []
+    for blob_hash in hashes:
+        url = blob_store.data_url(blob_hash)
+        if url:
+            urls.append(url)
+    return urls
+
+
+def resolve_request_images(data):
+    """Replace hash references in the current message's images with data URLs from the blob store"""
+    if not data or not data.get('images'):
+        return
+    resolved = []
+    for img in data['images']:
+        if img.get('hash'):
+            url = blob_store.data_url(img['hash'])
+            if url is None:
+                raise ChatRequestError({
+                    'error': 'Image not found',
+                    'details': f"No uploaded image with hash {img['hash']}; upload it again via /api/images"
+                }, 400)
+            img = dict(img, url=url)
+        resolved.append(img)
+    data['images'] = resolved
+
+
+def build_messages(message, images, conversation_history, normalize=None):
+    """Build the upstream messages array from the current turn and conversation history
+
+    `normalize` holds the image settings that history images are normalized with, if any.
+    """
+    messages = [
+            {'role': 'system', 'content': SYSTEM_PROMPT}
+    ]
+    
+    # Add conversation history
+    for hist_msg in conversation_history:
+        if hist_msg.get('sender') == 'user':
+            # Handle user messages - only send text content from history
+            # Images from history are blob URLs that can't be accessed by backend
+            user_content = hist_msg.get('content', '')
+            hist_images = hist_msg.get('images', [])
+            
+            # Images uploaded to the blob store are resent by hash; any others were
+            # browser-only object URLs the backend cannot access
+            image_urls = history_image_urls(hist_images, normalize)
+            missing_images = len(hist_images) - len(image_urls)
+            if missing_images and user_content:
+                # If there were images, add a note about them in the text
+                text = f"{user_content} [Note: This message originally contained {missing_images} image(s)]"
+            elif user_content:
+                # Simple text message
+                text = user_content
+            elif missing_images:
+                # Only images, no text - add a placeholder
+                text = f"[Image message with {missing_images} image(s)]"
+            else:
+                text = ''
+            
+            if image_urls:
+                content = [{'type': 'text', 'text': text}] if text else []
+                content.extend({'type': 'image_url', 'image_url': {'url': url}} for url in image_urls)
+                messages.append({'role': 'user', 'content': content})
+            elif text:
+                messages.append({'role': 'user', 'content': text})
+        elif hist_msg.get('sender') == 'ai':
+            messages.append({'role': 'assistant', 'content': hist_msg.get('content', '')})
+    
+    # Add current message
+    if images:
+        # Format as multimodal content
+        content = []
+        if message:
+            content.append({'type': 'text', 'text': message})
+        for img in images:
+            content.append({
+                'type': 'image_url',
+                'image_url': {'url': img.get('url', '')}
+            })
+        messages.append({'role': 'user', 'content': content})
+    else:
+        # Simple text message
+        messages.append({'role': 'user', 'content': message})
+    
+    return messages
+
+
+def transcript_text(content):
+    """Render message content for a summary transcript, with images as placeholders"""
+    if isinstance(content, str):
+        return content
+    return ' '.join(
+        part.get('text', '') if part.get('type') == 'text' else '[image]'
+        for part in content or []
+    )
+
+
+def make_history_summarizer(api_url, headers, model):
+    """Return a summarize(previous_summary, messages) function that asks the chat's own model"""
+    def summarize(previous_summary, messages):
+        transcript = []
+        if previous_summary:
+            transcript.append(f"Earlier summary: {previous_summary}")
+        for msg in messages:
+            transcript.append(f"{msg['role']}: {transcript_text(msg['content'])}")
+        payload = {
+            'messages': [
+                {'role': 'system', 'content': SUMMARY_PROMPT},
+                {'role': 'user', 'content': '\n\n'.join(transcript)}
+            ],
+            'max_tokens': 500,
+            'stream': False
+        }
+        if model:
+            payload['model'] = model
+        response = upstream_pool.post(api_url, headers=headers, json=payload, timeout=60)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+    return summarize
+
+
+def image_normalization_settings(data, config):
+    """Return image settings for a chat request, or None if it has no images to normalize"""
+    if not data or not data.get('images') or not image_pipeline.available:
+        return None
+    return image_settings(data, config)
+
+
+def report_image_stats(stats):
+    request_log.info('🖼️ Normalized images', **stats)
+    return stats
+
+
+def normalize_request_images(data, config):
+    """Downscale and re-encode the request's images in place; returns the stats, or None if skipped"""
+    settings = image_normalization_settings(data, config)
+    if not settings:
+        return None
+    data['images'], stats = image_pipeline.normalize(data['images'], settings)
+    return report_image_stats(stats)
+
+
+async def anormalize_request_images(data, config):
+    """Async counterpart of normalize_request_images for the asyncio chat path"""
+    settings = image_normalization_settings(data, config)
+    if not settings:
+        return None
+    data['images'], stats = await image_pipeline.anormalize(data['images'], settings)
+    return report_image_stats(stats)
+
+
+def prepare_chat_request(data, config=None):
+    """Validate a /api/chat request body and build the upstream URL, headers and payload.
+
+    Shared by the Flask view and the asyncio chat path in asgi.py so both
+    keep the same request/response contract. Raises ChatRequestError with
+    the JSON error body and status code when the request is invalid.
+    `config` is the matching stored configuration, used for its
+    per-configuration settings such as the context token budget.
+    """
+    # Check if data is None
+    if data is None:
+        request_log.warning('❌ No JSON data received in request')
+        raise ChatRequestError({
+            'error': 'No JSON data received',
+            'details': 'Request must contain valid JSON data'
+        }, 400)
+    
+    # Extract configuration from request
+    api_url = data.get('api_url')
+    api_key = data.get('api_key')
+    model = data.get('model')
+    message = data.get('message')
+    images = data.get('images', [])
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        # Stored history replaces any conversation_history sent by the client
+        conversation_history = conversation_store.get_messages(conversation_id)
+        if conversation_history is None:
+            raise ChatRequestError({
+                'error': 'Conversation not found',
+                'details': f'No conversation with id {conversation_id}'
+            }, 404)
+    else:
+        conversation_history = data.get('conversation_history', [])
+    
+    request_log.info('Chat request', api_url=api_url, model=model, api_key_present=bool(api_key),
+                     images=len(images), history=len(conversation_history), conversation_id=conversation_id)
+    # The full body only at DEBUG; images and keys are summarized/redacted off-thread
+    request_log.debug('Chat request body', data=data)
+
+    if not api_url or (not message and not images):
+        request_log.warning('❌ Missing required fields', api_url_provided=bool(api_url),
+                            message_provided=bool(message), images=len(images))
+        raise ChatRequestError({
+            'error': 'Missing required fields: api_url, and either message or images',
+            'details': {
+                'api_url_provided': bool(api_url),
+                'message_provided': bool(message),
+                'images_provided': len(images) > 0,
+                'received_data': data
+            }
+        }, 400)
+    
+    # Prepare the request to the external API
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    
+    # Only add Authorization header if API key is provided
+    if api_key:
+        headers['Authorization'] = f'Bearer {api_key}'
+    
+    # Build messages array with conversation history; stored history images get the same
+    # normalization as the current turn's
+    normalize = image_settings(data, config) if image_pipeline.available else None
+    messages = build_messages(message, images, conversation_history, normalize)
+    
+    # Trim history to the configured token budget
+    context = context_settings(data, config)
+    if context:
+        summarize = None
+        if context['strategy'] == 'summarize' and conversation_id:
+            # Summaries are only cached for server-side conversations, whose history is append-only
+            summarize = make_history_summarizer(api_url, headers, model)
+        history_count = len(messages)
+        messages = context_assembler.assemble(messages, context['budget'], key=conversation_id, summarize=summarize)
+        request_log.info('✂️ Context budget applied', budget=context['budget'], sent=len(messages), total=history_count)
+    
+    # API format for this specific endpoint
+    payload = {
+        'messages': messages,
+        'max_tokens': 1000,
+        'stream': True  # Enable streaming for real-time response
+    }
+    
+    # Only include model in payload if it's specified in the configuration
+    if model:
+        payload['model'] = model
+    
+    upstream_log.debug('📤 Upstream request', api_url=api_url, payload=payload)
+    
+    return api_url, headers, payload
+
+
+def find_configuration(api_url, model):
+    """Find the newest configuration matching an API URL and model"""
+    return config_manager.find_by_endpoint(api_url, model)
+
+
+def resolve_configuration(data):
+    """Return the stored configuration a chat request was made with, if any"""
+    config_id = data.get('configuration_id')
+    if config_id:
+        config = config_manager.get_configuration(config_id)
+        if config:
+            return config
+    return find_configuration(data.get('api_url'), data.get('model'))
+
+
+def content_from_raw_events(raw):
+    """Extract the concatenated delta content from raw upstream SSE bytes"""
+    parts = []
+    for event in parse_events(raw):
+        if event.is_done:
+            break
+        try:
+            content = json_codec.delta_content(event.data_bytes)
+        except json_codec.DecodeError:
+            continue
+        if content is not None:
+            parts.append(content)
+    return ''.join(parts)
+
+
+def start_conversation_turn(data):
+    """Store the user's turn and return a recorder for the assistant reply, if the chat has a conversation"""
+    conversation_id = data.get('conversation_id')
+    if not conversation_id:
+        return None
+    conversation_store.append(conversation_id, make_user_turn(data.get('message'), data.get('images', [])))
+    return conversation_store.recorder(conversation_id, decode_raw=content_from_raw_events)
+
+
+def register_stream(labels=None):
+    """Register a new cancellable stream and return its ID"""
+    stream_id = stream_registry.register()
+    stream_labels[stream_id] = labels or {}
+    metrics.inc('chat_active_streams', **stream_labels[stream_id])
+    return stream_id
+
+
+def is_stream_cancelled(stream_id):
+    """Check whether a stream was stopped or already cleaned up"""
+    return stream_registry.is_cancelled(stream_id)
+
+
+def release_stream(stream_id):
+    """Unregister a stream once it has finished, been cancelled or failed"""
+    labels = stream_labels.pop(stream_id, None)
+    if stream_registry.release(stream_id) and labels is not None:
+        metrics.dec('chat_active_streams', **labels)
+
+
+def record_chat_request(data, labels, body_bytes):
+    """Count a chat request with its body and (resolved) image bytes"""
+    metrics.inc('chat_requests_total', **labels)
+    metrics.inc('chat_request_bytes_total', body_bytes, **labels)
+    image_bytes = sum(len(img.get('url') or '') for img in (data or {}).get('images') or [] if isinstance(img, dict))
+    if image_bytes:
+        metrics.inc('chat_image_bytes_total', image_bytes, **labels)
+
+
+def start_stage_timer(name):
+    """Time the current request in stages; a non-streaming response gets them as a Server-Timing header"""
+    timing = StageTimer(name, span_exporter)
+
+    @after_this_request
+    def add_server_timing_header(response):
+        timing.attributes['http.status_code'] = response.status_code
+        if response.mimetype != 'text/event-stream':
+            # sse_stream finishes the timer and reports it in the stream's last event
+            timing.finish()
+            response.headers[SERVER_TIMING_HEADER] = timing.server_timing()
+        return response
+    return timing
+
+
+def stream_id_frame(stream_id, cache_hit=False):
+    """First SSE frame of every chat stream, carrying the ID used by /api/chat/stop"""
+    frame = {'stream_id': stream_id}
+    if cache_hit:
+        frame['cache_hit'] = True
+    return f"data: {json.dumps(frame)}\n\n"
+
+
+def sse_stream(stream_id, chunks, recorder=None, cache_hit=False, labels=None, timing=None):
+    """Frame relayed chunks as SSE: the stream ID first, then text deltas or raw passthrough events
+
+    With a StageTimer, a stream that runs to its end closes with an
+    `event: timing` frame reporting the request's stages.
+    """
+    frame = stream_id_frame(stream_id, cache_hit)
+    sent = len(frame)
+    yield frame
+    try:
+        for chunk in chunks:
+            if recorder:
+                recorder.add(chunk)
+            frame = chunk if isinstance(chunk, bytes) else format_text_frame(chunk)
+            sent += len(frame) if isinstance(frame, bytes) or frame.isascii() else len(frame.encode('utf-8'))
+            yield frame
+        if timing:
+            timing.mark('stream')
+            frame = timing.metadata_event()
+            sent += len(frame)
+            yield frame
+    finally:
+        # Runs on completion, cancellation and client disconnect alike
+        if recorder:
+            recorder.finish()
+        if timing:
+            timing.finish()
+        if labels is not None:
+            metrics.inc('chat_response_bytes_total', sent, **labels)
+
+
+def relayed_content(chunks):
+    """Join relayed text deltas and/or raw passthrough events into the reply text"""
+    text = ''.join(chunk for chunk in chunks if isinstance(chunk, str))
+    raw = b''.join(chunk for chunk in chunks if isinstance(chunk, bytes))
+    return text + (content_from_raw_events(raw) if raw else '')
+
+
+def cache_on_completion(chunks, key, ttl, outcome):
+    """Pass chunks through, caching the reply only if the upstream finished and every chunk was relayed"""
+    relayed = []
+    for chunk in chunks:
+        relayed.append(chunk)
+        yield chunk
+    if outcome.get('completed'):
+        response_cache.set(key, relayed_content(relayed), ttl)
+
+
+def replay_cached_response(content, stream_id, passthrough=False, pace_ms=0):
+    """Yield a cached reply the way stream_response relays an upstream one"""
+    stream_log.info('💾 Replaying cached response', stream_id=stream_id)
+    try:
+        for piece in replay_chunks(content, pace_ms):
+            if is_stream_cancelled(stream_id):
+                stream_log.info('🛑 Stream cancelled by user', stream_id=stream_id)
+                return
+            yield format_delta_event(piece) if passthrough else piece
+        if passthrough:
+            yield DONE_EVENT
+    finally:
+        release_stream(stream_id)
+
+
+def cached_chat_response(data, content, pace_ms=0, labels=None, timing=None):
+    """Build the SSE response for a response cache hit"""
+    recorder = start_conversation_turn(data)
+    stream_id = register_stream(labels)
+    chunks = replay_cached_response(content, stream_id, passthrough=data.get('stream_mode') == 'passthrough', pace_ms=pace_ms)
+    response = Response(sse_stream(stream_id, chunks, recorder, cache_hit=True, labels=labels, timing=timing),
+                        mimetype='text/event-stream')
+    response.headers[CACHE_STATUS_HEADER] = 'HIT'
+    return response
+
 
 @api_blueprint.route('/api/chat', methods=['POST'])
 def chat_proxy():
     """Proxy endpoint for chat API requests"""
+    timing = start_stage_timer('chat')
+    labels = chat_labels(None, None)
     try:
         data = request.get_json()
+        timing.mark('parse')
+        config = resolve_configuration(data or {})
+        labels = chat_labels(data, config)
+        timing.attributes.update(labels)
+        resolve_request_images(data)
+        record_chat_request(data, labels, request.content_length or 0)
+        timing.mark('resolve')
+        image_stats = normalize_request_images(data, config)
+        timing.mark('images')
+        if image_stats:
+            metrics.inc('chat_image_bytes_saved_total', image_stats['bytes_saved'], **labels)
+            @after_this_request
+            def add_image_stats_header(response):
+                response.headers[IMAGE_BYTES_SAVED_HEADER] = str(image_stats['bytes_saved'])
+                return response
+        api_url, headers, payload = prepare_chat_request(data, config)
+        # Optionally batch deltas into fewer, larger frames (resolved before anything is sent upstream)
+        coalescing = coalesce_settings(data, config)
+        timing.mark('build')
         
-        # Check if data is None
-        if data is None:
-            print(f"❌ No JSON data received in request")
-            return jsonify({
-                'error': 'No JSON data received',
-                'details': 'Request must contain valid JSON data'
-            }), 400
-        
-        # Extract configuration from request
-        api_url = data.get('api_url')
-        api_key = data.get('api_key')
-        model = data.get('model')
-        message = data.get('message')
-        images = data.get('images', [])
-        conversation_history = data.get('conversation_history', [])
-        
-        # Debug prints
-        print(f"\n=== Chat Request Debug ===")
-        print(f"Raw request data: {data}")
-        print(f"API URL: {api_url}")
-        print(f"API Key: {'*' * (len(api_key) - 8) + api_key[-8:] if api_key and len(api_key) > 8 else 'None'}")
-        print(f"Message: {message}")
-        print(f"Images: {len(images)} images provided")
-        print(f"Model: {model}")
-        print(f"Conversation History: {len(conversation_history)} messages")
-
-        if not api_url or (not message and not images):
-            print(f"❌ Missing required fields - URL: {bool(api_url)}, Message: {bool(message)}, Images: {len(images)}")
-            return jsonify({
-                'error': 'Missing required fields: api_url, and either message or images',
-                'details': {
-                    'api_url_provided': bool(api_url),
-                    'message_provided': bool(message),
-                    'images_provided': len(images) > 0,
-                    'received_data': data
-                }
-            }), 400
-        
-        # Prepare the request to the external API
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        # Only add Authorization header if API key is provided
-        if api_key:
-            headers['Authorization'] = f'Bearer {api_key}'
-        
-        # Build messages array with conversation history
-        messages = [
-                {'role': 'system', 'content': 'You are a helpful and knowledgeable assistant. All your responses must be formatted using Markdown. When providing code, you MUST follow this EXACT format:\n\n```language\ncode here\n```\n\nFor example:\n\n```python\nfor i in range(10):\n    print("Hello")\n```\n\nCRITICAL RULES:\n1. Always start with ``` followed immediately by the language name\n2. Add a newline after the language name\n3. Write your code with proper indentation\n4. Add a newline before the closing ```\n5. End with ``` on its own line\n\nNever write ```python on the same line as code. Never omit the language name. This formatting is essential for proper code display.'}
-        ]
-        
-        # Add conversation history
-        for hist_msg in conversation_history:
-            if hist_msg.get('sender') == 'user':
-                # Handle user messages - only send text content from history
-                # Images from history are blob URLs that can't be accessed by backend
-                user_content = hist_msg.get('content', '')
-                hist_images = hist_msg.get('images', [])
-                
-                # For conversation history, only send text content
-                # Images from previous messages are stored as blob URLs which are not accessible
-                if hist_images and user_content:
-                    # If there were images, add a note about them in the text
-                    content_with_note = f"{user_content} [Note: This message originally contained {len(hist_images)} image(s)]"
-                    messages.append({'role': 'user', 'content': content_with_note})
-                elif user_content:
-                    # Simple text message
-                    messages.append({'role': 'user', 'content': user_content})
-                elif hist_images:
-                    # Only images, no text - add a placeholder
-                    messages.append({'role': 'user', 'content': f"[Image message with {len(hist_images)} image(s)]"})
-            elif hist_msg.get('sender') == 'ai':
-                messages.append({'role': 'assistant', 'content': hist_msg.get('content', '')})
-        
-        # Add current message
-        if images:
-            # Format as multimodal content
-            content = []
-            if message:
-                content.append({'type': 'text', 'text': message})
-            for img in images:
-                content.append({
-                    'type': 'image_url',
-                    'image_url': {'url': img.get('url', '')}
-                })
-            messages.append({'role': 'user', 'content': content})
-        else:
-            # Simple text message
-            messages.append({'role': 'user', 'content': message})
-        
-        # API format for this specific endpoint
-        payload = {
-            'messages': messages,
-            'max_tokens': 1000,
-            'stream': True  # Enable streaming for real-time response
-        }
-        
-        # Only include model in payload if it's specified in the configuration
-        if model:
-            payload['model'] = model
-        
-        print(f"📤 Sending request to: {api_url}")
-        print(f"📦 Payload: {payload}")
+        # Identical requests can be answered from the response cache
+        caching = cache_settings(data, config)
+        key = cache_key(api_url, data.get('api_key'), payload) if caching else None
+        if key:
+            cached = response_cache.get(key)
+            timing.mark('cache')
+            if cached is not None:
+                request_log.info('💾 Response cache hit', key=key[:12])
+                return cached_chat_response(data, cached, caching['pace_ms'], labels, timing)
+            
+            @after_this_request
+            def add_cache_miss_header(response):
+                response.headers[CACHE_STATUS_HEADER] = 'MISS'
+                return response
         
         # Make request to external API with streaming
-        response = requests.post(api_url, headers=headers, json=payload, timeout=30, stream=True)
+        def send_upstream():
+            return upstream_pool.post(api_url, headers=headers, json=payload, timeout=30, stream=True)
+
+        # Opted-in configurations wait for the first event here and may race a second request
+        hedging = hedge_settings(data, config)
+        connect_started = time.perf_counter()
+        if hedging:
+            response = hedger.post(send_upstream, labels['config_id'] or api_url, hedging, labels)
+        else:
+            response = send_upstream()
+        metrics.observe('chat_upstream_connect_seconds', time.perf_counter() - connect_started, **labels)
+        timing.mark('upstream')
         
-        print(f"📥 Response status: {response.status_code}")
+        content_type = response.headers.get('content-type', '')
+        upstream_log.info('📥 Upstream response', status=response.status_code, content_type=content_type)
 
         if response.status_code == 200:
-            content_type = response.headers.get('content-type', '')
-            print(f"Content-Type: {content_type}")
+            recorder = start_conversation_turn(data)
             
             if 'text/event-stream' in content_type:
                 # Generate unique stream ID and register it
-                import uuid
-                stream_id = str(uuid.uuid4())
-                active_streams[stream_id] = {'cancelled': False}
+                stream_id = register_stream(labels)
                 
-                # Handle streaming response with proper Flask streaming
-                def stream_with_headers():
-                    # Send stream ID as first chunk
-                    yield f"data: {{\"stream_id\": \"{stream_id}\"}}\n\n"
-                    # Then stream the actual response
-                    for chunk in stream_response(response, stream_id):
-                        yield f"data: {chunk}\n\n"
+                # Passthrough relays upstream events verbatim instead of re-framing deltas
+                passthrough = data.get('stream_mode') == 'passthrough'
+                
+                outcome = {}
+                chunks = stream_response(response, stream_id, passthrough=passthrough,
+                                         on_complete=lambda: outcome.update(completed=True),
+                                         timer=StreamTimer(metrics, labels, timing.started, stages=timing))
+                if coalescing:
+                    chunks = coalesce_deltas(chunks, **coalescing)
+                if key:
+                    chunks = cache_on_completion(chunks, key, caching['ttl'], outcome)
                 
-                return Response(stream_with_headers(), mimetype='text/event-stream')
+                # Handle streaming response with proper Flask streaming
+                return Response(sse_stream(stream_id, chunks, recorder, labels=labels, timing=timing),
+                                mimetype='text/event-stream')
             else:
                 # Handle regular JSON response
-                return handle_json_response(response)
+                reply = handle_json_response(response, recorder)
+                timing.mark('response')
+                body = reply[0] if isinstance(reply, tuple) else reply
+                metrics.inc('chat_response_bytes_total', body.content_length or 0, **labels)
+                return reply
         else:
-            print(f"❌ API request failed with status {response.status_code}")
-            print(f"Error response: {response.text[:500]}...")
+            metrics.inc('chat_errors_total', kind='upstream_status', **labels)
+            upstream_log.warning('❌ API request failed', status=response.status_code, body=response.text[:500])
             return jsonify({
                 'error': f'API request failed with status {response.status_code}',
                 'details': response.text
             }), response.status_code
             
+    except ChatRequestError as e:
+        metrics.inc('chat_errors_total', kind='bad_request', **labels)
+        return jsonify(e.body), e.status_code
     except requests.RequestException as e:
-        print(f"🚨 Request Exception: {str(e)}")
+        metrics.inc('chat_errors_total', kind='upstream_connection', **labels)
+        upstream_log.error('🚨 Request exception', error=str(e))
         return jsonify({'error': f'Request failed: {str(e)}'}), 500
     except Exception as e:
-        print(f"🚨 Internal Server Error: {str(e)}")
+        metrics.inc('chat_errors_total', kind='internal', **labels)
+        request_log.error('🚨 Internal server error', exc_info=True, error=str(e))
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @api_blueprint.route('/api/test-external', methods=['POST'])
 def test_external_api():
-    """Test external API health and connectivity by sending a simple chat prompt"""
+    """Test external API health and connectivity by sending a simple chat prompt
+
+    Answers from the health monitor's cached result for a matching stored
+    configuration when it is fresh; send `"force": true` (or `?force=1`)
+    to always run a new probe.
+    """
     try:
         data = request.get_json()
         api_url = data['api_url']
         api_key = data.get('api_key')
         model = data.get('model')
+        force = bool(data.get('force')) or request.args.get('force') in ('1', 'true')
+        
+        config = find_configuration(api_url, model)
+        # Cached results are only shared with callers using the configuration's own key
+        if config and (config.get('apiKey') or None) != (api_key or None):
+            config = None
+        
+        if config and not force:
+            cached = health_monitor.latest(config['id'], max_age=health_monitor.interval)
+            if cached and 'response' in cached:
+                health_log.info('🩺 Returning cached health result', config=config['name'], checked_at=cached['checked_at'])
+                return jsonify(dict(cached['response'], cached=True, checked_at=cached['checked_at'],
+                                    latency_ms=cached['latency_ms'])), cached['status_code']
         
-        print(f"\n=== External API Test ===")
-        print(f"Testing API URL: {api_url}")
-        print(f"API Key: {'Present' if api_key else 'None'}")
-        print(f"Model: {model or 'None'}")
+        if config:
+            # An explicit test also re-runs the image test, like an unknown endpoint's
+            result = health_monitor.check(config, check_images=True)
+            return jsonify(dict(result['response'], cached=False, checked_at=result['checked_at'],
+                                latency_ms=result['latency_ms'])), result['status_code']
+        
+        body, status_code = timed_health_probe(api_url, api_key, model, {'config_id': '', 'model': model or ''})
+        return jsonify(body), status_code
+        
+    except Exception as e:
+        health_log.error('🚨 External API test error', exc_info=True, error=str(e))
+        return jsonify({
+            'health_status': 'unhealthy',
+            'error': str(e),
+            'error_type': 'internal_error'
+        }), 500
+
+
+def probe_configuration(config, check_images=False):
+    """Health probe for a stored configuration
+
+    Background probes only send the "I'm alive" check. Image support is
+    tested by the job queued when the configuration is saved, and the
+    stored result is reported, so periodic probing never rewrites the
+    configuration. Explicit tests pass `check_images=True` to re-run the
+    image test and store its result.
+    """
+    body, status_code = timed_health_probe(config['apiUrl'], config.get('apiKey'), config.get('model'),
+                                           chat_labels(None, config), check_images=check_images)
+    if check_images:
+        supports_images = body.get('supports_images')
+    else:
+        supports_images = config.get('supportsImages')
+        if status_code == 200:
+            body = dict(body, supports_images=supports_images)
+    return {
+        'healthy': status_code == 200,
+        'status_code': status_code,
+        'supports_images': supports_images,
+        'error': body.get('error'),
+        'response': body
+    }
+
+
+def timed_health_probe(api_url, api_key, model, labels, check_images=True):
+    """run_health_probe, recording its duration and failures under the given metric labels"""
+    started = time.perf_counter()
+    body, status_code = run_health_probe(api_url, api_key, model, check_images=check_images)
+    metrics.observe('health_probe_seconds', time.perf_counter() - started, **labels)
+    if status_code != 200:
+        metrics.inc('health_probe_failures_total', **labels)
+    return body, status_code
+
+
+def run_health_probe(api_url, api_key, model, check_images=True):
+    """Send the health prompt (and image test) to an endpoint; returns (response body, status code)
+
+    With `check_images` false only the health prompt is sent, and the
+    matching configuration's image support is left as it is.
+    """
+    try:
+        health_log.info('External API test', api_url=api_url, model=model, api_key_present=bool(api_key))
 
         # Prepare headers
         headers = {
@@ -205,35 +737,37 @@ def test_external_api():
         if model:
             test_payload['model'] = model
         
-        print(f"📤 Sending test request to: {api_url}")
-        print(f"📦 Test payload: {test_payload}")
+        health_log.debug('📤 Sending test request', api_url=api_url, payload=test_payload)
         
         # Make test request to the API endpoint
-        response = requests.post(api_url, headers=headers, json=test_payload, timeout=15)
+        response = upstream_pool.post(api_url, headers=headers, json=test_payload, timeout=15)
         
-        print(f"📥 Response status: {response.status_code}")
+        health_log.info('📥 Test response', api_url=api_url, status=response.status_code)
         
         if response.status_code == 200:
             try:
                 # Handle both streaming and JSON responses
                 response_text = response.text.strip()
-                print(f"📥 Raw response: {response_text[:200]}...")
+                health_log.debug('📥 Raw test response', body=response_text[:200])
                 
                 response_data = None
                 
                 # Check if it's a streaming response (starts with 'data:')
                 if response_text.startswith('data:'):
-                    # Parse streaming response
-                    lines = response_text.split('\n')
-                    for line in lines:
-                        if line.startswith('data:') and line != 'data: [DONE]':
-                            json_str = line[5:].strip()  # Remove 'data:' prefix
-                            if json_str:
-                                try:
-                                    response_data = json.loads(json_str)
-                                    break
-                                except json.JSONDecodeError:
-                                    continue
+                    # Parse streaming response, trying each data line so events
+                    # missing their blank-line separator are still understood
+                    data_lines = [
+                        line for event in parse_events(response_text)
+                        for line in event.data_bytes.split(b'\n')
+                    ]
+                    for json_line in data_lines:
+                        if json_line.strip() in (b'', b'[DONE]'):
+                            continue
+                        try:
+                            response_data = json_codec.loads(json_line)
+                            break
+                        except json_codec.DecodeError:
+                            continue
                 else:
                     # Regular JSON response
                     response_data = response.json()
@@ -241,7 +775,7 @@ def test_external_api():
                 if not response_data:
                     raise json.JSONDecodeError("No valid JSON found in response", response_text, 0)
                 
-                print(f"✅ API Response: {response_data}")
+                health_log.debug('✅ API response', response=response_data)
                 
                 # Try to extract the message content
                 response_content = "No content found"
@@ -256,10 +790,17 @@ def test_external_api():
                 expected_response = "I'm alive!"
                 response_content_clean = response_content.strip()
                 
-                print(f"🔍 Expected: '{expected_response}'")
-                print(f"🔍 Received: '{response_content_clean}'")
+                health_log.info('🔍 Test reply', expected=expected_response, received=response_content_clean)
                 
                 if response_content_clean.startswith(expected_response):
+                    if not check_images:
+                        return {
+                            'health_status': 'healthy',
+                            'status_code': response.status_code,
+                            'test_response': response_content_clean,
+                            'message': 'API is responding correctly - health check passed'
+                        }, 200
+                    
                     # Test image support
                     image_support_result = None
                     image_support_error = None
@@ -271,74 +812,70 @@ def test_external_api():
                     # Find and update the configuration with image support information
                     try:
                         # Find configuration by API URL and model
-                        config_to_update = None
-                        for config in config_manager.get_all_configurations():
-                            if (config['apiUrl'] == api_url and 
-                                config.get('model') == model):
-                                config_to_update = config
-                                break
+                        config_to_update = find_configuration(api_url, model)
                         
                         # Update the configuration with image support info
                         if config_to_update and image_support_result is not None:
                             config_manager.update_image_support(config_to_update['id'], image_support_result)
-                            print(f"✅ Updated configuration '{config_to_update['name']}' with image support: {image_support_result}")
+                            health_log.info('✅ Updated image support', config=config_to_update['name'],
+                                            supports_images=image_support_result)
                         elif config_to_update:
-                            print(f"⚠️ Configuration '{config_to_update['name']}' found but image support test result is None")
+                            health_log.warning('⚠️ Image support test result is None', config=config_to_update['name'])
                         else:
-                            print(f"⚠️ No configuration found matching API URL: {api_url} and model: {model}")
+                            health_log.info('⚠️ No configuration matches the tested endpoint', api_url=api_url, model=model)
                             
                     except Exception as e:
-                        print(f"🚨 Error updating configuration with image support: {str(e)}")
+                        health_log.error('🚨 Error updating configuration with image support', error=str(e))
                     
-                    return jsonify({
+                    return {
                         'health_status': 'healthy',
                         'status_code': response.status_code,
                         'test_response': response_content_clean,
                         'message': 'API is responding correctly - health check passed',
                         'supports_images': image_support_result,
                         'image_test_error': image_support_error
-                    })
+                    }, 200
                 else:
-                    return jsonify({
+                    return {
                         'health_status': 'unhealthy',
                         'status_code': response.status_code,
                         'test_response': response_content_clean,
                         'error': f'API returned unexpected response. Expected: "{expected_response}", Got: "{response_content_clean}"',
                         'message': 'API is responding but not following system instructions correctly'
-                    }), 502
+                    }, 502
                 
             except json.JSONDecodeError:
-                print(f"❌ Failed to parse JSON response")
-                return jsonify({
+                health_log.warning('❌ Failed to parse JSON response', api_url=api_url)
+                return {
                     'health_status': 'unhealthy',
                     'status_code': response.status_code,
                     'error': 'API returned non-JSON response',
                     'response_text': response.text[:500]
-                }), 502
+                }, 502
         else:
-            print(f"❌ API request failed with status {response.status_code}")
-            print(f"Error response: {response.text[:500]}")
-            return jsonify({
+            health_log.warning('❌ API request failed', api_url=api_url, status=response.status_code,
+                               body=response.text[:500])
+            return {
                 'health_status': 'unhealthy',
                 'status_code': response.status_code,
                 'error': f'API request failed with status {response.status_code}',
                 'response_text': response.text[:500]
-            }), 502
+            }, 502
         
     except requests.RequestException as e:
-        print(f"🚨 Request Exception: {str(e)}")
-        return jsonify({
+        health_log.warning('🚨 Request exception', api_url=api_url, error=str(e))
+        return {
             'health_status': 'unhealthy',
             'error': f'Request failed: {str(e)}',
             'error_type': 'connection_error'
-        }), 503
+        }, 503
     except Exception as e:
-        print(f"🚨 External API test error: {str(e)}")
-        return jsonify({
+        health_log.error('🚨 External API test error', exc_info=True, error=str(e))
+        return {
             'health_status': 'unhealthy',
             'error': str(e),
             'error_type': 'internal_error'
-        }), 500
+        }, 500
 
 
 def test_image_support(api_url, api_key, model):
@@ -357,7 +894,6 @@ def test_image_support(api_url, api_key, model):
         # This is a base64 encoded 1x1 transparent PNG (67 bytes)
         minimal_image = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
         image_url = f'data:image/png;base64,{minimal_image}'
-        print(f"📸 Using minimal test image (1x1 PNG, {len(minimal_image)} bytes base64)")
         
         # Test payload with image content
         test_payload = {
@@ -377,123 +913,133 @@ def test_image_support(api_url, api_key, model):
         if model:
             test_payload['model'] = model
         
-        print(f"📸 Testing image support for model: {model or 'default'}")
-        print(f"📤 Sending image test request to: {api_url}")
+        health_log.debug('📸 Sending image test request', api_url=api_url, model=model)
         
         # Make test request with longer timeout
-        response = requests.post(api_url, headers=headers, json=test_payload, timeout=30)
-        
-        print(f"📥 Image test response status: {response.status_code}")
+        response = upstream_pool.post(api_url, headers=headers, json=test_payload, timeout=30)
         
         if response.status_code == 200:
-            print("✅ Image support test passed - model supports images")
+            health_log.info('✅ Image support test passed', api_url=api_url, model=model)
             return True
         else:
             # Check if the error is related to image support
             error_text = response.text.lower()
             if 'image' in error_text or 'content' in error_text or 'multimodal' in error_text:
-                print(f"❌ Image support test failed - model does not support images: {response.text[:200]}")
+                health_log.info('❌ Model does not support images', api_url=api_url, model=model,
+                                status=response.status_code, body=response.text[:200])
                 return False
             else:
-                print(f"⚠️ Image support test inconclusive - unexpected error: {response.text[:200]}")
+                health_log.warning('⚠️ Image support test inconclusive', api_url=api_url, model=model,
+                                   status=response.status_code, body=response.text[:200])
                 # If it's an unexpected error, we re-raise it
                 raise Exception(f"Unexpected error during image support test: {response.text[:200]}")
                 
     except requests.RequestException as e:
-        print(f"🚨 Network error during image support test: {str(e)}")
+        health_log.warning('🚨 Network error during image support test', api_url=api_url, error=str(e))
         raise e
     except Exception as e:
-        print(f"🚨 Error during image support test: {str(e)}")
+        health_log.warning('🚨 Error during image support test', api_url=api_url, error=str(e))
         raise e
 
 
-def stream_response(response, stream_id):
-    """Generator function to stream response chunks to frontend"""
-    print(f"🔄 Starting streaming response with ID: {stream_id}")
+def stream_response(response, stream_id, passthrough=False, on_complete=None, timer=None):
+    """Generator function to stream response chunks to frontend
+
+    Yields delta content strings, or in passthrough mode the raw upstream
+    event bytes (including the final [DONE] event) without decoding JSON.
+    `on_complete` is called once the upstream reply has been read to the
+    end, i.e. not after a cancellation or error. `timer` (a StreamTimer)
+    records time-to-first-token, inter-token gaps and the stream's outcome.
+    """
+    stream_log.info('🔄 Starting streaming response', stream_id=stream_id, passthrough=passthrough)
+    # Decided once per stream, so the per-token path costs nothing when tracing is off
+    trace = stream_log.is_enabled_for(logging.DEBUG)
+    cancelled = False
+    errored = False
     
     try:
-        for line in response.iter_lines(decode_unicode=True):
+        for event in iter_response_events(response):
             # Check if this stream has been cancelled
-            if stream_id not in active_streams or active_streams[stream_id].get('cancelled', False):
-                print(f"🛑 Stream {stream_id} cancelled by user")
+            if is_stream_cancelled(stream_id):
+                stream_log.info('🛑 Stream cancelled by user', stream_id=stream_id)
+                cancelled = True
                 break
-                
-            if line and line.startswith('data: '):
-                data_part = line[6:]  # Remove 'data: ' prefix
-                if data_part.strip() == '[DONE]':
+            
+            if passthrough:
+                if timer and not event.is_done:
+                    timer.token()
+                yield event.raw
+                if event.is_done:
                     break
-                try:
-                    chunk_data = json.loads(data_part)
-                    
-                    # Check for choices and content
-                    if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                        delta = chunk_data['choices'][0].get('delta', {})
-                        if 'content' in delta and delta['content'] is not None:
-                            content = delta['content']
-                            print(f"📤 Streaming content: {content}")
-                            yield content
-                            
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON decode error: {e}")
-                    continue
+                continue
+                
+            if event.is_done:
+                break
+            try:
+                # Per token: with msgspec this decodes only the delta content
+                content = json_codec.delta_content(event.data_bytes)
+                if content is not None:
+                    if trace:
+                        stream_log.debug('📤 Streaming content', stream_id=stream_id, content=content)
+                    if timer:
+                        timer.token()
+                    yield content
+                        
+            except json_codec.DecodeError as e:
+                stream_log.warning('❌ JSON decode error', stream_id=stream_id, error=str(e))
+                continue
                     
-        print(f"✅ Streaming complete for ID: {stream_id}")
+        stream_log.info('✅ Streaming complete', stream_id=stream_id, cancelled=cancelled)
+        if on_complete and not cancelled:
+            on_complete()
         
     except Exception as e:
-        print(f"🚨 Streaming error for ID {stream_id}: {e}")
+        errored = True
+        stream_log.error('🚨 Streaming error', stream_id=stream_id, error=str(e))
         yield f"Error: {str(e)}"
     finally:
-        # Clean up the stream from active_streams
-        if stream_id in active_streams:
-            del active_streams[stream_id]
+        # Clean up the stream from the registry
+        release_stream(stream_id)
+        if timer:
+            timer.finish(cancelled=cancelled, error=errored)
 
 
 def handle_streaming_response(response):
     """Handle streaming response"""
-    print(f"🔄 Handling streaming response...")
     
     full_content = ""
     error_content = ""
-    line_count = 0
+    event_count = 0
     
-    for line in response.iter_lines(decode_unicode=True):
-        line_count += 1
-        print(f"📄 Line {line_count}: {line[:200]}..." if line and len(line) > 200 else f"📄 Line {line_count}: {line or 'None'}")
+    for event in iter_response_events(response):
+        event_count += 1
+        data_part = event.data
         
-        if line and line.startswith('data: '):
-            data_part = line[6:]  # Remove 'data: ' prefix
-            if data_part.strip() == '[DONE]':
-                break
-            try:
-                chunk_data = json.loads(data_part)
-                print(f"📊 Parsed chunk: {chunk_data}")
-                
-                # Check for errors in the chunk
-                if 'error' in chunk_data and chunk_data['error'] is not None:
-                    error_content += str(chunk_data['error'])
-                    print(f"❌ Error in chunk: {chunk_data['error']}")
-                
-                # Check for choices and content
-                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                    delta = chunk_data['choices'][0].get('delta', {})
-                    if 'content' in delta and delta['content'] is not None:
-                        full_content += delta['content']
-                        print(f"✅ Added content: {delta['content']}")
-                        
-            except json.JSONDecodeError as e:
-                print(f"❌ JSON decode error: {e}")
-                print(f"❌ Raw data: {data_part}")
-                # If it's not JSON, treat as plain text error
-                if data_part is not None:
-                    error_content += data_part
-                continue
+        if event.is_done:
+            break
+        try:
+            chunk_data = json_codec.loads(data_part)
+            # Check for errors in the chunk
+            if 'error' in chunk_data and chunk_data['error'] is not None:
+                error_content += str(chunk_data['error'])
+                upstream_log.warning('❌ Error in chunk', error=chunk_data['error'])
+            
+            # Check for choices and content
+            content = extract_delta_content(chunk_data)
+            if content is not None:
+                full_content += content
+                    
+        except json_codec.DecodeError as e:
+            upstream_log.warning('❌ JSON decode error', error=str(e), data=data_part)
+            # If it's not JSON, treat as plain text error
+            error_content += data_part
+            continue
     
-    print(f"✅ Streaming complete! Full response length: {len(full_content)}")
-    print(f"✅ Full response: {full_content}")
+    upstream_log.info('✅ Buffered streaming response', events=event_count, length=len(full_content))
     
     # If we have error content and no regular content, return error
     if error_content and not full_content:
-        print(f"❌ Returning error response: {error_content}")
+        upstream_log.warning('❌ Returning error response', error=error_content)
         return jsonify({
             'error': 'API returned error in streaming response',
             'details': error_content
@@ -510,10 +1056,16 @@ def handle_streaming_response(response):
     })
 
 
-def handle_json_response(response):
+def handle_json_response(response, recorder=None):
     """Handle JSON response"""
     try:
         response_data = response.json()
+        if recorder:
+            try:
+                recorder.add(response_data['choices'][0]['message']['content'] or '')
+            except (KeyError, IndexError, TypeError):
+                pass
+            recorder.finish()
         return jsonify(response_data)
     except json.JSONDecodeError:
         return jsonify({
@@ -525,11 +1077,127 @@ def handle_json_response(response):
 # Simplified configurations routes using ConfigurationManager
 @api_blueprint.route('/api/configurations', methods=['GET'])
 def get_configurations():
+    timing = start_stage_timer('configurations.list')
     configs = config_manager.get_all_configurations()
-    return jsonify(configs)
+    timing.mark('load')
+    # Attach the monitor's cached health; listing never waits on a probe
+    with_health = []
+    for config in configs:
+        health = health_monitor.summary(config['id'])
+        with_health.append(dict(config, health=health) if health else config)
+    timing.mark('health')
+    return jsonify(with_health)
+
+@api_blueprint.route('/api/configurations/health', methods=['GET'])
+def check_all_configurations():
+    """Probe every stored configuration concurrently, streaming each result as it finishes
+
+    Results are NDJSON lines, or SSE `data:` frames ending in [DONE] when
+    `?format=sse` is given or the client accepts text/event-stream. Each
+    line is a `result`; the last one is a `summary`. `?concurrency=` caps
+    simultaneous probes (at most HEALTH_FANOUT_MAX) and `?deadline=`
+    bounds each probe in seconds.
+    """
+    try:
+        concurrency = int(request.args.get('concurrency', os.environ.get('HEALTH_FANOUT_CONCURRENCY', '8')))
+        deadline = float(request.args.get('deadline', os.environ.get('HEALTH_PROBE_DEADLINE', '45')))
+        if concurrency < 1 or deadline <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'concurrency must be a positive integer and deadline a positive number'}), 400
+    concurrency = min(concurrency, health_monitor.max_fanout)
+
+    use_sse = request.args.get('format') == 'sse' or (
+        request.args.get('format') is None and request.accept_mimetypes.best == 'text/event-stream')
+    configs = config_manager.get_all_configurations()
+    health_log.info('🩺 Checking configurations', count=len(configs), concurrency=concurrency, deadline=deadline)
+
+    def encode(item):
+        line = json_codec.dumps(item)
+        return f'data: {line}\n\n' if use_sse else f'{line}\n'
+
+    def generate():
+        started = datetime.now()
+        healthy = timed_out = 0
+        for config, result in health_monitor.check_many(configs, concurrency=concurrency, deadline=deadline):
+            healthy += bool(result.get('healthy'))
+            timed_out += bool(result.get('timed_out'))
+            yield encode({
+                'type': 'result',
+                'id': config['id'],
+                'name': config['name'],
+                'health_status': 'healthy' if result.get('healthy') else 'unhealthy',
+                'status_code': result.get('status_code'),
+                'supports_images': result.get('supports_images'),
+                'error': result.get('error'),
+                'timed_out': bool(result.get('timed_out')),
+                'latency_ms': result.get('latency_ms'),
+                'checked_at': result.get('checked_at')
+            })
+        yield encode({
+            'type': 'summary',
+            'total': len(configs),
+            'healthy': healthy,
+            'unhealthy': len(configs) - healthy,
+            'timed_out': timed_out,
+            'elapsed_ms': round((datetime.now() - started).total_seconds() * 1000, 1)
+        })
+        if use_sse:
+            yield DONE_EVENT
+
+    return Response(generate(), mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache'})
+
+@api_blueprint.route('/api/configurations/<config_id>/health', methods=['GET'])
+def get_configuration_health(config_id):
+    """Cached health summary and rolling probe history; `?force=1` probes now"""
+    timing = start_stage_timer('configurations.health')
+    config = config_manager.get_configuration(config_id)
+    timing.mark('load')
+    if not config:
+        return jsonify({'error': 'Configuration not found'}), 404
+    if request.args.get('force') in ('1', 'true'):
+        health_monitor.check(config, check_images=True)
+        timing.mark('probe')
+    history = [
+        {key: value for key, value in result.items() if key != 'response'}
+        for result in health_monitor.history(config_id)
+    ]
+    return jsonify({'id': config_id, 'health': health_monitor.summary(config_id), 'history': history})
+
+def enqueue_image_probe(config):
+    """Queue an image support test for a saved configuration and return the job's id and status.
+
+    The result is stored with ConfigurationManager.update_image_support
+    when the probe finishes, unless the configuration has since been
+    deleted or pointed at a different endpoint or model.
+    """
+    manager = config_manager
+    config_id = config['id']
+    api_url, api_key, model = config['apiUrl'], config.get('apiKey', ''), config.get('model', '')
+
+    def apply_result(supports_images):
+        current = manager.get_configuration(config_id)
+        if not current or current['apiUrl'] != api_url or current.get('model', '') != model:
+            health_log.info('⏭️ Discarding image support result for changed configuration', config_id=config_id)
+            return
+        manager.update_image_support(config_id, supports_images)
+
+    job = job_queue.submit('image_support', test_image_support, api_url, api_key, model,
+                           key=('image_support', config_id), on_complete=apply_result)
+    return {'id': job['id'], 'status': job['status']}
+
+@api_blueprint.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job: pending, running, succeeded, failed or superseded"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 @api_blueprint.route('/api/configurations', methods=['POST'])
 def create_configuration():
+    timing = start_stage_timer('configurations.create')
     data = request.get_json()
     
     # Validate required fields
@@ -538,24 +1206,22 @@ def create_configuration():
     if not data.get('apiUrl'):
         return jsonify({'error': 'Missing required field: apiUrl'}), 400
     
+    if 'settings' in data and not isinstance(data['settings'], dict):
+        return jsonify({'error': 'settings must be an object'}), 400
+    
     name = data['name']
     api_url = data['apiUrl']
     api_key = data.get('apiKey', '')
     model = data.get('model', '')
+    settings = data.get('settings')
+    timing.mark('validate')
     
     try:
-        new_config = config_manager.create_configuration(name, api_url, api_key, model)
-        # Test image support
-        try:
-            supports_images = test_image_support(api_url, api_key, model)
-            config_manager.update_image_support(new_config['id'], supports_images)
-            new_config['supportsImages'] = supports_images
-            new_config['imageTestAt'] = datetime.now().isoformat()
-        except Exception as e:
-            print(f"⚠️ Image support test failed: {str(e)}")
-            new_config['supportsImages'] = None
-            new_config['imageTestAt'] = None
-        
+        new_config = config_manager.create_configuration(name, api_url, api_key, model, settings)
+        timing.mark('store')
+        # Test image support in the background; the client polls the job
+        new_config['imageTestJob'] = enqueue_image_probe(new_config)
+        timing.mark('enqueue_probe')
         return jsonify(new_config), 201
     except ValueError as e:
         return jsonify({'error': str(e)}), 409
@@ -564,24 +1230,22 @@ def create_configuration():
 
 @api_blueprint.route('/api/configurations/<config_id>', methods=['PUT'])
 def update_configuration(config_id):
+    timing = start_stage_timer('configurations.update')
     data = request.get_json()
+    if 'settings' in data and not isinstance(data['settings'], dict):
+        return jsonify({'error': 'settings must be an object'}), 400
     name = data['name']
     api_url = data['apiUrl']
     api_key = data.get('apiKey', '')
     model = data.get('model', '')
+    settings = data.get('settings')
+    timing.mark('validate')
     try:
-        updated_config = config_manager.update_configuration(config_id, name, api_url, api_key, model)
-        # Test image support
-        try:
-            supports_images = test_image_support(api_url, api_key, model)
-            config_manager.update_image_support(config_id, supports_images)
-            updated_config['supportsImages'] = supports_images
-            updated_config['imageTestAt'] = datetime.now().isoformat()
-        except Exception as e:
-            print(f"⚠️ Image support test failed: {str(e)}")
-            updated_config['supportsImages'] = None
-            updated_config['imageTestAt'] = None
-        
+        updated_config = config_manager.update_configuration(config_id, name, api_url, api_key, model, settings)
+        timing.mark('store')
+        # Test image support in the background; the client polls the job
+        updated_config = dict(updated_config, imageTestJob=enqueue_image_probe(updated_config))
+        timing.mark('enqueue_probe')
         return jsonify(updated_config)
     except ValueError as e:
         return jsonify({'error': str(e)}), 409
@@ -590,8 +1254,10 @@ def update_configuration(config_id):
 
 @api_blueprint.route('/api/configurations/<config_id>', methods=['DELETE'])
 def delete_configuration(config_id):
+    timing = start_stage_timer('configurations.delete')
     try:
         config_manager.delete_configuration(config_id)
+        timing.mark('store')
         return jsonify({'message': 'Configuration deleted successfully'})
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
@@ -600,8 +1266,10 @@ def delete_configuration(config_id):
 
 @api_blueprint.route('/api/configurations/<config_id>/activate', methods=['POST'])
 def activate_configuration(config_id):
+    timing = start_stage_timer('configurations.activate')
     try:
         activated_config = config_manager.activate_configuration(config_id)
+        timing.mark('store')
         return jsonify(activated_config)
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
@@ -610,7 +1278,9 @@ def activate_configuration(config_id):
 
 @api_blueprint.route('/api/configurations/active', methods=['GET'])
 def get_active_configuration():
+    timing = start_stage_timer('configurations.active')
     active_config = config_manager.get_active_configuration()
+    timing.mark('load')
     if active_config:
         return jsonify(active_config)
     return jsonify({'error': 'No active configuration found'}), 404
@@ -625,17 +1295,100 @@ def stop_stream():
         if not stream_id:
             return jsonify({'error': 'Missing stream_id'}), 400
         
-        if stream_id in active_streams:
-            active_streams[stream_id]['cancelled'] = True
-            print(f"🛑 Stream {stream_id} marked for cancellation")
+        # The stream may be relayed by another worker process
+        if stream_registry.cancel(stream_id):
+            stream_log.info('🛑 Stream marked for cancellation', stream_id=stream_id)
             return jsonify({'message': 'Stream stopped successfully'})
         else:
             return jsonify({'error': 'Stream not found or already completed'}), 404
             
     except Exception as e:
-        print(f"🚨 Error stopping stream: {str(e)}")
+        stream_log.error('🚨 Error stopping stream', error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@api_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Chat proxy metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api_blueprint.route('/api/conversations', methods=['POST'])
+def create_conversation():
+    """Create a server-side conversation, optionally seeded with existing messages"""
+    data = request.get_json(silent=True) or {}
+    messages = data.get('messages', [])
+    if not isinstance(messages, list):
+        return jsonify({'error': 'messages must be a list'}), 400
+    try:
+        conversation_id = conversation_store.create(messages)
+        return jsonify({
+            'id': conversation_id,
+            'messages': conversation_store.get_messages(conversation_id)
+        }), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_blueprint.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    messages = conversation_store.get_messages(conversation_id)
+    if messages is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    return jsonify({'id': conversation_id, 'messages': messages})
+
+@api_blueprint.route('/api/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    try:
+        conversation_store.delete(conversation_id)
+        context_assembler.summarizer.discard(conversation_id)
+        return jsonify({'message': 'Conversation deleted successfully'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_blueprint.route('/api/images', methods=['POST'])
+def upload_image():
+    """Store an image by content hash; accepts a multipart `file` or JSON `{'url': <data URL>}`"""
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            blob_hash, created = blob_store.put(upload.read(), upload.mimetype or '')
+        else:
+            data = request.get_json(silent=True) or {}
+            blob_hash, created = blob_store.put_data_url(data.get('url'))
+        info = blob_store.info(blob_hash) or {'hash': blob_hash}
+        return jsonify(dict(info, deduplicated=not created)), 201 if created else 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_blueprint.route('/api/images/<blob_hash>', methods=['GET'])
+def get_image(blob_hash):
+    if request.method == 'HEAD':
+        # Existence check used by the frontend before uploading
+        info = blob_store.info(blob_hash)
+        if info is None:
+            return jsonify({'error': 'Image not found'}), 404
+        return Response(mimetype=info['mime'], headers={'Content-Length': str(info['size'])})
+    blob = blob_store.get(blob_hash)
+    if blob is None:
+        return jsonify({'error': 'Image not found'}), 404
+    data, mime = blob
+    response = Response(data, mimetype=mime)
+    # Content-addressed: the bytes behind a hash never change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(blob_hash)
+    return response.make_conditional(request)
+
+@api_blueprint.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    """Connection pool hit/miss statistics for upstream endpoints, and hedging per configuration"""
+    return jsonify({
+        'sync': upstream_pool.get_stats(),
+        'async': async_upstream_pool.get_stats(),
+        'hedging': hedger.get_stats()
+    })
+
 @api_blueprint.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Backend is running'})
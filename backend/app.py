@@ -1,7 +1,12 @@
+import os
 from server import create_app
 
 
 if __name__ == '__main__':
     app = create_app()
+    # With the debug reloader only the serving child process runs the monitor
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from api import health_monitor
+        health_monitor.start()
     print("Starting Michael's Chat server on http://localhost:8000")
     app.run(host='0.0.0.0', port=8000, debug=True)
@@ -0,0 +1,372 @@
+"""
+ASGI entry point with an asyncio-based streaming path for /api/chat
+
+POST /api/chat is served by an async handler that talks to the upstream
+model with httpx, so a long-lived stream costs a coroutine instead of a
+worker thread. Every other route (configurations, health checks,
+/api/chat/stop, the React build) falls through to the Flask app.
+
+Upstream clients come from api.async_upstream_pool, keyed by endpoint.
+
+Run with:  uvicorn asgi:app --app-dir backend --port 8000
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+import api
+import json_codec
+from server import create_app
+from sse import aiter_response_events, format_text_frame, format_delta_event, DONE_EVENT
+from stream_coalescer import coalesce_settings, acoalesce_deltas
+from hedging import hedge_settings
+from response_cache import cache_settings, cache_key, areplay_chunks
+from metrics import StreamTimer, chat_labels
+from stage_timing import StageTimer
+
+
+async def astream_response(response, stream_id, passthrough=False, on_complete=None, timer=None):
+    """Async counterpart of api.stream_response for httpx streaming responses"""
+    api.stream_log.info('🔄 Starting async streaming response', stream_id=stream_id, passthrough=passthrough)
+    trace = api.stream_log.is_enabled_for(logging.DEBUG)
+    cancelled = False
+    errored = False
+
+    try:
+        async for event in aiter_response_events(response):
+            # Check if this stream has been cancelled
+            if api.is_stream_cancelled(stream_id):
+                api.stream_log.info('🛑 Stream cancelled by user', stream_id=stream_id)
+                cancelled = True
+                break
+
+            if passthrough:
+                if timer and not event.is_done:
+                    timer.token()
+                yield event.raw
+                if event.is_done:
+                    break
+                continue
+
+            if event.is_done:
+                break
+            try:
+                content = json_codec.delta_content(event.data_bytes)
+                if content is not None:
+                    if trace:
+                        api.stream_log.debug('📤 Streaming content', stream_id=stream_id, content=content)
+                    if timer:
+                        timer.token()
+                    yield content
+            except json_codec.DecodeError as e:
+                api.stream_log.warning('❌ JSON decode error', stream_id=stream_id, error=str(e))
+                continue
+
+        api.stream_log.info('✅ Streaming complete', stream_id=stream_id, cancelled=cancelled)
+        if on_complete and not cancelled:
+            on_complete()
+
+    except Exception as e:
+        errored = True
+        api.stream_log.error('🚨 Streaming error', stream_id=stream_id, error=str(e))
+        yield f"Error: {str(e)}"
+    finally:
+        api.release_stream(stream_id)
+        if timer:
+            timer.finish(cancelled=cancelled, error=errored)
+
+
+class AsyncChatApp:
+    """ASGI application routing /api/chat to an asyncio handler and everything else to Flask"""
+
+    def __init__(self, flask_app=None, pool=None):
+        self.flask_app = flask_app or create_app()
+        self.wsgi = WsgiToAsgi(self.flask_app)
+        self.pool = pool or api.async_upstream_pool
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/api/chat' and scope['method'] == 'POST':
+            await self.chat(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                api.health_monitor.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                api.health_monitor.stop()
+                await self.pool.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def chat(self, scope, receive, send):
+        """Async equivalent of api.chat_proxy"""
+        loop = asyncio.get_running_loop()
+        timing = StageTimer('chat', api.span_exporter)
+        labels = chat_labels(None, None)
+        entry = None
+        response = None
+        try:
+            try:
+                body = await read_body(receive)
+                data = json_codec.loads(body) if body else None
+                timing.mark('parse')
+                # Stored configurations are read from disk or a database
+                config = await loop.run_in_executor(None, api.resolve_configuration, data or {})
+                labels = chat_labels(data, config)
+                timing.attributes.update(labels)
+                # Blob reads happen off the event loop
+                await loop.run_in_executor(None, api.resolve_request_images, data)
+                api.record_chat_request(data, labels, len(body))
+                timing.mark('resolve')
+                image_stats = await api.anormalize_request_images(data, config)
+                timing.mark('images')
+                extra_headers = []
+                if image_stats:
+                    api.metrics.inc('chat_image_bytes_saved_total', image_stats['bytes_saved'], **labels)
+                    extra_headers.append((api.IMAGE_BYTES_SAVED_HEADER.lower().encode('ascii'), str(image_stats['bytes_saved']).encode('ascii')))
+                # History lookups, token counting and history image normalization are blocking work
+                api_url, headers, payload = await loop.run_in_executor(None, api.prepare_chat_request, data, config)
+                coalescing = coalesce_settings(data, config)
+                timing.mark('build')
+
+                # Identical requests can be answered from the response cache
+                caching = cache_settings(data, config)
+                key = cache_key(api_url, data.get('api_key'), payload) if caching else None
+                cached = await loop.run_in_executor(None, api.response_cache.get, key) if key else None
+                if key:
+                    timing.mark('cache')
+                    extra_headers.append((api.CACHE_STATUS_HEADER.lower().encode('ascii'), b'HIT' if cached is not None else b'MISS'))
+
+                if cached is None:
+                    connect_started = time.perf_counter()
+                    entry = await self.pool.acquire(api_url)
+                    body = json_codec.dumps_bytes(payload)
+
+                    def send_upstream():
+                        request = entry.client.build_request('POST', api_url, headers=headers, content=body)
+                        return entry.client.send(request, stream=True)
+
+                    # A hedged request shares the endpoint's client; the loser's connection is closed
+                    hedging = hedge_settings(data, config)
+                    if hedging:
+                        response = await api.hedger.asend(send_upstream, labels['config_id'] or api_url, hedging, labels)
+                    else:
+                        response = await send_upstream()
+                    api.metrics.observe('chat_upstream_connect_seconds', time.perf_counter() - connect_started, **labels)
+                    timing.mark('upstream')
+
+                    content_type = response.headers.get('content-type', '')
+                    api.upstream_log.info('📥 Upstream response', status=response.status_code, content_type=content_type)
+
+                    if response.status_code != 200:
+                        api.metrics.inc('chat_errors_total', kind='upstream_status', **labels)
+                        error_text = (await response.aread()).decode('utf-8', errors='replace')
+                        api.upstream_log.warning('❌ API request failed', status=response.status_code, body=error_text[:500])
+                        await send_json(send, {
+                            'error': f'API request failed with status {response.status_code}',
+                            'details': error_text
+                        }, response.status_code, timing=timing)
+                        return
+                # Appending the user turn may load the conversation from disk
+                recorder = await loop.run_in_executor(None, api.start_conversation_turn, data)
+
+                if cached is None and 'text/event-stream' not in content_type:
+                    # Handle regular JSON response
+                    raw = await response.aread()
+                    api.metrics.inc('chat_response_bytes_total', len(raw), **labels)
+                    timing.mark('response')
+                    try:
+                        response_data = json_codec.loads(raw)
+                        if recorder:
+                            try:
+                                recorder.add(response_data['choices'][0]['message']['content'] or '')
+                            except (KeyError, IndexError, TypeError):
+                                pass
+                            recorder.finish()
+                        await send_json(send, response_data, extra_headers=extra_headers, timing=timing)
+                    except json_codec.DecodeError:
+                        await send_json(send, {
+                            'error': 'Failed to parse API response',
+                            'details': raw.decode('utf-8', errors='replace')[:500]
+                        }, 500, timing=timing)
+                    return
+
+            except api.ChatRequestError as e:
+                api.metrics.inc('chat_errors_total', kind='bad_request', **labels)
+                await send_json(send, e.body, e.status_code, timing=timing)
+                return
+            except httpx.HTTPError as e:
+                api.metrics.inc('chat_errors_total', kind='upstream_connection', **labels)
+                api.upstream_log.error('🚨 Request exception', error=str(e))
+                await send_json(send, {'error': f'Request failed: {str(e)}'}, 500, timing=timing)
+                return
+            except Exception as e:
+                api.metrics.inc('chat_errors_total', kind='internal', **labels)
+                api.request_log.error('🚨 Internal server error', exc_info=True, error=str(e))
+                await send_json(send, {'error': f'Internal server error: {str(e)}'}, 500, timing=timing)
+                return
+
+            # Response headers go out from here on, so errors are reported in-stream
+            passthrough = data.get('stream_mode') == 'passthrough'
+            if cached is not None:
+                api.request_log.info('💾 Response cache hit', key=key[:12])
+                await self.relay_stream(
+                    receive, send,
+                    lambda stream_id: areplay_cached_response(cached, stream_id, passthrough, caching['pace_ms']),
+                    recorder=recorder,
+                    extra_headers=extra_headers,
+                    cache_hit=True,
+                    labels=labels,
+                    timing=timing
+                )
+                return
+
+            def make_chunks(stream_id):
+                outcome = {}
+                chunks = astream_response(response, stream_id, passthrough=passthrough,
+                                          on_complete=lambda: outcome.update(completed=True),
+                                          timer=StreamTimer(api.metrics, labels, timing.started, stages=timing))
+                if coalescing:
+                    chunks = acoalesce_deltas(chunks, **coalescing)
+                if key:
+                    chunks = acache_on_completion(chunks, key, caching['ttl'], outcome)
+                return chunks
+
+            await self.relay_stream(receive, send, make_chunks, recorder=recorder, extra_headers=extra_headers,
+                                    labels=labels, timing=timing)
+        finally:
+            if response is not None:
+                await response.aclose()
+            # The endpoint's client stays checked out until the stream is fully relayed
+            if entry is not None:
+                self.pool.release(entry)
+
+    async def relay_stream(self, receive, send, make_chunks, recorder=None, extra_headers=(), cache_hit=False,
+                           labels=None, timing=None):
+        """Relay chunks from make_chunks(stream_id) as SSE frames, stream ID first, until done or cancelled
+
+        A StageTimer's stages are sent as a final `event: timing` frame, like api.sse_stream does.
+        """
+        stream_id = api.register_stream(labels)
+        sent = 0
+        # A client disconnect cancels the stream just like /api/chat/stop does
+        watcher = asyncio.ensure_future(watch_disconnect(receive, stream_id))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'access-control-allow-origin', b'*'),
+                    *extra_headers,
+                ]
+            })
+            sent += await send_chunk(send, api.stream_id_frame(stream_id, cache_hit))
+            async for chunk in make_chunks(stream_id):
+                if recorder:
+                    recorder.add(chunk)
+                if isinstance(chunk, bytes):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    sent += len(chunk)
+                else:
+                    sent += await send_chunk(send, format_text_frame(chunk))
+            if timing:
+                timing.mark('stream')
+                sent += await send_chunk(send, timing.metadata_event())
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if recorder:
+                recorder.finish()
+            if timing:
+                timing.attributes['http.status_code'] = 200
+                timing.finish()
+            watcher.cancel()
+            api.release_stream(stream_id)
+            if labels is not None:
+                api.metrics.inc('chat_response_bytes_total', sent, **labels)
+
+
+async def areplay_cached_response(content, stream_id, passthrough=False, pace_ms=0):
+    """Async counterpart of api.replay_cached_response"""
+    api.stream_log.info('💾 Replaying cached response', stream_id=stream_id)
+    try:
+        async for piece in areplay_chunks(content, pace_ms):
+            if api.is_stream_cancelled(stream_id):
+                api.stream_log.info('🛑 Stream cancelled by user', stream_id=stream_id)
+                return
+            yield format_delta_event(piece) if passthrough else piece
+        if passthrough:
+            yield DONE_EVENT
+    finally:
+        api.release_stream(stream_id)
+
+
+async def acache_on_completion(chunks, key, ttl, outcome):
+    """Async counterpart of api.cache_on_completion; the cache write runs off the event loop"""
+    relayed = []
+    async for chunk in chunks:
+        relayed.append(chunk)
+        yield chunk
+    if outcome.get('completed'):
+        await asyncio.get_running_loop().run_in_executor(
+            None, api.response_cache.set, key, api.relayed_content(relayed), ttl)
+
+
+async def read_body(receive):
+    """Read the full request body from the ASGI receive channel"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def watch_disconnect(receive, stream_id):
+    """Mark a stream as cancelled once the client goes away"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            api.stream_registry.cancel(stream_id)
+            return
+
+
+async def send_chunk(send, text):
+    """Send text as a body chunk; returns the number of bytes sent"""
+    body = text.encode('utf-8')
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    return len(body)
+
+
+async def send_json(send, data, status=200, extra_headers=(), timing=None):
+    body = json_codec.dumps_bytes(data)
+    if timing:
+        timing.attributes['http.status_code'] = status
+        timing.finish()
+        extra_headers = [*extra_headers, (api.SERVER_TIMING_HEADER.lower().encode('ascii'), timing.server_timing().encode('ascii'))]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            (b'access-control-allow-origin', b'*'),
+            *extra_headers,
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = AsyncChatApp()
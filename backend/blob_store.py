@@ -0,0 +1,183 @@
+"""
+Content-addressed image blob store
+
+Uploaded images are stored once under the SHA-256 of their bytes, so the
+same screenshot pasted twice, or resent with every turn of a
+conversation, takes one upload and one file. Chat requests then refer to
+images by hash instead of carrying base64 data URLs.
+
+Blobs live in `<directory>/<hash[:2]>/<hash>.<ext>`, where the extension
+records the image type. Total size is bounded: once it passes
+`max_bytes`, the least recently used blobs are deleted. Access times are
+kept in memory and written back as file mtimes, so LRU order survives a
+restart.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from structured_logging import get_logger
+
+
+log = get_logger('storage')
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+MIME_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpeg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+}
+EXTENSION_MIMES = {ext: mime for mime, ext in MIME_EXTENSIONS.items()}
+
+DATA_URL_PATTERN = re.compile(r'^data:(?P<mime>[\w.+-]+/[\w.+-]+)(?:;[^,;]*)*;base64,', re.IGNORECASE)
+
+
+def decode_data_url(url):
+    """Split a base64 image data URL into (bytes, mime); raises ValueError if it is not one"""
+    match = DATA_URL_PATTERN.match(url or '')
+    if match is None:
+        raise ValueError('Expected a base64 data URL')
+    try:
+        data = base64.b64decode(url[match.end():], validate=True)
+    except ValueError:
+        raise ValueError('Invalid base64 image data')
+    return data, match.group('mime').lower()
+
+
+class BlobStore:
+    def __init__(self, directory='blobs', max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()  # hash -> (size, mime), least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get('BLOB_DIR', 'blobs'),
+            max_bytes=int(os.environ.get('BLOB_MAX_BYTES', str(512 * 1024 * 1024)))
+        )
+
+    @staticmethod
+    def is_valid_hash(blob_hash):
+        return isinstance(blob_hash, str) and bool(HASH_PATTERN.match(blob_hash))
+
+    def _path(self, blob_hash, mime):
+        return os.path.join(self.directory, blob_hash[:2], f'{blob_hash}.{MIME_EXTENSIONS[mime]}')
+
+    def _scan(self):
+        """Rebuild the index from disk, oldest mtime first"""
+        found = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    blob_hash, _, ext = name.partition('.')
+                    if not self.is_valid_hash(blob_hash) or ext not in EXTENSION_MIMES:
+                        continue
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, blob_hash, stat.st_size, EXTENSION_MIMES[ext]))
+        for _, blob_hash, size, mime in sorted(found):
+            self._index[blob_hash] = (size, mime)
+            self._total_bytes += size
+
+    def put(self, data, mime):
+        """Store image bytes and return (hash, created); identical content is stored once"""
+        mime = mime.lower()
+        if mime not in MIME_EXTENSIONS:
+            raise ValueError(f'Unsupported image type: {mime}')
+        if len(data) > self.max_bytes:
+            raise ValueError('Image is larger than the blob store')
+        blob_hash = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            if blob_hash in self._index:
+                self._touch(blob_hash)
+                return blob_hash, False
+
+        path = self._path(blob_hash, mime)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a unique name and rename so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            created = blob_hash not in self._index
+            if created:
+                self._index[blob_hash] = (len(data), mime)
+                self._total_bytes += len(data)
+            self._index.move_to_end(blob_hash)
+            self._evict()
+        return blob_hash, created
+
+    def put_data_url(self, url):
+        data, mime = decode_data_url(url)
+        return self.put(data, mime)
+
+    def get(self, blob_hash):
+        """Return (bytes, mime) for a blob, or None if unknown or evicted"""
+        if not self.is_valid_hash(blob_hash):
+            return None
+        with self._lock:
+            entry = self._index.get(blob_hash)
+            if entry is None:
+                return None
+            self._touch(blob_hash)
+        size, mime = entry
+        try:
+            with open(self._path(blob_hash, mime), 'rb') as f:
+                return f.read(), mime
+        except OSError:
+            with self._lock:
+                if self._index.pop(blob_hash, None) is not None:
+                    self._total_bytes -= size
+            return None
+
+    def info(self, blob_hash):
+        """Return {'hash', 'size', 'mime'} without reading the blob, or None"""
+        if not self.is_valid_hash(blob_hash):
+            return None
+        with self._lock:
+            entry = self._index.get(blob_hash)
+        if entry is None:
+            return None
+        return {'hash': blob_hash, 'size': entry[0], 'mime': entry[1]}
+
+    def data_url(self, blob_hash):
+        blob = self.get(blob_hash)
+        if blob is None:
+            return None
+        data, mime = blob
+        return f'data:{mime};base64,' + base64.b64encode(data).decode('ascii')
+
+    def _touch(self, blob_hash):
+        self._index.move_to_end(blob_hash)
+        size, mime = self._index[blob_hash]
+        try:
+            now = time.time()
+            os.utime(self._path(blob_hash, mime), (now, now))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            blob_hash, (size, mime) = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(blob_hash, mime))
+            except OSError:
+                pass
+            log.info('🗑️ Evicted image blob', blob=blob_hash[:12], bytes=size)
+
+    def get_stats(self):
+        with self._lock:
+            return {'blobs': len(self._index), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
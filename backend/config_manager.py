@@ -1,25 +1,49 @@
 """
 Configuration management module with file persistence
+
+Lookups are served from indexes kept in step with every mutation: a
+case-insensitive name index for duplicate checks, the active
+configuration's id, an (apiUrl, model) index for matching requests to
+stored configurations, and a creation-ordered list so listings need no
+sort. Code that replaces `configurations` wholesale must call
+`_rebuild_indexes()`.
+
+With a shared backend (CONFIG_STORAGE=sqlite) several worker processes
+each hold a manager. Every public method first applies the changes the
+others have committed (`_refresh`), which costs a single pragma query
+when nothing changed. Public methods hold the manager's lock for the
+whole call, so `_refresh` and the index updates of concurrent request
+threads never interleave.
+
+Name and active checks against the local copy can still race another
+process, so the SQLite backend repeats them inside its write
+transaction. A write that loses raises ConfigurationConflict (a
+ValueError), and the manager reloads the stored state.
 """
-import json
-import os
+import bisect
+import threading
 import uuid
 from datetime import datetime
+from config_storage import ConfigurationConflict, storage_from_env
 
 
 class ConfigurationManager:
-    def __init__(self, config_file='configurations.json'):
+    def __init__(self, config_file='configurations.json', storage=None):
         self.config_file = config_file
+        # Snapshot file (default) or snapshot plus journal, see config_storage
+        self.storage = storage or storage_from_env(config_file)
+        # Held across _refresh and every index mutation (reentrant, see module docstring)
+        self._lock = threading.RLock()
         self.configurations = {}
+        self._rebuild_indexes()
         self.load_configurations()
     
     def load_configurations(self):
         """Load configurations from file"""
-        try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r') as f:
-                    data = json.load(f)
-                    
+        with self._lock:
+            try:
+                data = self.storage.load()
+                if data is not None:
                     # Handle list format (convert to dictionary)
                     if isinstance(data, list):
                         self.configurations = {}
@@ -27,7 +51,7 @@ class ConfigurationManager:
                             # Convert to internal format
                             config_id = config.get('id', str(uuid.uuid4()))
                             now = datetime.now().isoformat()
-                            
+                        
                             internal_config = {
                                 'id': config_id,
                                 'name': config['name'],
@@ -40,149 +64,264 @@ class ConfigurationManager:
                                 'createdAt': config.get('createdAt', now),
                                 'updatedAt': config.get('updatedAt', now)
                             }
-                            
+                        
                             self.configurations[config_id] = internal_config
-                    
+                
                     # Handle dictionary format (already in internal format)
                     elif isinstance(data, dict):
                         self.configurations = data
-                    
+                
                     else:
                         self.configurations = {}
-                        
-                print(f"✅ Loaded {len(self.configurations)} configurations from {self.config_file}")
-            else:
-                print(f"📄 No configuration file found at {self.config_file}, starting with empty configurations")
-        except Exception as e:
-            print(f"⚠️ Error loading configurations: {e}")
-            self.configurations = {}
+                    
+                    replayed = self.storage.replay(self.configurations)
+                    print(f"✅ Loaded {len(self.configurations)} configurations from {self.config_file}"
+                          + (f" (+{replayed} journal records)" if replayed else ""))
+                elif self.storage.replay(self.configurations):
+                    # Journal written before the first snapshot
+                    print(f"✅ Loaded {len(self.configurations)} configurations from the journal of {self.config_file}")
+                else:
+                    print(f"📄 No configuration file found at {self.config_file}, starting with empty configurations")
+            except Exception as e:
+                print(f"⚠️ Error loading configurations: {e}")
+                self.configurations = {}
+            self._rebuild_indexes()
     
     def save_configurations(self):
-        """Save configurations to file"""
+        """Save a full snapshot of the configurations to file"""
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.configurations, f, indent=2)
+            self.storage.save(self.configurations)
             print(f"💾 Saved {len(self.configurations)} configurations to {self.config_file}")
         except Exception as e:
             print(f"❌ Error saving configurations: {e}")
     
+    def _persist(self, changed=(), deleted=()):
+        """Persist a mutation of the given configuration ids (journal append or snapshot)"""
+        try:
+            self.storage.write(self.configurations, changed, deleted)
+        except ConfigurationConflict:
+            # Another process committed first: drop the local change and take the stored state
+            self.load_configurations()
+            raise
+        except Exception as e:
+            print(f"❌ Error saving configurations: {e}")
+    
+    def _refresh(self):
+        """Apply configurations other processes changed in shared storage"""
+        try:
+            changes = self.storage.poll()
+        except Exception as e:
+            print(f"⚠️ Error checking for configuration changes: {e}")
+            return
+        for config_id, config in changes:
+            current = self.configurations.get(config_id)
+            if current is not None:
+                self._unindex(current)
+            if config is None:
+                self.configurations.pop(config_id, None)
+            else:
+                self.configurations[config_id] = config
+                self._index(config)
+    
+    def _rebuild_indexes(self):
+        self._by_name = {}
+        self._by_endpoint = {}
+        self._ordered = []  # (createdAt, -insertion seq, id), ascending
+        self._order_keys = {}
+        self._active_ids = {}  # Normally just one; older files may mark several active
+        self._seq = 0
+        self._listing = None  # Cached newest-first list, dropped on any index change
+        for config in self.configurations.values():
+            self._index(config)
+    
+    @staticmethod
+    def _endpoint_key(config):
+        return (config.get('apiUrl'), config.get('model') or '')
+    
+    def _index(self, config):
+        config_id = config['id']
+        self._listing = None
+        self._seq += 1
+        # Newest first, ties in insertion order (as the stable sort used to give)
+        order_key = (config['createdAt'], -self._seq, config_id)
+        self._order_keys[config_id] = order_key
+        bisect.insort(self._ordered, order_key)
+        self._by_name[config['name'].lower()] = config_id
+        endpoint = self._by_endpoint.setdefault(self._endpoint_key(config), [])
+        bisect.insort(endpoint, order_key)
+        if config.get('isActive'):
+            self._active_ids[config_id] = True
+    
+    def _unindex(self, config):
+        config_id = config['id']
+        self._listing = None
+        order_key = self._order_keys.pop(config_id)
+        self._remove_sorted(self._ordered, order_key)
+        if self._by_name.get(config['name'].lower()) == config_id:
+            del self._by_name[config['name'].lower()]
+        endpoint_key = self._endpoint_key(config)
+        endpoint = self._by_endpoint[endpoint_key]
+        self._remove_sorted(endpoint, order_key)
+        if not endpoint:
+            del self._by_endpoint[endpoint_key]
+        self._active_ids.pop(config_id, None)
+    
+    @staticmethod
+    def _remove_sorted(items, item):
+        index = bisect.bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            del items[index]
+    
     def get_all_configurations(self):
         """Get all configurations sorted by creation date"""
-        config_list = list(self.configurations.values())
-        config_list.sort(key=lambda x: x['createdAt'], reverse=True)
-        return config_list
+        with self._lock:
+            self._refresh()
+            if self._listing is None:
+                self._listing = [self.configurations[key[2]] for key in reversed(self._ordered)]
+            return list(self._listing)
     
     def get_configuration(self, config_id):
         """Get a specific configuration by ID"""
-        return self.configurations.get(config_id)
+        with self._lock:
+            self._refresh()
+            return self.configurations.get(config_id)
+    
+    def find_by_endpoint(self, api_url, model):
+        """Get the newest configuration for an API URL and model"""
+        with self._lock:
+            self._refresh()
+            endpoint = self._by_endpoint.get((api_url, model or ''))
+            return self.configurations[endpoint[-1][2]] if endpoint else None
     
-    def create_configuration(self, name, api_url, api_key='', model=''):
+    def create_configuration(self, name, api_url, api_key='', model='', settings=None):
         """Create a new configuration"""
-        # Check if name already exists
-        for config in self.configurations.values():
-            if config['name'].lower() == name.lower():
+        with self._lock:
+            self._refresh()
+            # Check if name already exists
+            if name.lower() in self._by_name:
                 raise ValueError('Configuration with this name already exists')
         
-        # Create new configuration
-        config_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-        
-        # If this is the first configuration, make it active
-        is_first_config = len(self.configurations) == 0
-        
-        new_config = {
-            'id': config_id,
-            'name': name,
-            'apiUrl': api_url,
-            'apiKey': api_key,
-            'model': model,
-            'isActive': is_first_config,
-            'supportsImages': None,  # Will be tested later
-            'imageTestAt': None,
-            'createdAt': now,
-            'updatedAt': now
-        }
-        
-        self.configurations[config_id] = new_config
-        self.save_configurations()
-        
-        return new_config
-    
-    def update_configuration(self, config_id, name, api_url, api_key='', model=''):
-        """Update an existing configuration"""
-        if config_id not in self.configurations:
-            raise ValueError('Configuration not found')
-        
-        # Check if name already exists (excluding current config)
-        for cid, config in self.configurations.items():
-            if cid != config_id and config['name'].lower() == name.lower():
+            # Create new configuration
+            config_id = str(uuid.uuid4())
+            now = datetime.now().isoformat()
+        
+            # If this is the first configuration, make it active
+            is_first_config = len(self.configurations) == 0
+        
+            new_config = {
+                'id': config_id,
+                'name': name,
+                'apiUrl': api_url,
+                'apiKey': api_key,
+                'model': model,
+                'isActive': is_first_config,
+                'supportsImages': None,  # Will be tested later
+                'imageTestAt': None,
+                'settings': settings or {},  # Per-configuration proxy tuning
+                'createdAt': now,
+                'updatedAt': now
+            }
+        
+            self.configurations[config_id] = new_config
+            self._index(new_config)
+            self._persist(changed=[config_id])
+        
+            return new_config
+    
+    def update_configuration(self, config_id, name, api_url, api_key='', model='', settings=None):
+        """Update an existing configuration (settings are kept when None)"""
+        with self._lock:
+            self._refresh()
+            if config_id not in self.configurations:
+                raise ValueError('Configuration not found')
+        
+            # Check if name already exists (excluding current config)
+            if self._by_name.get(name.lower(), config_id) != config_id:
                 raise ValueError('Configuration with this name already exists')
         
-        # Update configuration
-        config = self.configurations[config_id]
-        config['name'] = name
-        config['apiUrl'] = api_url
-        config['apiKey'] = api_key
-        config['model'] = model
-        config['updatedAt'] = datetime.now().isoformat()
+            # Update configuration
+            config = self.configurations[config_id]
+            self._unindex(config)
+            config['name'] = name
+            config['apiUrl'] = api_url
+            config['apiKey'] = api_key
+            config['model'] = model
+            if settings is not None:
+                config['settings'] = settings
+            config['updatedAt'] = datetime.now().isoformat()
+            self._index(config)
         
-        self.save_configurations()
-        return config
+            self._persist(changed=[config_id])
+            return config
     
     def delete_configuration(self, config_id):
         """Delete a configuration"""
-        if config_id not in self.configurations:
-            raise ValueError('Configuration not found')
+        with self._lock:
+            self._refresh()
+            if config_id not in self.configurations:
+                raise ValueError('Configuration not found')
         
-        config = self.configurations[config_id]
-        was_active = config['isActive']
+            config = self.configurations[config_id]
+            was_active = config['isActive']
         
-        # Delete the configuration
-        del self.configurations[config_id]
+            # Delete the configuration
+            self._unindex(config)
+            del self.configurations[config_id]
         
-        # If the deleted config was active, make another one active
-        if was_active and self.configurations:
-            # Make the first remaining configuration active
-            next_config = next(iter(self.configurations.values()))
-            next_config['isActive'] = True
-            next_config['updatedAt'] = datetime.now().isoformat()
+            # If the deleted config was active, make another one active
+            changed = []
+            if was_active and self.configurations:
+                # Make the first remaining configuration active
+                next_config = next(iter(self.configurations.values()))
+                next_config['isActive'] = True
+                next_config['updatedAt'] = datetime.now().isoformat()
+                self._active_ids[next_config['id']] = True
+                changed.append(next_config['id'])
         
-        self.save_configurations()
-        return config
+            self._persist(changed=changed, deleted=[config_id])
+            return config
     
     def activate_configuration(self, config_id):
         """Set a configuration as active"""
-        if config_id not in self.configurations:
-            raise ValueError('Configuration not found')
+        with self._lock:
+            self._refresh()
+            if config_id not in self.configurations:
+                raise ValueError('Configuration not found')
         
-        # Deactivate all configurations
-        for config in self.configurations.values():
-            config['isActive'] = False
+            # Deactivate the currently active configuration(s)
+            changed = [config_id]
+            for cid in self._active_ids:
+                self.configurations[cid]['isActive'] = False
+                if cid != config_id:
+                    changed.append(cid)
         
-        # Activate the selected configuration
-        config = self.configurations[config_id]
-        config['isActive'] = True
-        config['updatedAt'] = datetime.now().isoformat()
+            # Activate the selected configuration
+            config = self.configurations[config_id]
+            config['isActive'] = True
+            config['updatedAt'] = datetime.now().isoformat()
+            self._active_ids = {config_id: True}
         
-        self.save_configurations()
-        return config
+            self._persist(changed=changed)
+            return config
     
     def get_active_configuration(self):
         """Get the currently active configuration"""
-        for config in self.configurations.values():
-            if config['isActive']:
-                return config
-        return None
+        with self._lock:
+            self._refresh()
+            active_id = next(iter(self._active_ids), None)
+            return self.configurations[active_id] if active_id else None
     
     def update_image_support(self, config_id, supports_images):
         """Update image support status for a configuration"""
-        if config_id not in self.configurations:
-            raise ValueError('Configuration not found')
+        with self._lock:
+            self._refresh()
+            if config_id not in self.configurations:
+                raise ValueError('Configuration not found')
         
-        config = self.configurations[config_id]
-        config['supportsImages'] = supports_images
-        config['imageTestAt'] = datetime.now().isoformat()
-        config['updatedAt'] = datetime.now().isoformat()
+            config = self.configurations[config_id]
+            config['supportsImages'] = supports_images
+            config['imageTestAt'] = datetime.now().isoformat()
+            config['updatedAt'] = datetime.now().isoformat()
         
-        self.save_configurations()
-        return config
+            self._persist(changed=[config_id])
+            return config
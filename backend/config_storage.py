@@ -0,0 +1,407 @@
+"""
+Persistence backends for ConfigurationManager
+
+The original store rewrote the whole pretty-printed configurations.json
+on every change, without fsync or an atomic rename. A crash mid-write
+could therefore lose every configuration. Both backends here write
+snapshots to a temporary file, fsync it, and rename it into place.
+
+`JsonFileStorage` (the default) still writes a full snapshot per change.
+`JournalStorage` (CONFIG_STORAGE=journal) appends one compact JSON line
+per changed configuration to `<file>.journal`. A frequent small
+mutation such as an image-support update then costs a single short
+append. Appends can be fsynced one by one, group-committed after a short
+debounce, or left to the OS. Every `compact_every` records the journal
+is folded into a fresh snapshot and truncated. Loading reads the
+snapshot and replays the journal. Journal records carry a full
+configuration, so replaying one that is already in the snapshot (for
+example after a crash between the two compaction steps) is harmless.
+
+`SqliteStorage` (CONFIG_STORAGE=sqlite) keeps one row per configuration
+in a SQLite database in WAL mode, so it can be shared by several worker
+processes. Readers never block each other or the writer, and writers are
+serialized by `BEGIN IMMEDIATE`. Every write transaction bumps a revision
+counter and stamps the rows it touches (deletes leave a tombstone).
+`poll()` first checks `PRAGMA data_version`, which only changes when
+another connection has committed, and then fetches just the rows with a
+newer revision. A worker can therefore pick up its siblings' changes
+without re-reading every configuration.
+
+The manager's own checks run against its in-memory copy, which another
+worker may have changed since. So the SQLite write transaction enforces
+the invariants itself. A unique index on the lower-cased name rejects
+duplicates, a tombstone stops a write from bringing back a configuration
+another worker deleted, and activating a configuration deactivates every
+other row. A write that loses such a race raises ConfigurationConflict.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+
+from structured_logging import get_logger
+
+log = get_logger('storage')
+
+
+class ConfigurationConflict(ValueError):
+    """A write contradicts a change another process committed first"""
+
+
+def write_atomic(path, text):
+    """Write text to path via a fsynced temporary file and an atomic rename"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(path)
+
+
+def _fsync_directory(path):
+    # Make the rename itself durable (not supported on every platform)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JsonFileStorage:
+    """Full JSON snapshot rewritten on every change"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the parsed snapshot, or None if there is none"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def replay(self, configurations):
+        """Apply changes recorded after the snapshot (none for this backend)"""
+        return 0
+
+    def save(self, configurations):
+        write_atomic(self.path, json.dumps(configurations, indent=2))
+
+    def write(self, configurations, changed=(), deleted=()):
+        """Persist a mutation of the given configuration ids"""
+        self.save(configurations)
+
+    def poll(self):
+        """Return (id, config or None) for changes made by other processes"""
+        return []
+
+    def flush(self):
+        pass
+
+
+class JournalStorage(JsonFileStorage):
+    """Snapshot plus an append-only journal of changed configurations"""
+
+    SYNC_MODES = ('always', 'batch', 'none')
+
+    def __init__(self, path, sync='batch', flush_interval=0.05, compact_every=500):
+        super().__init__(path)
+        if sync not in self.SYNC_MODES:
+            raise ValueError(f'Unknown journal sync mode: {sync}')
+        self.journal_path = f'{path}.journal'
+        self.sync = sync
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self._pending = []
+        self._records = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls, path):
+        return cls(
+            path,
+            sync=os.environ.get('CONFIG_JOURNAL_SYNC', 'batch'),
+            flush_interval=float(os.environ.get('CONFIG_JOURNAL_FLUSH_MS', '50')) / 1000.0,
+            compact_every=int(os.environ.get('CONFIG_JOURNAL_COMPACT_EVERY', '500'))
+        )
+
+    def replay(self, configurations):
+        """Apply journal records to the loaded snapshot; returns how many were applied"""
+        if not os.path.exists(self.journal_path):
+            return 0
+        applied = 0
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        # Every record ends with a newline, so bytes after the last one are a torn append
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            log.warning('⚠️ Truncating incomplete journal record', path=self.journal_path,
+                        size=len(data) - complete)
+            # Cut it off, or the next append would be glued onto it and lost as well
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(complete)
+                f.flush()
+                os.fsync(f.fileno())
+        for line in data[:complete].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                log.warning('⚠️ Ignoring unreadable journal record', path=self.journal_path)
+                continue
+            if record.get('op') == 'put':
+                configurations[record['id']] = record['config']
+            elif record.get('op') == 'delete':
+                configurations.pop(record['id'], None)
+            applied += 1
+        with self._lock:
+            self._records = applied
+        return applied
+
+    def save(self, configurations):
+        """Compact: write a fresh snapshot, then drop the journal it now contains"""
+        with self._lock:
+            self._pending = []
+            super().save(configurations)
+            with open(self.journal_path, 'w') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self._records = 0
+
+    def write(self, configurations, changed=(), deleted=()):
+        records = [{'op': 'put', 'id': cid, 'config': configurations[cid]} for cid in changed if cid in configurations]
+        records += [{'op': 'delete', 'id': cid} for cid in deleted]
+        lines = [json.dumps(record, separators=(',', ':')) + '\n' for record in records]
+        with self._lock:
+            self._pending.extend(lines)
+            self._records += len(lines)
+            compact = self._records >= self.compact_every
+            if not compact and self.sync == 'batch':
+                # Group commit: appends within the debounce window share one write and fsync
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        if compact:
+            self.save(configurations)
+        else:
+            self.flush()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.error('❌ Error appending to configuration journal', path=self.journal_path, error=str(e))
+
+    def flush(self):
+        """Append buffered records to the journal"""
+        with self._lock:
+            self._timer = None
+            if not self._pending:
+                return
+            lines, self._pending = self._pending, []
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(lines))
+                f.flush()
+                if self.sync != 'none':
+                    os.fsync(f.fileno())
+
+
+class SqliteStorage:
+    """One row per configuration in a WAL-mode SQLite database shared across processes"""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS configurations (id TEXT PRIMARY KEY, config TEXT NOT NULL, rev INTEGER NOT NULL, '
+        'name_key TEXT, active INTEGER NOT NULL DEFAULT 0)',
+        'CREATE INDEX IF NOT EXISTS configurations_rev ON configurations (rev)',
+        'CREATE TABLE IF NOT EXISTS tombstones (id TEXT PRIMARY KEY, rev INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('rev', 0)",
+    )
+
+    def __init__(self, path, json_path=None, busy_timeout=5.0):
+        self.path = path
+        # An existing JSON snapshot is imported once, into an empty database
+        self.json_path = json_path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._seen_rev = 0
+        self._import = None
+        self._lock = threading.Lock()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with _Transaction(conn):
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            if 'name_key' not in {row[1] for row in conn.execute('PRAGMA table_info(configurations)')}:
+                self._add_constraint_columns(conn)
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS configurations_name ON configurations (name_key)')
+
+    @staticmethod
+    def _add_constraint_columns(conn):
+        """Add and fill the name and active columns of a database created before they existed"""
+        conn.execute('ALTER TABLE configurations ADD COLUMN name_key TEXT')
+        conn.execute('ALTER TABLE configurations ADD COLUMN active INTEGER NOT NULL DEFAULT 0')
+        taken = set()
+        for config_id, config in conn.execute('SELECT id, config FROM configurations').fetchall():
+            config = json.loads(config)
+            name_key = config['name'].lower()
+            # A duplicate left by an earlier race keeps working, just without the constraint
+            conn.execute('UPDATE configurations SET name_key = ?, active = ? WHERE id = ?',
+                         (None if name_key in taken else name_key, int(bool(config.get('isActive'))), config_id))
+            taken.add(name_key)
+
+    @classmethod
+    def from_env(cls, path):
+        return cls(
+            os.environ.get('CONFIG_SQLITE_PATH') or f'{os.path.splitext(path)[0]}.db',
+            json_path=path,
+            busy_timeout=float(os.environ.get('CONFIG_SQLITE_BUSY_MS', '5000')) / 1000.0
+        )
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads, nor used on both sides of a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.data_version = None
+        return conn
+
+    def _current_rev(self, conn):
+        return conn.execute("SELECT value FROM meta WHERE key = 'rev'").fetchone()[0]
+
+    def load(self):
+        """Return all stored configurations, the JSON snapshot to import, or None"""
+        conn = self._connection()
+        self._local.data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with _Transaction(conn, immediate=False):
+            rev = self._current_rev(conn)
+            rows = conn.execute('SELECT id, config FROM configurations').fetchall()
+        with self._lock:
+            self._seen_rev = max(self._seen_rev, rev)
+        if rows:
+            return {config_id: json.loads(config) for config_id, config in rows}
+        if rev == 0 and self.json_path and os.path.exists(self.json_path):
+            with open(self.json_path, 'r') as f:
+                self._import = json.load(f)
+            return self._import
+        return None
+
+    def replay(self, configurations):
+        """Copy an imported JSON snapshot into the database once it has been converted"""
+        if self._import is None:
+            return 0
+        self._import = None
+        self.save(configurations)
+        log.info('📥 Imported configurations', count=len(configurations), path=self.path)
+        return 0
+
+    def save(self, configurations):
+        """Replace the stored configurations with the given ones"""
+        conn = self._connection()
+        with _Transaction(conn):
+            stored = {row[0] for row in conn.execute('SELECT id FROM configurations')}
+            self._write(conn, configurations, list(configurations), stored - set(configurations))
+
+    def write(self, configurations, changed=(), deleted=()):
+        """Persist a mutation of the given configuration ids in one transaction"""
+        conn = self._connection()
+        with _Transaction(conn):
+            self._write(conn, configurations, changed, deleted)
+
+    def _write(self, conn, configurations, changed, deleted):
+        changed = [cid for cid in changed if cid in configurations]
+        for cid in changed:
+            if conn.execute('SELECT 1 FROM tombstones WHERE id = ?', (cid,)).fetchone():
+                raise ConfigurationConflict('Configuration not found')
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'rev'")
+        rev = self._current_rev(conn)
+        conn.executemany('DELETE FROM configurations WHERE id = ?', [(cid,) for cid in deleted])
+        conn.executemany('INSERT OR REPLACE INTO tombstones (id, rev) VALUES (?, ?)', [(cid, rev) for cid in deleted])
+        try:
+            conn.executemany(
+                'INSERT INTO configurations (id, config, rev, name_key, active) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET config = excluded.config, rev = excluded.rev, '
+                'name_key = excluded.name_key, active = excluded.active',
+                [(cid, json.dumps(configurations[cid], separators=(',', ':')), rev,
+                  configurations[cid]['name'].lower(), int(bool(configurations[cid].get('isActive'))))
+                 for cid in changed]
+            )
+        except sqlite3.IntegrityError:
+            raise ConfigurationConflict('Configuration with this name already exists') from None
+        # One active configuration, whatever other workers activated since this one last looked
+        for cid in changed:
+            if configurations[cid].get('isActive'):
+                conn.execute(
+                    "UPDATE configurations SET active = 0, config = json_set(config, '$.isActive', json('false')), rev = ? "
+                    "WHERE active = 1 AND id != ?", (rev, cid)
+                )
+
+    def poll(self):
+        """Return (id, config or None) for rows committed since the last poll"""
+        conn = self._connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._local.data_version:
+            return []
+        self._local.data_version = data_version
+        with self._lock:
+            seen_rev = self._seen_rev
+        # Rows this process wrote itself come back too; applying them again is harmless
+        with _Transaction(conn, immediate=False):
+            rev = self._current_rev(conn)
+            rows = conn.execute('SELECT rev, id, config FROM configurations WHERE rev > ?', (seen_rev,)).fetchall()
+            rows += conn.execute('SELECT rev, id, NULL FROM tombstones WHERE rev > ?', (seen_rev,)).fetchall()
+        with self._lock:
+            self._seen_rev = max(self._seen_rev, rev)
+        rows.sort(key=lambda row: row[0])
+        return [(cid, json.loads(config) if config is not None else None) for _, cid, config in rows]
+
+    def flush(self):
+        pass
+
+
+class _Transaction:
+    """Explicit transaction; writers use BEGIN IMMEDIATE so they queue on the busy timeout"""
+
+    def __init__(self, conn, immediate=True):
+        self.conn = conn
+        self.immediate = immediate
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+
+def storage_from_env(path):
+    """Pick the persistence backend named by CONFIG_STORAGE (json, journal or sqlite)"""
+    kind = os.environ.get('CONFIG_STORAGE', 'json')
+    if kind == 'journal':
+        return JournalStorage.from_env(path)
+    if kind == 'sqlite':
+        return SqliteStorage.from_env(path)
+    if kind != 'json':
+        raise ValueError(f'Unknown CONFIG_STORAGE: {kind}')
+    return JsonFileStorage(path)
@@ -0,0 +1,222 @@
+"""
+Token-budgeted context assembly
+
+Long conversations eventually outgrow the model's context window, and
+every extra history message makes each turn slower. The assembler here
+trims the upstream messages array to a per-configuration token budget.
+The system prompt and the current turn are always kept. History is
+filled newest-first, and the oldest turns are either dropped or replaced
+by a running summary.
+
+Token counts are estimated and cached per message, so each turn only
+counts messages it has not seen before. Summaries are produced on a
+background thread and cached per conversation. Each refresh extends the
+previous summary with just the newly evicted turns, and a turn never
+waits on one: it uses the newest summary that is already available.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from request_errors import number_setting
+from structured_logging import get_logger
+
+
+log = get_logger('request')
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 765
+
+STRATEGIES = ('drop', 'summarize')
+
+SUMMARY_PREFIX = 'Summary of the earlier conversation:\n'
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token)"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def context_settings(data, config=None):
+    """Resolve the context budget from the request body, then the configuration.
+
+    Request fields `context_tokens` / `context_strategy` override the
+    configuration's `settings.contextTokens` / `settings.contextStrategy`.
+    Returns None when no budget is set, otherwise a dict with `budget`
+    and `strategy` ('drop' or 'summarize'). A non-numeric budget raises
+    ChatRequestError.
+    """
+    settings = (config or {}).get('settings') or {}
+    budget = data.get('context_tokens', settings.get('contextTokens'))
+    if not budget:
+        return None
+    strategy = data.get('context_strategy', settings.get('contextStrategy')) or 'drop'
+    if strategy not in STRATEGIES:
+        strategy = 'drop'
+    return {'budget': number_setting(budget, 'context_tokens', int), 'strategy': strategy}
+
+
+class TokenCounter:
+    """Per-message token counts with an LRU cache keyed by role and content
+
+    Stored conversation turns keep the same content string objects from
+    turn to turn, so cache lookups reuse the string's cached hash and an
+    already-counted message costs a dictionary lookup.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, message):
+        content = message.get('content')
+        if not isinstance(content, str):
+            # Multimodal content (the current turn, or history with stored images) is not cached
+            return MESSAGE_OVERHEAD_TOKENS + sum(
+                estimate_tokens(part.get('text')) if part.get('type') == 'text' else IMAGE_TOKENS
+                for part in content or []
+            )
+
+        key = (message.get('role'), content)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+
+        tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content)
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def get_stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+
+class HistorySummarizer:
+    """Background, incremental summaries of evicted history per conversation
+
+    A summary is stored as (covered, text): `text` summarizes the first
+    `covered` history messages. Refreshing to a larger `covered` only
+    sends the previous summary plus the messages after it.
+    """
+
+    def __init__(self, max_workers=2, max_entries=1000):
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self, key):
+        """Return the cached (covered, text) summary for a conversation, or None"""
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def request(self, key, history, covered, summarize):
+        """Schedule a refresh so the summary covers history[:covered].
+
+        `summarize(previous_summary, messages)` returns the new summary
+        text and runs on a worker thread. Returns the Future, or None if
+        the summary is already current or a refresh is in flight.
+        """
+        with self._lock:
+            current = self._summaries.get(key)
+            if key in self._inflight or (current is not None and current[0] >= covered):
+                return None
+            self._inflight.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='history-summary')
+            executor = self._executor
+        return executor.submit(self._refresh, key, list(history[:covered]), covered, summarize)
+
+    def _refresh(self, key, history, covered, summarize):
+        try:
+            previous = self.get(key)
+            start, previous_text = previous if previous is not None else (0, None)
+            text = summarize(previous_text, history[start:covered])
+            if text:
+                with self._lock:
+                    self._summaries[key] = (covered, text)
+                    self._summaries.move_to_end(key)
+                    while len(self._summaries) > self.max_entries:
+                        self._summaries.popitem(last=False)
+            return text
+        except Exception as e:
+            log.warning('⚠️ Error summarizing conversation', key=key, error=str(e))
+            return None
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._summaries.pop(key, None)
+
+
+class ContextAssembler:
+    def __init__(self, counter=None, summarizer=None):
+        self.counter = counter or TokenCounter()
+        self.summarizer = summarizer or HistorySummarizer()
+
+    def assemble(self, messages, budget, key=None, summarize=None):
+        """Fit an upstream messages array into `budget` tokens.
+
+        `messages` is [system, *history, current]. The newest history
+        messages that fit are kept. When `key` and `summarize` are given,
+        older messages are represented by the cached summary (if any) and
+        a background refresh is scheduled to cover the newly evicted ones.
+        Returns the messages to send, and the list unchanged if it fits.
+        """
+        if len(messages) <= 2:
+            return messages
+
+        system, history, current = messages[0], messages[1:-1], messages[-1]
+        counts = [self.counter.count(m) for m in history]
+        remaining = budget - self.counter.count(system) - self.counter.count(current)
+        if sum(counts) <= remaining:
+            return messages
+
+        summary_message = None
+        floor = 0
+        if key and summarize:
+            summary = self.summarizer.get(key)
+            if summary is not None and summary[0] <= len(history):
+                candidate = {'role': 'system', 'content': SUMMARY_PREFIX + summary[1]}
+                summary_tokens = self.counter.count(candidate)
+                if summary_tokens <= remaining:
+                    summary_message = candidate
+                    remaining -= summary_tokens
+                    floor = summary[0]
+
+        # Keep the newest messages that fit; messages before `floor` are already summarized
+        keep_from = len(history)
+        used = 0
+        while keep_from > floor and used + counts[keep_from - 1] <= remaining:
+            keep_from -= 1
+            used += counts[keep_from]
+
+        if key and summarize and keep_from > floor:
+            self.summarizer.request(key, history, keep_from, summarize)
+
+        assembled = [system]
+        if summary_message is not None:
+            assembled.append(summary_message)
+        assembled.extend(history[keep_from:])
+        assembled.append(current)
+        return assembled
@@ -0,0 +1,312 @@
+"""
+Server-side conversation store with write-behind persistence
+
+Conversations live under a conversation ID so the frontend only sends
+the new user turn instead of the whole history on every /api/chat call.
+Each conversation is an append-only JSON-lines file of turns in the same
+shape the frontend uses ({'sender', 'content', 'images', 'timestamp'}).
+
+Appends update the in-memory copy immediately and are written to disk
+by a background thread, so persistence never blocks a streaming response.
+
+Each worker process keeps its own cache, so a cached conversation is
+checked against its file's size before use: a file that grew (another
+worker appended) is reloaded, and a file that is gone (another worker
+deleted it) is dropped. Turns appended to a deleted conversation are
+discarded rather than recreating its file.
+"""
+import atexit
+import os
+import queue
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import json_codec
+from structured_logging import get_logger
+
+
+CONVERSATION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+log = get_logger('storage')
+
+
+def make_user_turn(message, images):
+    """Build the stored user turn; image payloads are reduced to metadata and blob hashes"""
+    turn = {'sender': 'user', 'content': message or '', 'timestamp': datetime.now().isoformat()}
+    if images:
+        turn['images'] = [
+            {key: img[key] for key in ('id', 'name', 'size', 'hash') if key in img}
+            for img in images
+        ]
+    return turn
+
+
+def sanitize_turn(turn):
+    """Reduce a frontend ChatMessage to the fields the store keeps"""
+    clean = {
+        'sender': turn.get('sender'),
+        'content': turn.get('content') or '',
+        'timestamp': turn.get('timestamp') or datetime.now().isoformat()
+    }
+    if turn.get('images'):
+        clean['images'] = make_user_turn('', turn['images'])['images']
+    return clean
+
+
+def make_ai_turn(content):
+    return {'sender': 'ai', 'content': content, 'timestamp': datetime.now().isoformat()}
+
+
+class AssistantRecorder:
+    """Accumulates streamed assistant text and stores it as one turn when finished
+
+    Passthrough streams hand over raw upstream event bytes; those are only
+    decoded (with decode_raw) once the stream ends, keeping JSON parsing
+    off the per-token path.
+    """
+
+    def __init__(self, store, conversation_id, decode_raw=None):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.decode_raw = decode_raw
+        self.parts = []
+        self.raw_parts = []
+        self.finished = False
+
+    def add(self, chunk):
+        if isinstance(chunk, bytes):
+            self.raw_parts.append(chunk)
+        else:
+            self.parts.append(chunk)
+
+    def finish(self):
+        """Queue the assistant turn; safe to call more than once"""
+        if self.finished:
+            return
+        self.finished = True
+        if self.raw_parts and self.decode_raw is not None:
+            self.parts.append(self.decode_raw(b''.join(self.raw_parts)))
+        content = ''.join(self.parts)
+        if content:
+            self.store.append(self.conversation_id, make_ai_turn(content))
+
+
+class ConversationStore:
+    def __init__(self, directory='conversations', max_cached=1000):
+        self.directory = directory
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        # File size each cached conversation had after its last load or write (None once unknown)
+        self._sizes = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_pid = None
+        atexit.register(self.flush)
+
+    def _path(self, conversation_id):
+        return os.path.join(self.directory, f'{conversation_id}.jsonl')
+
+    @staticmethod
+    def is_valid_id(conversation_id):
+        return isinstance(conversation_id, str) and bool(CONVERSATION_ID_PATTERN.match(conversation_id))
+
+    def create(self, messages=None):
+        """Create a conversation, optionally seeded with existing turns, and return its ID"""
+        conversation_id = uuid.uuid4().hex
+        with self._lock:
+            self._cache[conversation_id] = []
+            self._sizes[conversation_id] = 0
+        # Create the file first; later writes only ever append to an existing file
+        self._enqueue(conversation_id, None)
+        for turn in messages or []:
+            self.append(conversation_id, sanitize_turn(turn))
+        with self._lock:
+            self._trim_cache()
+        return conversation_id
+
+    def exists(self, conversation_id):
+        if not self.is_valid_id(conversation_id):
+            return False
+        with self._lock:
+            # Queued writes include the one creating the file
+            if self._pending.get(conversation_id):
+                return True
+        return os.path.exists(self._path(conversation_id))
+
+    def get_messages(self, conversation_id):
+        """Return a copy of the conversation's turns, or None if it does not exist"""
+        if not self.is_valid_id(conversation_id):
+            return None
+        with self._lock:
+            turns = self._cache.get(conversation_id)
+            pending = self._pending.get(conversation_id)
+            size = self._sizes.get(conversation_id)
+        # With writes still queued the cache is ahead of the file, so trust it
+        if turns is not None and (pending or (size is not None and self._file_size(conversation_id) == size)):
+            with self._lock:
+                if conversation_id in self._cache:
+                    self._cache.move_to_end(conversation_id)
+            return list(turns)
+
+        loaded = self._load(conversation_id)
+        with self._lock:
+            if self._pending.get(conversation_id) and conversation_id in self._cache:
+                # Another thread appended meanwhile; its turns are not on disk yet
+                return list(self._cache[conversation_id])
+            if loaded is None:
+                self._cache.pop(conversation_id, None)
+                self._sizes.pop(conversation_id, None)
+                return None
+            turns, size = loaded
+            self._cache[conversation_id] = turns
+            self._cache.move_to_end(conversation_id)
+            self._sizes[conversation_id] = size
+            self._trim_cache()
+            return list(turns)
+
+    def append(self, conversation_id, turn):
+        """Append a turn in memory now and on disk in the background
+
+        A turn for a conversation that no longer exists is dropped.
+        """
+        with self._lock:
+            turns = self._cache.get(conversation_id)
+            if turns is not None:
+                turns.append(turn)
+                self._cache.move_to_end(conversation_id)
+        if turns is None:
+            if self.get_messages(conversation_id) is None:
+                log.warning('⚠️ Dropping turn for a deleted conversation', conversation_id=conversation_id)
+                return
+            with self._lock:
+                self._cache.setdefault(conversation_id, []).append(turn)
+        self._enqueue(conversation_id, turn)
+
+    def recorder(self, conversation_id, decode_raw=None):
+        return AssistantRecorder(self, conversation_id, decode_raw)
+
+    def delete(self, conversation_id):
+        if not self.exists(conversation_id):
+            raise ValueError('Conversation not found')
+        # Let queued writes land first so the file is not recreated afterwards
+        self.flush()
+        with self._lock:
+            self._cache.pop(conversation_id, None)
+            self._sizes.pop(conversation_id, None)
+        path = self._path(conversation_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def flush(self):
+        """Block until every queued write has been persisted"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def _file_size(self, conversation_id):
+        try:
+            return os.stat(self._path(conversation_id)).st_size
+        except FileNotFoundError:
+            return None
+
+    def _load(self, conversation_id):
+        """Read a conversation file; returns (turns, bytes read) or None if there is no file"""
+        path = self._path(conversation_id)
+        turns = []
+        size = None
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        turns.append(json_codec.loads(line))
+                size = f.tell()
+        except FileNotFoundError:
+            return None
+        except (OSError, json_codec.DecodeError) as e:
+            log.warning('⚠️ Error loading conversation', conversation_id=conversation_id, error=str(e))
+        return turns, size
+
+    def _trim_cache(self):
+        # Only conversations without queued writes can be dropped and reloaded from disk
+        while len(self._cache) > self.max_cached:
+            victim = next((cid for cid in self._cache if not self._pending.get(cid)), None)
+            if victim is None:
+                break
+            del self._cache[victim]
+            self._sizes.pop(victim, None)
+
+    def _enqueue(self, conversation_id, turn):
+        with self._lock:
+            self._pending[conversation_id] = self._pending.get(conversation_id, 0) + 1
+        self._ensure_writer()
+        self._queue.put((conversation_id, turn))
+
+    def _ensure_writer(self):
+        # Started lazily (and restarted after fork) so worker processes each own one
+        if self._writer is None or self._writer_pid != os.getpid() or not self._writer.is_alive():
+            with self._lock:
+                if self._writer is None or self._writer_pid != os.getpid() or not self._writer.is_alive():
+                    self._writer_pid = os.getpid()
+                    self._writer = threading.Thread(target=self._write_loop, name='conversation-writer', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Group whatever else is already queued into the same batch of writes
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                log.error('❌ Error writing conversations', exc_info=True, error=str(e), turns=len(batch))
+            finally:
+                with self._lock:
+                    for conversation_id, _ in batch:
+                        self._pending[conversation_id] -= 1
+                        if not self._pending[conversation_id]:
+                            del self._pending[conversation_id]
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        lines_by_id = OrderedDict()
+        for conversation_id, turn in batch:
+            entry = lines_by_id.setdefault(conversation_id, {'create': False, 'lines': []})
+            if turn is None:
+                entry['create'] = True
+            else:
+                entry['lines'].append(json_codec.dumps_bytes(turn) + b'\n')
+        os.makedirs(self.directory, exist_ok=True)
+        for conversation_id, entry in lines_by_id.items():
+            # Only a create may make the file, so a deleted conversation stays deleted
+            flags = os.O_WRONLY | os.O_APPEND | (os.O_CREAT if entry['create'] else 0)
+            try:
+                fd = os.open(self._path(conversation_id), flags, 0o666)
+            except FileNotFoundError:
+                log.warning('⚠️ Dropping turns for a deleted conversation', conversation_id=conversation_id,
+                            turns=len(entry['lines']))
+                with self._lock:
+                    self._cache.pop(conversation_id, None)
+                    self._sizes.pop(conversation_id, None)
+                continue
+            with os.fdopen(fd, 'ab') as f:
+                start = os.fstat(fd).st_size
+                f.writelines(entry['lines'])
+            written = sum(len(line) for line in entry['lines'])
+            with self._lock:
+                # Anything else in the file means another process wrote to it too
+                if conversation_id not in self._cache:
+                    self._sizes.pop(conversation_id, None)
+                elif self._sizes.get(conversation_id) == start:
+                    self._sizes[conversation_id] = start + written
+                else:
+                    self._sizes[conversation_id] = None
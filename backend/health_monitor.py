@@ -0,0 +1,262 @@
+"""
+Background health monitoring of stored configurations
+
+A health probe (chat prompt plus image-support test) can block for tens
+of seconds, so running it on every "Test" click or page load is slow.
+The monitor probes every configuration on a background thread instead
+and keeps a rolling history per configuration. Endpoints answer from
+that cache and only probe synchronously when asked to.
+
+Probes are spread out with jitter. A configuration that keeps failing is
+retried with exponential backoff, so a dead endpoint is not hammered.
+
+`check_many` probes a whole fleet at once for the bulk health endpoint.
+Probes run concurrently up to a cap, and results are yielded as each one
+finishes. A checked fleet therefore takes about as long as its slowest
+probe, not the sum of all of them. Every call shares one bounded pool of
+`max_fanout` threads, so concurrent bulk checks (or a large client
+supplied cap) cannot start an unbounded number of threads.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from structured_logging import get_logger
+
+
+log = get_logger('health')
+
+DEFAULT_INTERVAL = 300
+DEFAULT_JITTER = 0.1
+DEFAULT_MAX_BACKOFF = 3600
+DEFAULT_HISTORY_SIZE = 20
+DEFAULT_FANOUT = 8
+DEFAULT_MAX_FANOUT = 32
+DEFAULT_PROBE_DEADLINE = 45
+
+
+class HealthMonitor:
+    def __init__(self, probe, list_targets, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 max_backoff=DEFAULT_MAX_BACKOFF, history_size=DEFAULT_HISTORY_SIZE, max_fanout=DEFAULT_MAX_FANOUT):
+        """`probe(target)` returns a result dict with at least `healthy`;
+        `list_targets()` returns the configurations to monitor (dicts with an `id`).
+        Explicit checks may pass keyword options through to `probe`."""
+        self.probe = probe
+        self.list_targets = list_targets
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.history_size = history_size
+        self.max_fanout = max_fanout
+        self._records = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._fanout_executor = None
+        self._fanout_pid = None
+
+    @classmethod
+    def from_env(cls, probe, list_targets):
+        return cls(
+            probe, list_targets,
+            interval=float(os.environ.get('HEALTH_CHECK_INTERVAL', str(DEFAULT_INTERVAL))),
+            max_backoff=float(os.environ.get('HEALTH_CHECK_MAX_BACKOFF', str(DEFAULT_MAX_BACKOFF))),
+            max_fanout=int(os.environ.get('HEALTH_FANOUT_MAX', str(DEFAULT_MAX_FANOUT)))
+        )
+
+    def start(self):
+        """Start the probe thread (no-op if already running in this process or interval is 0)"""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            self._thread.start()
+        log.info('🩺 Health monitor started', interval=self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def _delay(self, failures):
+        """Seconds until the next probe: the interval, doubled per consecutive failure, with jitter"""
+        delay = min(self.interval * (2 ** failures), max(self.max_backoff, self.interval))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                targets = {target['id']: target for target in self.list_targets()}
+            except Exception as e:
+                log.warning('⚠️ Health monitor could not list configurations', error=str(e))
+                targets = {}
+
+            now = time.monotonic()
+            with self._lock:
+                # Forget deleted configurations; schedule new ones with a random offset
+                for key in list(self._records):
+                    if key not in targets:
+                        del self._records[key]
+                for key in targets:
+                    if key not in self._records:
+                        self._records[key] = self._new_record(now + random.uniform(0, self.interval * self.jitter))
+                due = [key for key in targets if self._records[key]['next_due'] <= now]
+
+            for key in due:
+                if self._stop.is_set():
+                    return
+                self.check(targets[key])
+
+            with self._lock:
+                next_due = min((record['next_due'] for record in self._records.values()), default=None)
+            wait = self.interval if next_due is None else next_due - time.monotonic()
+            # Re-list at least once per interval so new configurations are picked up
+            self._stop.wait(max(1.0, min(wait, self.interval)))
+
+    def _new_record(self, next_due):
+        return {
+            'history': deque(maxlen=self.history_size),
+            'failures': 0,
+            'last_success': None,
+            'supports_images': None,
+            'next_due': next_due
+        }
+
+    def check(self, target, **options):
+        """Probe a configuration now, record the result and return it
+
+        `options` are passed to the probe; the background thread never sets any.
+        """
+        started = time.monotonic()
+        try:
+            result = dict(self.probe(target, **options))
+        except Exception as e:
+            result = {'healthy': False, 'error': str(e)}
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+        result['checked_at'] = datetime.now().isoformat()
+        self.record(target['id'], result)
+        return result
+
+    def check_many(self, targets, concurrency=DEFAULT_FANOUT, deadline=DEFAULT_PROBE_DEADLINE):
+        """Probe targets concurrently, yielding (target, result) in completion order.
+
+        At most `concurrency` probes of this call (never more than
+        `max_fanout`) are queued at once on the shared pool. A probe still
+        running `deadline` seconds after it started is reported as timed
+        out. It keeps its worker thread until the upstream call returns,
+        and its eventual result is still recorded in the history.
+        """
+        targets = list(targets)
+        if not targets:
+            return
+        concurrency = max(1, min(concurrency, self.max_fanout))
+        executor = self._get_fanout_executor()
+        queued = iter(range(len(targets)))
+        futures = {}
+        started = {}
+
+        def run(index):
+            started[index] = time.monotonic()
+            return self.check(targets[index])
+
+        def submit_next():
+            index = next(queued, None)
+            if index is not None:
+                future = executor.submit(run, index)
+                futures[future] = index
+                pending.add(future)
+
+        pending = set()
+        for _ in range(concurrency):
+            submit_next()
+        try:
+            while pending:
+                running = [started[futures[f]] for f in pending if futures[f] in started]
+                timeout = max(0.0, min(running) + deadline - time.monotonic()) if running else deadline
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                finished = [(targets[futures[future]], future.result()) for future in done]
+
+                now = time.monotonic()
+                for future in [f for f in pending if futures[f] in started and now - started[futures[f]] >= deadline]:
+                    pending.discard(future)
+                    finished.append((targets[futures[future]], {
+                        'healthy': False,
+                        'timed_out': True,
+                        'error': f'Probe exceeded {deadline:g}s deadline',
+                        'latency_ms': round((now - started[futures[future]]) * 1000, 1),
+                        'checked_at': datetime.now().isoformat()
+                    }))
+
+                # Refill before yielding so probes keep running while the caller writes results
+                for _ in finished:
+                    submit_next()
+                yield from finished
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _get_fanout_executor(self):
+        # Created lazily (and again after fork) so each worker process owns its threads
+        with self._lock:
+            if self._fanout_executor is None or self._fanout_pid != os.getpid():
+                self._fanout_executor = ThreadPoolExecutor(self.max_fanout, thread_name_prefix='health-fanout')
+                self._fanout_pid = os.getpid()
+            return self._fanout_executor
+
+    def record(self, key, result):
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                record = self._records[key] = self._new_record(0)
+            record['history'].append(result)
+            if result.get('healthy'):
+                record['failures'] = 0
+                record['last_success'] = result.get('checked_at')
+            else:
+                record['failures'] += 1
+            if result.get('supports_images') is not None:
+                record['supports_images'] = result['supports_images']
+            record['next_due'] = time.monotonic() + self._delay(record['failures'])
+
+    def latest(self, key, max_age=None):
+        """Return the most recent result, or None if there is none (or it is older than max_age seconds)"""
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or not record['history']:
+                return None
+            result = record['history'][-1]
+        if max_age is not None:
+            age = (datetime.now() - datetime.fromisoformat(result['checked_at'])).total_seconds()
+            if age > max_age:
+                return None
+        return result
+
+    def summary(self, key):
+        """Compact health view for configuration listings, or None if never probed"""
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or not record['history']:
+                return None
+            latest = record['history'][-1]
+            latencies = [r['latency_ms'] for r in record['history'] if r.get('healthy')]
+            return {
+                'status': 'healthy' if latest.get('healthy') else 'unhealthy',
+                'checked_at': latest.get('checked_at'),
+                'latency_ms': latest.get('latency_ms'),
+                'avg_latency_ms': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                'last_success': record['last_success'],
+                'consecutive_failures': record['failures'],
+                'supports_images': record['supports_images']
+            }
+
+    def history(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return list(record['history']) if record is not None else []
@@ -0,0 +1,378 @@
+"""
+Hedged upstream requests for endpoints with a long tail before the first token
+
+With hedging on for a configuration (`settings.hedge`, or `hedge` in the
+chat request), the upstream request is sent as usual. If its first SSE
+event has not arrived after the hedge delay, an identical second request
+is sent. Whichever produces a first event wins. The other is cancelled
+and its connection closed, so its pool slot is freed straight away.
+
+- Delay: the configuration's observed p95 time to first event
+  (HEDGE_PERCENTILE) over its last HEDGE_WINDOW requests, but at least
+  HEDGE_MIN_DELAY_MS. Until HEDGE_MIN_SAMPLES requests have been seen,
+  `settings.hedgeDelayMs` / `hedge_delay_ms` (default
+  HEDGE_DEFAULT_DELAY_MS) is used instead.
+- Budget: at most HEDGE_MAX_RATE (default 0.1) of a configuration's
+  recent requests are hedged, so a slow upstream does not get twice its
+  load.
+- Errors are not retried. A failed attempt never beats one that is still
+  pending, but when the first request fails before the delay the failure
+  is returned as before.
+
+The bytes the winner read while racing are replayed before the rest of
+its body, so the stream relays exactly as if it had not been hedged.
+Per-configuration hedge and win rates are served by /api/upstream/stats.
+"""
+import asyncio
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from request_errors import number_setting
+from sse import READ_CHUNK_SIZE, SSEParser, iter_response_chunks
+from structured_logging import get_logger
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_WINDOW = 200
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_MIN_DELAY_MS = 50
+DEFAULT_INITIAL_DELAY_MS = 1000
+DEFAULT_MAX_RATE = 0.1
+
+log = get_logger('upstream')
+
+
+def hedge_settings(data, config=None):
+    """Resolve hedging from the request body, then the configuration.
+
+    Request fields `hedge` / `hedge_delay_ms` override the configuration's
+    `settings.hedge` / `settings.hedgeDelayMs`. Returns None when hedging
+    is off, otherwise a dict with `initial_delay_ms` (the delay used until
+    enough first-event times have been observed, or None for the default).
+    A non-numeric delay raises ChatRequestError.
+    """
+    settings = (config or {}).get('settings') or {}
+    if not data.get('hedge', settings.get('hedge')):
+        return None
+    initial_delay_ms = data.get('hedge_delay_ms', settings.get('hedgeDelayMs'))
+    return {'initial_delay_ms': number_setting(initial_delay_ms, 'hedge_delay_ms') if initial_delay_ms else None}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)]
+
+
+def is_event_stream(response):
+    return response.status_code == 200 and 'text/event-stream' in response.headers.get('content-type', '')
+
+
+class PrefetchedResponse:
+    """A streaming response whose first chunks were read while racing
+
+    `iter_content` (requests) or `aiter_bytes` (httpx) replays those chunks
+    and then continues the same body iterator. Everything else is the
+    wrapped response's.
+    """
+
+    # Readers must go through iter_content, which replays the prefetched chunks first
+    raw = None
+
+    def __init__(self, response, chunks, rest):
+        self._response = response
+        self._chunks = chunks
+        self._rest = rest
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        yield from self._chunks
+        yield from self._rest
+
+    async def aiter_bytes(self, chunk_size=None):
+        for chunk in self._chunks:
+            yield chunk
+        async for chunk in self._rest:
+            yield chunk
+
+
+class _Attempt:
+    def __init__(self, hedge):
+        self.hedge = hedge
+        self.started = time.perf_counter()
+        self.first_event_at = None
+        self.response = None
+        self.error = None
+        self.chunks = []
+        self.rest = None
+        self.cancelled = False
+
+    @property
+    def usable(self):
+        return self.error is None and self.response is not None and self.response.status_code == 200
+
+    def read_first_event(self, chunks):
+        """Read body chunks until the parser completes an event, keeping the iterator for the rest"""
+        parser = SSEParser()
+        for chunk in chunks:
+            self.chunks.append(chunk)
+            if parser.feed(chunk):
+                break
+        self.rest = chunks
+
+    async def aread_first_event(self, chunks):
+        parser = SSEParser()
+        async for chunk in chunks:
+            self.chunks.append(chunk)
+            if parser.feed(chunk):
+                break
+        self.rest = chunks
+
+    def result(self):
+        if self.rest is not None:
+            return PrefetchedResponse(self.response, self.chunks, self.rest)
+        return self.response
+
+
+class _Record:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # Seconds from sending the first request to its first event
+        self.recent = deque(maxlen=window)  # Whether each recent request was hedged
+        self.recent_hedged = 0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+
+class Hedger:
+    def __init__(self, metrics=None, pct=DEFAULT_PERCENTILE, window=DEFAULT_WINDOW,
+                 min_samples=DEFAULT_MIN_SAMPLES, min_delay_ms=DEFAULT_MIN_DELAY_MS,
+                 initial_delay_ms=DEFAULT_INITIAL_DELAY_MS, max_rate=DEFAULT_MAX_RATE):
+        self.metrics = metrics
+        self.pct = pct
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay_ms = min_delay_ms
+        self.initial_delay_ms = initial_delay_ms
+        self.max_rate = max_rate
+        self._records = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        return cls(
+            metrics,
+            pct=float(os.environ.get('HEDGE_PERCENTILE', str(DEFAULT_PERCENTILE))),
+            window=int(os.environ.get('HEDGE_WINDOW', str(DEFAULT_WINDOW))),
+            min_samples=int(os.environ.get('HEDGE_MIN_SAMPLES', str(DEFAULT_MIN_SAMPLES))),
+            min_delay_ms=float(os.environ.get('HEDGE_MIN_DELAY_MS', str(DEFAULT_MIN_DELAY_MS))),
+            initial_delay_ms=float(os.environ.get('HEDGE_DEFAULT_DELAY_MS', str(DEFAULT_INITIAL_DELAY_MS))),
+            max_rate=float(os.environ.get('HEDGE_MAX_RATE', str(DEFAULT_MAX_RATE)))
+        )
+
+    def _record(self, key):
+        record = self._records.get(key)
+        if record is None:
+            with self._lock:
+                record = self._records.setdefault(key, _Record(self.window))
+        return record
+
+    def delay(self, key, settings):
+        """Seconds to wait for the first event before hedging a request for `key`"""
+        record = self._record(key)
+        with self._lock:
+            samples = list(record.samples)
+        if len(samples) < self.min_samples:
+            return (settings.get('initial_delay_ms') or self.initial_delay_ms) / 1000
+        return max(self.min_delay_ms / 1000, percentile(samples, self.pct))
+
+    def _may_hedge(self, record):
+        with self._lock:
+            return record.recent_hedged < max(1.0, self.max_rate * len(record.recent))
+
+    def _finish(self, key, attempts, winner, labels):
+        """Cancel the losers and record the outcome; returns the attempts to close"""
+        primary = attempts[0]
+        hedged = len(attempts) > 1
+        losers = [attempt for attempt in attempts if attempt is not winner]
+        for attempt in losers:
+            attempt.cancelled = True
+        if primary.usable and primary.first_event_at is not None:
+            sample = primary.first_event_at - primary.started
+        elif primary.error is None and primary.first_event_at is None and primary in losers:
+            # Cancelled before its first event: the elapsed time is a lower bound of its latency
+            sample = time.perf_counter() - primary.started
+        else:
+            sample = None
+
+        record = self._record(key)
+        with self._lock:
+            if sample is not None:
+                record.samples.append(sample)
+            if len(record.recent) == record.recent.maxlen and record.recent[0]:
+                record.recent_hedged -= 1
+            record.recent.append(hedged)
+            record.recent_hedged += hedged
+            record.requests += 1
+            record.hedged += hedged
+            record.hedge_wins += bool(winner is not None and winner.hedge)
+
+        if self.metrics is not None:
+            self.metrics.inc('chat_hedge_requests_total', **labels)
+            if hedged:
+                self.metrics.inc('chat_hedges_total', **labels)
+                if winner is not None and winner.hedge:
+                    self.metrics.inc('chat_hedge_wins_total', **labels)
+        if hedged:
+            log.info('🪁 Hedged upstream request', key=key, winner='hedge' if winner and winner.hedge else 'primary')
+        return losers
+
+    def post(self, send, key, settings, labels=None):
+        """Run send(), a streaming requests call, hedged after the delay
+
+        Returns the winning response, or raises the first request's error
+        when no attempt succeeded.
+        """
+        record = self._record(key)
+        delay = self.delay(key, settings)
+        done = queue.Queue()
+        attempts = [self._start(send, done, hedge=False)]
+        pending = 1
+        winner = None
+        while pending:
+            timeout = None
+            if len(attempts) == 1 and delay is not None:
+                timeout = max(0.0, attempts[0].started + delay - time.perf_counter())
+            try:
+                attempt = done.get(timeout=timeout)
+            except queue.Empty:
+                if self._may_hedge(record):
+                    attempts.append(self._start(send, done, hedge=True))
+                    pending += 1
+                delay = None
+                continue
+            pending -= 1
+            if attempt.usable:
+                winner = attempt
+                break
+            if len(attempts) == 1:
+                break  # The first request failed before a hedge was sent
+
+        for attempt in self._finish(key, attempts, winner, labels or {}):
+            if attempt is not attempts[0] or winner is not None:
+                self._close(attempt)
+        chosen = winner or attempts[0]
+        if chosen.error is not None:
+            raise chosen.error
+        return chosen.result()
+
+    def _start(self, send, done, hedge):
+        attempt = _Attempt(hedge)
+        threading.Thread(target=self._run, args=(attempt, send, done), name='upstream-hedge', daemon=True).start()
+        return attempt
+
+    @staticmethod
+    def _run(attempt, send, done):
+        try:
+            attempt.response = send()
+            if attempt.cancelled:
+                attempt.response.close()
+                return
+            if is_event_stream(attempt.response):
+                attempt.read_first_event(iter_response_chunks(attempt.response))
+            # Non-streaming replies count from their response headers
+            attempt.first_event_at = time.perf_counter()
+        except Exception as e:
+            attempt.error = e
+        finally:
+            done.put(attempt)
+
+    @staticmethod
+    def _close(attempt):
+        # Closing the response from here also unblocks a read in progress on the attempt's thread
+        if attempt.response is not None:
+            try:
+                attempt.response.close()
+            except Exception:
+                pass
+
+    async def asend(self, send, key, settings, labels=None):
+        """Async counterpart of post() for `await send()` returning a streaming httpx response"""
+        record = self._record(key)
+        delay = self.delay(key, settings)
+        attempts = [_Attempt(hedge=False)]
+        tasks = {asyncio.ensure_future(self._arun(attempts[0], send)): attempts[0]}
+        pending = set(tasks)
+        winner = None
+        while pending:
+            timeout = None
+            if len(attempts) == 1 and delay is not None:
+                timeout = max(0.0, attempts[0].started + delay - time.perf_counter())
+            finished, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not finished:
+                if self._may_hedge(record):
+                    attempts.append(_Attempt(hedge=True))
+                    task = asyncio.ensure_future(self._arun(attempts[-1], send))
+                    tasks[task] = attempts[-1]
+                    pending.add(task)
+                delay = None
+                continue
+            usable = [tasks[task] for task in finished if tasks[task].usable]
+            if usable:
+                winner = min(usable, key=lambda attempt: attempt.first_event_at or attempt.started)
+                break
+            if len(attempts) == 1:
+                break
+
+        losers = self._finish(key, attempts, winner, labels or {})
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for attempt in losers:
+            if attempt is not attempts[0] or winner is not None:
+                if attempt.response is not None:
+                    await attempt.response.aclose()
+        chosen = winner or attempts[0]
+        if chosen.error is not None:
+            raise chosen.error
+        return chosen.result()
+
+    @staticmethod
+    async def _arun(attempt, send):
+        try:
+            attempt.response = await send()
+            if is_event_stream(attempt.response):
+                await attempt.aread_first_event(attempt.response.aiter_bytes(READ_CHUNK_SIZE))
+            attempt.first_event_at = time.perf_counter()
+        except Exception as e:
+            attempt.error = e
+        return attempt
+
+    def get_stats(self):
+        """Per-key request, hedge and win counts with the current hedge delay"""
+        with self._lock:
+            records = list(self._records.items())
+        stats = {}
+        for key, record in records:
+            with self._lock:
+                samples = list(record.samples)
+            p = percentile(samples, self.pct)
+            stats[key] = {
+                'requests': record.requests,
+                'hedged': record.hedged,
+                'hedge_wins': record.hedge_wins,
+                'hedge_rate': round(record.hedged / record.requests, 4) if record.requests else None,
+                'win_rate': round(record.hedge_wins / record.hedged, 4) if record.hedged else None,
+                'samples': len(samples),
+                f'p{self.pct:g}_first_event_ms': round(p * 1000, 1) if p is not None else None,
+                'delay_ms': round(max(self.min_delay_ms / 1000, p) * 1000, 1)
+                if len(samples) >= self.min_samples else None,
+            }
+        return stats
@@ -0,0 +1,213 @@
+"""
+Server-side image normalization
+
+The browser sends images as base64 data URLs exactly as captured, so a
+multi-megabyte PNG screenshot travels to the upstream model at full size,
+plus base64's 33% overhead. This stage decodes each image, downscales it
+to the configuration's maximum dimension and re-encodes it as JPEG or
+WebP. The result is used only when it is actually smaller.
+
+Work runs on a shared thread pool. Pillow releases the GIL while decoding,
+resizing and encoding, so the images of one request are processed in
+parallel, and the asyncio server can await them without blocking its
+event loop.
+
+Pillow is optional. Without it, images are forwarded unchanged.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - exercised only without Pillow
+    Image = None
+
+from request_errors import number_setting
+from structured_logging import get_logger
+
+
+log = get_logger('request')
+
+DEFAULT_FORMAT = 'jpeg'
+DEFAULT_QUALITY = 85
+STORED_ENTRIES = 10000
+FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+
+DATA_URL_PATTERN = re.compile(r'^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?P<params>(?:;[^,;]*)*?);base64,', re.IGNORECASE)
+
+
+def image_settings(data, config=None):
+    """Resolve image normalization settings from the request body, then the configuration.
+
+    Request fields `image_max_dimension` / `image_format` / `image_quality`
+    override the configuration's `settings.imageMaxDimension` /
+    `settings.imageFormat` / `settings.imageQuality`. Returns None when no
+    maximum dimension is set, otherwise a dict with `max_dimension`,
+    `image_format` and `quality`. Non-numeric values raise ChatRequestError.
+    """
+    settings = (config or {}).get('settings') or {}
+    max_dimension = data.get('image_max_dimension', settings.get('imageMaxDimension'))
+    if not max_dimension:
+        return None
+    image_format = (data.get('image_format', settings.get('imageFormat')) or DEFAULT_FORMAT).lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in FORMATS:
+        image_format = DEFAULT_FORMAT
+    quality = data.get('image_quality', settings.get('imageQuality')) or DEFAULT_QUALITY
+    return {
+        'max_dimension': number_setting(max_dimension, 'image_max_dimension', int),
+        'image_format': image_format,
+        'quality': max(1, min(100, number_setting(quality, 'image_quality', int)))
+    }
+
+
+def unchanged(url):
+    return url, len(url), len(url)
+
+
+def normalize_data_url(url, max_dimension, image_format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    """Downscale and re-encode one base64 data URL.
+
+    Returns (url, original_size, new_size) in bytes of the URL string.
+    URLs that are not base64 data URLs, cannot be decoded, or would not
+    get smaller are returned unchanged.
+    """
+    original_size = len(url)
+    match = DATA_URL_PATTERN.match(url) if Image is not None else None
+    if match is None:
+        return unchanged(url)
+
+    try:
+        raw = base64.b64decode(url[match.end():], validate=False)
+        with Image.open(io.BytesIO(raw)) as img:
+            # Animated images would lose their frames; leave them alone
+            if getattr(img, 'is_animated', False):
+                return unchanged(url)
+            img.draft('RGB', (max_dimension, max_dimension))  # Cheap JPEG pre-scaling
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                if image_format == 'jpeg':
+                    # JPEG has no alpha channel: flatten onto white like the chat background
+                    background = Image.new('RGB', img.size, (255, 255, 255))
+                    background.paste(img, mask=img.getchannel('A'))
+                    img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            pil_format, mime = FORMATS[image_format]
+            output = io.BytesIO()
+            img.save(output, pil_format, quality=quality, optimize=True)
+    except (OSError, ValueError, binascii.Error, Image.DecompressionBombError) as e:
+        log.warning('⚠️ Could not normalize image', error=str(e))
+        return unchanged(url)
+
+    new_url = f"data:{mime};base64," + base64.b64encode(output.getvalue()).decode('ascii')
+    if len(new_url) >= original_size:
+        return unchanged(url)
+    return new_url, original_size, len(new_url)
+
+
+class ImagePipeline:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # (blob hash, max dimension, format, quality) -> hash of the normalized copy, least recently used first
+        self._stored = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        workers = os.environ.get('IMAGE_WORKERS')
+        return cls(max_workers=int(workers) if workers else None)
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _get_executor(self):
+        # Created lazily (and again after fork) so each worker process owns its threads
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='image-pipeline')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _submit(self, images, settings):
+        executor = self._get_executor()
+        return [executor.submit(normalize_data_url, img.get('url', ''), **settings) for img in images]
+
+    @staticmethod
+    def _collect(images, results):
+        normalized = []
+        stats = {'images': len(images), 'original_bytes': 0, 'normalized_bytes': 0}
+        for img, (url, original_size, new_size) in zip(images, results):
+            normalized.append(dict(img, url=url))
+            stats['original_bytes'] += original_size
+            stats['normalized_bytes'] += new_size
+        stats['bytes_saved'] = stats['original_bytes'] - stats['normalized_bytes']
+        return normalized, stats
+
+    def normalize(self, images, settings):
+        """Normalize a request's images in parallel; returns (images, stats)"""
+        images = images or []
+        if not self.available:
+            return self._collect(images, [unchanged(img.get('url', '')) for img in images])
+        futures = self._submit(images, settings)
+        return self._collect(images, [future.result() for future in futures])
+
+    async def anormalize(self, images, settings):
+        """Async counterpart of normalize that awaits the pool without blocking the event loop"""
+        images = images or []
+        if not self.available:
+            return self.normalize(images, settings)
+        futures = self._submit(images, settings)
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        return self._collect(images, results)
+
+    def normalize_stored(self, hashes, settings, store):
+        """Map blob store hashes to the hashes of their normalized copies.
+
+        Conversation history refers to images by hash and is resent with
+        every turn. Each image is normalized once per settings, the result
+        is put in `store` and later turns reuse it. Returns (hashes, stats),
+        with hashes missing from the store passed through unchanged.
+        """
+        settings_key = (settings['max_dimension'], settings['image_format'], settings['quality'])
+        result = {}
+        with self._lock:
+            for blob_hash in hashes:
+                normalized_hash = self._stored.get((blob_hash,) + settings_key)
+                if normalized_hash is not None:
+                    self._stored.move_to_end((blob_hash,) + settings_key)
+                    result[blob_hash] = normalized_hash
+        pending = []
+        for blob_hash in dict.fromkeys(hashes):
+            # A normalized copy evicted from the store is made again
+            if blob_hash in result and store.info(result[blob_hash]) is not None:
+                continue
+            url = store.data_url(blob_hash)
+            if url is not None:
+                pending.append((blob_hash, {'url': url}))
+
+        normalized, stats = self.normalize([img for _, img in pending], settings)
+        for (blob_hash, _), img in zip(pending, normalized):
+            try:
+                normalized_hash, _ = store.put_data_url(img['url'])
+            except (OSError, ValueError):
+                normalized_hash = blob_hash
+            result[blob_hash] = normalized_hash
+            with self._lock:
+                self._stored[(blob_hash,) + settings_key] = normalized_hash
+                while len(self._stored) > STORED_ENTRIES:
+                    self._stored.popitem(last=False)
+        return [result.get(blob_hash, blob_hash) for blob_hash in hashes], stats
@@ -0,0 +1,129 @@
+"""
+Background job queue for slow, non-interactive work
+
+Endpoints that used to block on an upstream probe (such as the image
+support test run when a configuration is saved) submit a job instead and
+return right away. Clients poll `GET /api/jobs/<id>` for the outcome.
+Each job's `on_complete` callback applies its result server-side.
+
+Jobs may carry a `key`. When a newer job with the same key is submitted,
+an older one that finishes later does not apply its result. This way a
+configuration saved twice ends up with the result for its latest
+settings.
+"""
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from structured_logging import get_logger
+
+
+log = get_logger('jobs')
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_jobs=1000):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._latest_by_key = {}
+        self._done = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_workers=int(os.environ.get('JOB_WORKERS', '2')))
+
+    def _get_executor(self):
+        # Created lazily (and again after fork) so each worker process owns its threads
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='jobs')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, kind, fn, *args, key=None, on_complete=None, **kwargs):
+        """Queue fn(*args, **kwargs) and return the new job's public view.
+
+        `on_complete(result)` runs on the worker after fn succeeds, unless
+        a newer job with the same key has been submitted in the meantime.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'pending',
+            'result': None,
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._done[job_id] = threading.Event()
+            if key is not None:
+                self._latest_by_key[key] = job_id
+            self._trim()
+            executor = self._get_executor()
+        executor.submit(self._run, job_id, key, fn, args, kwargs, on_complete)
+        return self.get(job_id)
+
+    def _run(self, job_id, key, fn, args, kwargs, on_complete):
+        self._update(job_id, status='running', started_at=datetime.now().isoformat())
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                superseded = key is not None and self._latest_by_key.get(key) != job_id
+            if superseded:
+                self._update(job_id, status='superseded', result=result)
+            else:
+                if on_complete is not None:
+                    on_complete(result)
+                self._update(job_id, status='succeeded', result=result)
+        except Exception as e:
+            log.warning('⚠️ Background job failed', job_id=job_id, kind=self._jobs.get(job_id, {}).get('kind'),
+                        error=str(e))
+            self._update(job_id, status='failed', error=str(e))
+        finally:
+            self._update(job_id, finished_at=datetime.now().isoformat())
+            with self._lock:
+                if key is not None and self._latest_by_key.get(key) == job_id:
+                    del self._latest_by_key[key]
+                done = self._done.get(job_id)
+            if done is not None:
+                done.set()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _trim(self):
+        # Drop the oldest finished jobs once the table is full
+        while len(self._jobs) > self.max_jobs:
+            victim = next((job_id for job_id, job in self._jobs.items() if job['finished_at']), None)
+            if victim is None:
+                break
+            del self._jobs[victim]
+            self._done.pop(victim, None)
+
+    def get(self, job_id):
+        """Return a copy of the job, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes; returns the job or None if unknown"""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is None:
+            return None
+        done.wait(timeout)
+        return self.get(job_id)
@@ -0,0 +1,149 @@
+"""
+Pluggable JSON codec for request bodies, upstream payloads and stream chunks
+
+Every JSON document the backend parses or produces per request, or per
+token, goes through the codec selected by JSON_CODEC:
+
+- `auto` (default): msgspec if installed, else orjson, else the standard library
+- `msgspec`, `orjson` or `stdlib`: force one (a package that is not
+  installed falls back to `stdlib` with a warning)
+
+The fast codecs parse and serialize in C straight from and to bytes, so
+bodies are never decoded to str first. With msgspec, streaming chunks are
+decoded into typed structs that hold only choices[].delta.content, so the
+per-token path builds no dicts for id, model, usage and the other fields
+it ignores. Chunks of another shape fall back to a full decode.
+
+Output is compact (no spaces after separators), keys keep their insertion
+order and non-ASCII text is written as UTF-8. Every codec raises
+DecodeError (ValueError) on invalid input.
+"""
+import json
+import logging
+import os
+from typing import List, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: the stdlib codec is used instead
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # Optional: typed chunk decoding needs it
+    msgspec = None
+
+# json.JSONDecodeError and orjson.JSONDecodeError subclass it; msgspec errors are re-raised as it
+DecodeError = ValueError
+
+
+def extract_delta_content(chunk_data):
+    """Return the delta content from a parsed streaming chunk, or None"""
+    if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
+        delta = chunk_data['choices'][0].get('delta', {})
+        if 'content' in delta and delta['content'] is not None:
+            return delta['content']
+    return None
+
+
+class StdlibCodec:
+    name = 'stdlib'
+
+    def loads(self, data):
+        """Parse a JSON document from str or bytes"""
+        return json.loads(data)
+
+    def dumps(self, obj, default=None):
+        """Serialize obj to a str; `default` converts otherwise unsupported objects"""
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=default)
+
+    def dumps_bytes(self, obj, default=None):
+        """Serialize obj to UTF-8 bytes, ready to be sent"""
+        return self.dumps(obj, default).encode('utf-8')
+
+    def delta_content(self, data):
+        """The delta content of one streaming chunk's data, or None"""
+        return extract_delta_content(self.loads(data))
+
+
+class OrjsonCodec(StdlibCodec):
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj, default=None):
+        return self.dumps_bytes(obj, default).decode('utf-8')
+
+    def dumps_bytes(self, obj, default=None):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+if msgspec is not None:
+    class _Delta(msgspec.Struct):
+        content: Optional[str] = None
+
+    class _Choice(msgspec.Struct):
+        delta: Optional[_Delta] = None
+
+    class _Chunk(msgspec.Struct):
+        choices: Optional[List[_Choice]] = None
+
+
+class MsgspecCodec(StdlibCodec):
+    name = 'msgspec'
+
+    def __init__(self):
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+        self._chunk_decoder = msgspec.json.Decoder(_Chunk)
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e)) from None
+
+    def dumps(self, obj, default=None):
+        return self.dumps_bytes(obj, default).decode('utf-8')
+
+    def dumps_bytes(self, obj, default=None):
+        if default is None:
+            return self._encoder.encode(obj)
+        return msgspec.json.encode(obj, enc_hook=default)
+
+    def delta_content(self, data):
+        try:
+            chunk = self._chunk_decoder.decode(data)
+        except msgspec.ValidationError:
+            # Valid JSON that is not a chunk (e.g. "choices" holds something else): decode it generically
+            return super().delta_content(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e)) from None
+        if not chunk.choices or chunk.choices[0].delta is None:
+            return None
+        return chunk.choices[0].delta.content
+
+
+CODECS = {'stdlib': StdlibCodec, 'orjson': OrjsonCodec, 'msgspec': MsgspecCodec}
+_INSTALLED = {'stdlib': True, 'orjson': orjson is not None, 'msgspec': msgspec is not None}
+
+
+def create_codec(name='auto'):
+    """Codec by name, where `auto` picks the fastest one installed"""
+    if name == 'auto':
+        name = next(candidate for candidate in ('msgspec', 'orjson', 'stdlib') if _INSTALLED[candidate])
+    elif name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name!r}, expected one of: auto, {', '.join(CODECS)}")
+    elif not _INSTALLED[name]:
+        logging.getLogger(__name__).warning('JSON codec %s is not installed, using stdlib', name)
+        name = 'stdlib'
+    return CODECS[name]()
+
+
+codec = create_codec(os.environ.get('JSON_CODEC', 'auto'))
+
+loads = codec.loads
+dumps = codec.dumps
+dumps_bytes = codec.dumps_bytes
+delta_content = codec.delta_content
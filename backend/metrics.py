@@ -0,0 +1,254 @@
+"""
+Prometheus metrics for the chat proxy, aggregated across worker processes
+
+`/metrics` serves the Prometheus text format. Counters, gauges and
+histograms are kept in memory per process and labeled by configuration
+id and the configuration's model. The model named in a request body is
+not used, so clients cannot create new series. A few calls per request
+or token update them under a lock.
+
+With several worker processes, set METRICS_DIR to a directory they
+share. Each process then writes its values to `metrics-<pid>.json`
+about once a second (METRICS_FLUSH_INTERVAL). The worker answering a
+scrape adds up its own live values and every other live process's
+file. A worker removes its file when it exits, and files left by
+workers that were killed are skipped, so totals only cover running
+workers (Prometheus treats the drop like a counter reset).
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from config_storage import write_atomic
+from structured_logging import get_logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'chat_requests_total': ('counter', 'Chat requests received', None),
+    'chat_time_to_first_token_seconds': ('histogram', 'Time from request to the first relayed token', LATENCY_BUCKETS),
+    'chat_inter_token_seconds': ('histogram', 'Time between consecutive relayed tokens', TOKEN_BUCKETS),
+    'chat_stream_duration_seconds': ('histogram', 'Time from request to the end of the relayed stream', LATENCY_BUCKETS),
+    'chat_upstream_connect_seconds': ('histogram', 'Time until the upstream returned response headers, connection setup included', LATENCY_BUCKETS),
+    'chat_request_bytes_total': ('counter', 'Chat request body bytes received', None),
+    'chat_response_bytes_total': ('counter', 'Response bytes relayed to clients', None),
+    'chat_image_bytes_total': ('counter', 'Image bytes received in chat requests', None),
+    'chat_image_bytes_saved_total': ('counter', 'Image bytes removed by normalization before forwarding', None),
+    'chat_active_streams': ('gauge', 'Streams currently being relayed', None),
+    'chat_cancellations_total': ('counter', 'Streams stopped by the client', None),
+    'chat_errors_total': ('counter', 'Chat errors by kind', None),
+    'chat_hedge_requests_total': ('counter', 'Chat requests sent with hedging enabled', None),
+    'chat_hedges_total': ('counter', 'Second upstream requests sent because the first event was late', None),
+    'chat_hedge_wins_total': ('counter', 'Hedged requests where the second request produced the first event first', None),
+    'health_probe_seconds': ('histogram', 'Duration of upstream health probes', LATENCY_BUCKETS),
+    'health_probe_failures_total': ('counter', 'Health probes that did not report healthy', None),
+}
+
+log = get_logger('metrics')
+
+
+def chat_labels(data, config):
+    """Metric labels for a chat request: its stored configuration (if any) and that configuration's model"""
+    return {
+        'config_id': config['id'] if config else '',
+        'model': (config or {}).get('model') or ''
+    }
+
+
+class Metrics:
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._values = {}  # (name, labels) -> float, or [bucket counts..., sum, count] for histograms
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.environ.get('METRICS_DIR') or None,
+            flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+        )
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter or gauge"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        self._ensure_flusher()
+
+    def dec(self, name, value=1, **labels):
+        self.inc(name, -value, **labels)
+
+    def observe(self, name, value, **labels):
+        """Record a histogram observation"""
+        buckets = METRICS[name][2]
+        key = self._key(name, labels)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 3)
+            series[index] += 1  # Per-bucket counts (the last is +Inf), made cumulative when rendered
+            series[-2] += value
+            series[-1] += 1
+        self._ensure_flusher()
+
+    def snapshot(self):
+        """This process's values as JSON-serializable [name, labels, value] entries"""
+        with self._lock:
+            return [[name, dict(labels), list(value) if isinstance(value, list) else value]
+                    for (name, labels), value in self._values.items()]
+
+    def _ensure_flusher(self):
+        # Started lazily (and again after fork) so each worker process writes its own file
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        atexit.register(self._remove_file, os.getpid())
+        threading.Thread(target=self._flush_loop, name='metrics', daemon=True).start()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def _remove_file(self, pid):
+        # Inherited by forked children, which must not remove their parent's file
+        if os.getpid() != pid:
+            return
+        try:
+            os.remove(self._path(pid))
+        except OSError:
+            pass
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('⚠️ Error writing metrics', directory=self.directory, error=str(e))
+
+    def flush(self):
+        """Write this process's values for the other workers to aggregate"""
+        if self.directory:
+            write_atomic(self._path(os.getpid()),
+                         json.dumps({'pid': os.getpid(), 'values': self.snapshot()}, separators=(',', ':')))
+
+    def collect(self):
+        """Values summed over this process and, with METRICS_DIR, every other live worker's file"""
+        totals = {}
+        sources = [self.snapshot()]
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if data.get('pid') != os.getpid() and _pid_alive(data.get('pid')):
+                    sources.append(data.get('values', []))
+        for values in sources:
+            for name, labels, value in values:
+                if name not in METRICS:
+                    continue
+                key = self._key(name, labels)
+                if isinstance(value, list):
+                    current = totals.get(key)
+                    totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        totals = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class StreamTimer:
+    """Time-to-first-token, inter-token gaps and total duration of one relayed stream
+
+    `stages` is the request's StageTimer, if any; the first token closes
+    its `first_token` stage.
+    """
+
+    def __init__(self, metrics, labels, started=None, stages=None):
+        self.metrics = metrics
+        self.labels = labels
+        self.started = started if started is not None else time.perf_counter()
+        self.stages = stages
+        self.last = None
+
+    def token(self):
+        now = time.perf_counter()
+        if self.last is None:
+            self.metrics.observe('chat_time_to_first_token_seconds', now - self.started, **self.labels)
+            if self.stages:
+                self.stages.mark('first_token')
+        else:
+            self.metrics.observe('chat_inter_token_seconds', now - self.last, **self.labels)
+        self.last = now
+
+    def finish(self, cancelled=False, error=False):
+        self.metrics.observe('chat_stream_duration_seconds', time.perf_counter() - self.started, **self.labels)
+        if cancelled:
+            self.metrics.inc('chat_cancellations_total', **self.labels)
+        if error:
+            self.metrics.inc('chat_errors_total', kind='stream', **self.labels)
+
+
+def _pid_alive(pid):
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
@@ -0,0 +1,20 @@
+"""
+Client errors raised while turning a /api/chat body into an upstream request
+"""
+
+
+class ChatRequestError(Exception):
+    """Raised when a /api/chat request body cannot be turned into an upstream request"""
+
+    def __init__(self, body, status_code=400):
+        super().__init__(body.get('error'))
+        self.body = body
+        self.status_code = status_code
+
+
+def number_setting(value, name, convert=float):
+    """Convert a numeric request or configuration setting, raising a 400 ChatRequestError naming `name`"""
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise ChatRequestError({'error': f'{name} must be a number, got {value!r}'}) from None
@@ -0,0 +1,249 @@
+"""
+Exact-match response cache
+
+Identical prompts (templates, retries, regenerate-after-error) otherwise
+pay for a full upstream generation every time. When caching is enabled
+for a configuration or request, a completed reply is stored under a hash
+of the endpoint, API key, model, normalized messages and generation
+parameters. The next identical request is replayed from the cache
+through the usual SSE framing.
+
+Entries live in a memory LRU tier and, when a directory is configured,
+an on-disk tier that survives restarts and is shared by worker
+processes. Both tiers are size-bounded and entries expire after a TTL.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import json_codec
+from request_errors import number_setting
+from structured_logging import get_logger
+
+
+DEFAULT_TTL = 3600
+REPLAY_CHUNK_CHARS = 64
+
+log = get_logger('cache')
+
+
+def cache_settings(data, config=None):
+    """Resolve response caching from the request body, then the configuration.
+
+    Request fields `cache` / `cache_ttl` / `cache_pace_ms` override the
+    configuration's `settings.responseCache` / `settings.cacheTtl` /
+    `settings.cachePaceMs`. Returns None when caching is off, otherwise a
+    dict with `ttl` (seconds) and `pace_ms` (delay between replayed
+    chunks, 0 to replay at once). Non-numeric values raise
+    ChatRequestError.
+    """
+    settings = (config or {}).get('settings') or {}
+    if not data.get('cache', settings.get('responseCache')):
+        return None
+    return {
+        'ttl': number_setting(data.get('cache_ttl', settings.get('cacheTtl')) or DEFAULT_TTL, 'cache_ttl'),
+        'pace_ms': number_setting(data.get('cache_pace_ms', settings.get('cachePaceMs')) or 0, 'cache_pace_ms')
+    }
+
+
+def _normalize_message(message):
+    content = message.get('content')
+    if isinstance(content, str):
+        return dict(message, content=content.strip())
+    if isinstance(content, list):
+        return dict(message, content=[
+            dict(part, text=part['text'].strip()) if part.get('type') == 'text' and isinstance(part.get('text'), str) else part
+            for part in content
+        ])
+    return message
+
+
+def cache_key(api_url, api_key, payload):
+    """Hash the parts of an upstream request that determine its reply"""
+    material = {
+        'api_url': api_url,
+        # Entries are scoped to the API key without storing it
+        'auth': hashlib.sha256(api_key.encode('utf-8')).hexdigest() if api_key else None,
+        'params': {k: v for k, v in payload.items() if k not in ('messages', 'stream')},
+        'messages': [_normalize_message(m) for m in payload.get('messages', [])],
+    }
+    # Always stdlib json: keys of stored entries must not depend on JSON_CODEC
+    encoded = json.dumps(material, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def replay_chunks(content, pace_ms=0):
+    """Split cached content into replay chunks, sleeping `pace_ms` between them"""
+    if not pace_ms:
+        if content:
+            yield content
+        return
+    for i in range(0, len(content), REPLAY_CHUNK_CHARS):
+        if i:
+            time.sleep(pace_ms / 1000.0)
+        yield content[i:i + REPLAY_CHUNK_CHARS]
+
+
+async def areplay_chunks(content, pace_ms=0):
+    """Async counterpart of replay_chunks"""
+    if not pace_ms:
+        if content:
+            yield content
+        return
+    for i in range(0, len(content), REPLAY_CHUNK_CHARS):
+        if i:
+            await asyncio.sleep(pace_ms / 1000.0)
+        yield content[i:i + REPLAY_CHUNK_CHARS]
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> (expires_at, content)
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            self._scan()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', '1000')),
+            directory=os.environ.get('RESPONSE_CACHE_DIR') or None,
+            max_disk_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+        )
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _scan(self):
+        found = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    found.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        """Return the cached content for a key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        # Other worker processes may have written the entry, so check the directory, not just the index
+        entry = self._read_disk(key) if self.directory else None
+        with self._lock:
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            # Promote to the memory tier
+            self._memory[key] = entry
+            self._trim_memory()
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, content, ttl=DEFAULT_TTL):
+        if not content:
+            return
+        entry = (time.time() + ttl, content)
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            self._trim_memory()
+        if self.directory:
+            self._write_disk(key, entry)
+
+    def _trim_memory(self):
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                stored = json_codec.loads(f.read())
+                expires_at, content = stored['expires_at'], stored['content']
+            os.utime(self._path(key))
+        except (OSError, ValueError, KeyError, TypeError):
+            self._forget_disk(key)
+            return None
+        with self._lock:
+            if key not in self._disk:
+                self._disk_bytes += size
+            self._disk[key] = size
+            self._disk.move_to_end(key)
+        if expires_at <= time.time():
+            self._forget_disk(key, remove=True)
+            return None
+        return expires_at, content
+
+    def _write_disk(self, key, entry):
+        body = json_codec.dumps_bytes({'expires_at': entry[0], 'content': entry[1]})
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            log.warning('⚠️ Error writing response cache entry', error=str(e))
+            return
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(body) - self._disk.pop(key, 0)
+            self._disk[key] = len(body)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _forget_disk(self, key, remove=False):
+        with self._lock:
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_bytes -= size
+        if remove:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            keys = list(self._disk)
+        for key in keys:
+            self._forget_disk(key, remove=True)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,144 @@
+"""
+Production entry point: gunicorn with a worker model suited to long-lived SSE streams
+
+app.py runs the Werkzeug development server (one process, reloader and
+debugger on). This runs the same app under gunicorn instead:
+
+    python backend/serve.py --worker-class gthread --threads 64
+
+Worker classes (SERVER_WORKER_CLASS / --worker-class):
+
+- `gthread` (default): the Flask app in threaded workers. Every open
+  chat stream holds one thread, so workers x threads caps the number of
+  concurrent streams.
+- `uvicorn`: asgi.py in uvicorn workers. A chat stream is a coroutine on
+  the worker's event loop, so one worker holds thousands of them. Other
+  routes run on the Flask app through a thread pool.
+- `sync`: one request at a time per worker. Only useful as a comparison
+  point, since a single stream blocks a whole worker.
+
+The app is imported once in the master and the workers are forked from
+it (SERVER_PRELOAD, on by default). Before forking, the heap is moved to
+the garbage collector's permanent generation (gc.freeze). The collector
+then never touches those objects, so the pages stay shared with the
+master instead of being copied into every worker. Background threads
+(health monitor, metrics flusher, job and logging queues) start per
+worker after the fork.
+
+One worker is the default. Several workers do not yet share all state:
+a worker never sees conversation turns another worker appended after it
+cached the conversation, blobs are only found if uploaded to the same
+worker (or present when it started), `/api/jobs/<id>` only knows the
+worker's own jobs, and every worker runs its own health monitor. Set
+SERVER_WORKERS above 1 only with these limits in mind, together with
+STREAM_REGISTRY, METRICS_DIR and CONFIG_STORAGE=sqlite.
+
+Every setting can come from the environment or the command line, and the
+command line wins: SERVER_BIND (0.0.0.0:8000), SERVER_WORKERS (1),
+SERVER_THREADS (32), SERVER_TIMEOUT (60), SERVER_GRACEFUL_TIMEOUT (30),
+SERVER_KEEPALIVE (5). The timeout is the worker heartbeat, not a limit on
+request length: gthread and uvicorn workers keep reporting in while they
+stream. It does bound a single stream with `sync` workers.
+"""
+import argparse
+import gc
+import os
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Windows has no gunicorn; run uvicorn asgi:app --workers N there
+    BaseApplication = object
+
+WORKER_CLASSES = {
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+    'sync': 'sync',
+}
+
+
+def parse_settings(argv=None, environ=os.environ):
+    """Server settings from SERVER_* environment variables, overridden by command line flags"""
+    parser = argparse.ArgumentParser(description="Run Michael's Chat under gunicorn")
+    parser.add_argument('--bind', default=environ.get('SERVER_BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int, default=int(environ.get('SERVER_WORKERS') or 1),
+                        help='worker processes; see the module docstring before raising it')
+    parser.add_argument('--worker-class', choices=sorted(WORKER_CLASSES),
+                        default=environ.get('SERVER_WORKER_CLASS', 'gthread'))
+    parser.add_argument('--threads', type=int, default=int(environ.get('SERVER_THREADS', '32')),
+                        help='threads per gthread worker, i.e. concurrent streams per worker')
+    parser.add_argument('--timeout', type=int, default=int(environ.get('SERVER_TIMEOUT', '60')),
+                        help='seconds before a silent worker is restarted')
+    parser.add_argument('--graceful-timeout', type=int, default=int(environ.get('SERVER_GRACEFUL_TIMEOUT', '30')),
+                        help='seconds open streams get to finish on shutdown or reload')
+    parser.add_argument('--keepalive', type=int, default=int(environ.get('SERVER_KEEPALIVE', '5')))
+    parser.add_argument('--preload', action=argparse.BooleanOptionalAction,
+                        default=environ.get('SERVER_PRELOAD', '1') not in ('0', 'false', 'no'))
+    parser.add_argument('--access-log', action='store_true', default=bool(environ.get('SERVER_ACCESS_LOG')))
+    return parser.parse_args(argv)
+
+
+def gunicorn_options(settings):
+    """gunicorn configuration for the parsed settings"""
+    options = {
+        'bind': settings.bind,
+        'workers': settings.workers,
+        'worker_class': WORKER_CLASSES[settings.worker_class],
+        'timeout': settings.timeout,
+        'graceful_timeout': settings.graceful_timeout,
+        'keepalive': settings.keepalive,
+        'preload_app': settings.preload,
+        'post_worker_init': start_worker_services,
+    }
+    if settings.worker_class == 'gthread':
+        options['threads'] = settings.threads
+    if settings.access_log:
+        options['accesslog'] = '-'
+    return options
+
+
+def load_app(worker_class):
+    """Import the WSGI (Flask) or ASGI app for a worker class"""
+    if worker_class == 'uvicorn':
+        from asgi import app
+        return app
+    from server import create_app
+    return create_app()
+
+
+def start_worker_services(worker):
+    # The ASGI lifespan starts the monitor too; start() is a no-op the second time in a process
+    from api import health_monitor
+    health_monitor.start()
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, settings):
+        self.settings = settings
+        super().__init__()
+
+    def load_config(self):
+        for key, value in gunicorn_options(self.settings).items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        app = load_app(self.settings.worker_class)
+        if self.settings.preload:
+            # Loaded in the master: keep the imported heap out of the workers' collections (copy-on-write)
+            gc.collect()
+            gc.freeze()
+        return app
+
+
+def main(argv=None):
+    if BaseApplication is object:
+        sys.exit('gunicorn is not available on this platform; run: uvicorn asgi:app --app-dir backend --workers N')
+    settings = parse_settings(argv)
+    print(f"Starting Michael's Chat on http://{settings.bind} "
+          f"({settings.workers} {settings.worker_class} workers"
+          + (f" x {settings.threads} threads" if settings.worker_class == 'gthread' else '') + ')')
+    ProductionServer(settings).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,47 +2,62 @@
 Server utilities and route handlers for serving the React frontend
 """
 import os
-from flask import Flask, send_from_directory
+from flask import Flask, abort
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
+import json_codec
+from static_assets import StaticAssets
 
-def create_app():
+# Path to the React build directory
+BUILD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend', 'build')
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """request.get_json() and jsonify() through the fast JSON codec (compact, keys unsorted)"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:  # Indented output for debug mode, or options the codec does not take
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        body = json_codec.dumps_bytes(self._prepare_response_obj(args, kwargs), default=self.default)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def create_app(build_dir=BUILD_DIR):
     """Create and configure the Flask application"""
-    # Path to the React build directory
-    BUILD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend', 'build')
-    
-    # Configure Flask to serve static files from the build directory
-    app = Flask(__name__, static_folder=BUILD_DIR, static_url_path='')
+    # The build is served by StaticAssets, so Flask's own static route is disabled
+    app = Flask(__name__, static_folder=None)
+    app.json = CodecJSONProvider(app)
     CORS(app)
     
     # Register blueprints
     from api import api_blueprint
     app.register_blueprint(api_blueprint)
     
+    # Route table, compressed variants and ETags are prepared once at startup
+    assets = StaticAssets.from_env(build_dir)
+    
     # Frontend routes
-    @app.route('/')
-    def serve_index():
-        """Serve the React app's index.html"""
-        return send_from_directory(BUILD_DIR, 'index.html')
-
-    @app.route('/static/<path:path>')
-    def serve_static_files(path):
-        """Serve static files from the React build directory"""
-        static_dir = os.path.join(BUILD_DIR, 'static')
-        return send_from_directory(static_dir, path)
-
+    @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve_static(path):
-        """Serve static files from the React build directory"""
-        try:
-            return send_from_directory(BUILD_DIR, path)
-        except:
-            # If file not found, serve index.html for React Router
-            return send_from_directory(BUILD_DIR, 'index.html')
+        """Serve a file from the React build, or index.html for React Router paths"""
+        asset = assets.lookup(path)
+        if asset is None:
+            abort(404)
+        return assets.response(asset)
     
     # Check if build directory exists
-    if not os.path.exists(BUILD_DIR):
-        print(f"Warning: Build directory not found at {BUILD_DIR}")
+    if not os.path.exists(build_dir):
+        print(f"Warning: Build directory not found at {build_dir}")
         print("Please run 'npm run build' in the frontend directory first.")
     
     return app
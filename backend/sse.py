@@ -0,0 +1,215 @@
+"""
+Incremental Server-Sent Events parser shared by the streaming code paths
+
+SSEParser consumes raw bytes in arbitrarily sized chunks and returns
+complete events. It follows the EventSource parsing rules: LF, CRLF and
+CR line endings (including a CRLF split across two chunks), multi-line
+`data:` fields joined with newlines, `:` comment lines and the optional
+single space after the colon.
+
+Each event keeps its raw bytes, so callers can relay upstream events
+verbatim (passthrough mode) without decoding the JSON inside them.
+"""
+import json_codec
+
+# Large reads keep per-chunk Python overhead low. Reads never wait for
+# 16KB to fill up: chunked responses yield each chunk as it arrives, and
+# other responses are read with read1 (see iter_response_chunks).
+READ_CHUNK_SIZE = 16384
+
+
+class SSEEvent:
+    """A single dispatched SSE event"""
+
+    __slots__ = ('event', 'data_bytes', 'id', 'retry', 'raw')
+
+    def __init__(self, data_bytes, event='message', id=None, retry=None, raw=b''):
+        self.data_bytes = data_bytes
+        self.event = event
+        self.id = id
+        self.retry = retry
+        self.raw = raw
+
+    @property
+    def data(self):
+        return self.data_bytes.decode('utf-8', errors='replace')
+
+    @property
+    def is_done(self):
+        """True for the OpenAI-style `data: [DONE]` terminator"""
+        return self.data_bytes.strip() == b'[DONE]'
+
+    def __repr__(self):
+        return f'SSEEvent(event={self.event!r}, data={self.data!r})'
+
+
+class SSEParser:
+    """Incremental SSE parser: feed() bytes in, get complete SSEEvents out"""
+
+    def __init__(self):
+        self._buffer = b''
+        self._skip_lf = False
+        self._data_lines = []
+        self._raw_lines = []
+        self._event = None
+        self._id = None
+        self._retry = None
+
+    def feed(self, chunk):
+        """Consume a chunk of bytes and return the events it completed"""
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            return []
+        if self._skip_lf:
+            # The previous chunk ended in CR; a leading LF completes that CRLF
+            self._skip_lf = False
+            if chunk[:1] == b'\n':
+                chunk = chunk[1:]
+        buffer = self._buffer + chunk if self._buffer else chunk
+
+        cut = max(buffer.rfind(b'\n'), buffer.rfind(b'\r')) + 1
+        if cut == 0:
+            self._buffer = buffer
+            return []
+        self._buffer = buffer[cut:]
+        if buffer[cut - 1:cut] == b'\r':
+            self._skip_lf = True
+
+        events = []
+        # bytes.splitlines() only splits on LF, CR and CRLF, matching the SSE grammar
+        for line in buffer[:cut].splitlines():
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def flush(self):
+        """Dispatch a trailing event left without a blank line at end of stream"""
+        events = []
+        if self._buffer:
+            line, self._buffer = self._buffer, b''
+            self._process_line(line)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, line):
+        if not line:
+            return self._dispatch()
+
+        self._raw_lines.append(line)
+        if line[:1] == b':':
+            # Comment line (often used as a keep-alive)
+            return None
+
+        field, sep, value = line.partition(b':')
+        if sep and value[:1] == b' ':
+            value = value[1:]
+
+        if field == b'data':
+            self._data_lines.append(value)
+        elif field == b'event':
+            self._event = value.decode('utf-8', errors='replace')
+        elif field == b'id':
+            if b'\0' not in value:
+                self._id = value.decode('utf-8', errors='replace')
+        elif field == b'retry':
+            if value.isdigit():
+                self._retry = int(value)
+        return None
+
+    def _dispatch(self):
+        data_lines, raw_lines = self._data_lines, self._raw_lines
+        event_type = self._event
+        self._data_lines, self._raw_lines, self._event = [], [], None
+        if not data_lines:
+            return None
+        return SSEEvent(
+            b'\n'.join(data_lines),
+            event=event_type or 'message',
+            id=self._id,
+            retry=self._retry,
+            raw=b'\n'.join(raw_lines) + b'\n\n'
+        )
+
+
+def iter_events(chunks):
+    """Yield SSEEvents from an iterable of byte chunks"""
+    parser = SSEParser()
+    for chunk in chunks:
+        if chunk:
+            yield from parser.feed(chunk)
+    yield from parser.flush()
+
+
+def parse_events(body):
+    """Parse a fully buffered SSE body (str or bytes) into a list of events"""
+    return list(iter_events([body]))
+
+
+def iter_response_chunks(response, chunk_size=READ_CHUNK_SIZE):
+    """Yield the body of a streaming requests response as it arrives
+
+    `iter_content` only returns early for chunked responses. An upstream
+    that ends its stream by closing the connection (HTTP/1.0, or
+    `Connection: close` without chunked encoding) would have every event
+    held back until 16KB arrived, so those bodies are read with urllib3's
+    `read1`, which returns whatever has been received.
+    """
+    raw = getattr(response, 'raw', None)
+    if getattr(raw, 'chunked', None) is False and hasattr(raw, 'read1'):
+        return _iter_read1(raw, chunk_size)
+    return response.iter_content(chunk_size=chunk_size)
+
+
+def _iter_read1(raw, chunk_size):
+    while True:
+        chunk = raw.read1(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_response_events(response, chunk_size=READ_CHUNK_SIZE):
+    """Yield SSEEvents from a streaming requests response"""
+    return iter_events(iter_response_chunks(response, chunk_size))
+
+
+async def aiter_response_events(response, chunk_size=READ_CHUNK_SIZE):
+    """Yield SSEEvents from a streaming httpx response"""
+    parser = SSEParser()
+    async for chunk in response.aiter_bytes(chunk_size):
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.flush():
+        yield event
+
+
+def format_text_frame(text):
+    """Encode streamed text as one SSE frame the chat frontend can reassemble
+
+    The frontend appends each `data: ` line verbatim and turns an empty
+    `data: ` line into a newline, so text is split on newlines with one
+    empty data line per newline. A single-line delta produces exactly the
+    historical `data: <text>` frame.
+    """
+    if '\n' not in text:
+        return f"data: {text}\n\n"
+    lines = []
+    for i, segment in enumerate(text.split('\n')):
+        if i:
+            lines.append('data: ')
+        if segment:
+            lines.append(f'data: {segment}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_delta_event(text):
+    """Encode text as an OpenAI-format streaming chunk, as relayed in passthrough mode"""
+    chunk = {'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}
+    return b'data: ' + json_codec.dumps_bytes(chunk) + b'\n\n'
+
+
+DONE_EVENT = b'data: [DONE]\n\n'
@@ -0,0 +1,141 @@
+"""
+Per-request stage timing, reported as Server-Timing and optional trace spans
+
+A `StageTimer` splits a request into consecutive stages. Each `mark(name)`
+closes the stage that ran since the previous mark, so straight-line
+handler code needs one call per step:
+
+    timing = StageTimer('chat')
+    data = request.get_json()
+    timing.mark('parse')
+
+Non-streaming responses carry the stages in a `Server-Timing` header
+(visible in the browser's network panel). Streams have already sent
+their headers when the last stages finish. They therefore end with a
+named SSE event, `event: timing`, after the reply (and after [DONE] in
+passthrough mode).
+
+With TRACE_FILE set, each finished request is also appended to that
+file as one OTLP/JSON line: a root span plus one child span per stage.
+This is the format the OpenTelemetry collector's file exporter writes,
+so the file can be loaded into OpenTelemetry tooling for offline
+analysis. Lines are written by the same bounded, non-blocking queue
+that structured_logging uses.
+"""
+import json
+import logging
+import os
+import time
+
+from structured_logging import NonBlockingQueueHandler
+
+TIMING_EVENT = 'timing'
+
+
+class StageTimer:
+    def __init__(self, name, exporter=None):
+        self.name = name
+        self.exporter = exporter
+        self.attributes = {}  # Added to the root span, e.g. config_id and status
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.stages = []  # (name, offset from start in seconds, duration in seconds)
+        self._last = self.started
+        self._finished = None
+
+    def mark(self, stage):
+        """Close the stage that ran since the previous mark (or the start)"""
+        now = time.perf_counter()
+        self.stages.append((stage, self._last - self.started, now - self._last))
+        self._last = now
+
+    def durations(self):
+        """Milliseconds per stage (repeated stages are summed) plus the total so far"""
+        result = {}
+        for stage, _, duration in self.stages:
+            result[stage] = result.get(stage, 0) + duration * 1000
+        total = (self._finished or time.perf_counter()) - self.started
+        result['total'] = total * 1000
+        return {stage: round(ms, 2) for stage, ms in result.items()}
+
+    def server_timing(self):
+        """Value for the Server-Timing response header"""
+        return ', '.join(f'{stage};dur={ms}' for stage, ms in self.durations().items())
+
+    def metadata_event(self):
+        """Final SSE event carrying the stage timings of a stream"""
+        return f"event: {TIMING_EVENT}\ndata: {json.dumps({'timing': self.durations()})}\n\n"
+
+    def finish(self):
+        """Stop the clock and export the spans (only the first call counts)"""
+        if self._finished is not None:
+            return
+        self._finished = time.perf_counter()
+        if self.exporter is not None:
+            self.exporter.export(self)
+
+
+class SpanFileExporter:
+    """Appends each finished StageTimer to a file as an OTLP/JSON resourceSpans line"""
+
+    def __init__(self, path, service_name='michael_chat'):
+        self.path = path
+        self.service_name = service_name
+        target = logging.FileHandler(path, delay=True)
+        target.setFormatter(logging.Formatter('%(message)s'))
+        self._handler = NonBlockingQueueHandler([target])
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get('TRACE_FILE')
+        return cls(path) if path else None
+
+    def export(self, timer):
+        line = json.dumps(self.encode(timer), separators=(',', ':'))
+        self._handler.handle(logging.LogRecord('michael_chat.trace', logging.INFO, __file__, 0, line, None, None))
+
+    def encode(self, timer):
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+
+        def nanos(offset):
+            return str(timer.started_ns + int(offset * 1e9))
+
+        spans = [{
+            'traceId': trace_id,
+            'spanId': root_id,
+            'name': timer.name,
+            'kind': 2,  # SERVER
+            'startTimeUnixNano': nanos(0),
+            'endTimeUnixNano': nanos(timer._finished - timer.started),
+            'attributes': [_attribute(key, value) for key, value in timer.attributes.items()],
+        }]
+        for stage, offset, duration in timer.stages:
+            spans.append({
+                'traceId': trace_id,
+                'spanId': os.urandom(8).hex(),
+                'parentSpanId': root_id,
+                'name': f'{timer.name}.{stage}',
+                'kind': 1,  # INTERNAL
+                'startTimeUnixNano': nanos(offset),
+                'endTimeUnixNano': nanos(offset + duration),
+            })
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'michael_chat.stage_timing'}, 'spans': spans}],
+        }]}
+
+    def close(self):
+        self._handler.close()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
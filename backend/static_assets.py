@@ -0,0 +1,138 @@
+"""
+Precompressed, cache-friendly serving of the React build
+
+The build directory is scanned once at startup into a route table
+(URL path -> asset). Requests are dict lookups, and any path that is not
+a file falls back to index.html for client-side routing.
+
+- Compression: a precompressed `.br` / `.gz` file next to an asset is sent
+  to clients whose Accept-Encoding allows it. Text assets without a `.gz`
+  are gzipped at startup and kept in memory (STATIC_COMPRESS=0 disables
+  this). Brotli variants are also generated when the optional `brotli`
+  package is installed.
+- Caching: files under /static/ carry a content hash in their name (Create
+  React App), so they are served `immutable` for a year. Everything else,
+  index.html included, must be revalidated. Every variant has a strong
+  ETag, so revalidation costs a 304.
+- index.html (and its compressed variants) is held in memory.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:  # Optional: only precompressed .br files are served
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Content types worth compressing when no precompressed variant exists
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/manifest+json')
+MIN_COMPRESS_SIZE = 1024
+# Precompressed suffixes in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class _Variant:
+    def __init__(self, path=None, data=None):
+        self.path = path
+        self.data = data
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.etag = hashlib.sha1(data).hexdigest()[:20]
+        self.size = len(data)
+
+
+class _Asset:
+    def __init__(self, path, content_type, cache_control):
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.variants = {}  # encoding ('identity', 'br', 'gzip') -> _Variant
+
+
+class StaticAssets:
+    def __init__(self, build_dir, compress=True):
+        self.build_dir = build_dir
+        self.compress = compress
+        self.routes = {}
+        self.index = None
+        if os.path.isdir(build_dir):
+            self._scan()
+
+    @classmethod
+    def from_env(cls, build_dir):
+        return cls(build_dir, compress=os.environ.get('STATIC_COMPRESS', '1') not in ('0', 'false', 'no'))
+
+    def _scan(self):
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                if name.endswith(suffixes):
+                    continue  # Served as a variant of the uncompressed file
+                path = os.path.join(root, name)
+                url_path = os.path.relpath(path, self.build_dir).replace(os.sep, '/')
+                self.routes[url_path] = self._load(path, url_path)
+        self.index = self.routes.get('index.html')
+        if self.index is not None:
+            # Served for every client-side route, so the identity body is kept in memory too
+            identity = self.index.variants['identity']
+            with open(self.index.path, 'rb') as f:
+                identity.data = f.read()
+
+    def _load(self, path, url_path):
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        asset = _Asset(path, content_type, IMMUTABLE if url_path.startswith('static/') else REVALIDATE)
+        asset.variants['identity'] = _Variant(path)
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                asset.variants[encoding] = _Variant(path + suffix)
+        if self.compress and asset.content_type.startswith(COMPRESSIBLE_TYPES) \
+                and asset.variants['identity'].size >= MIN_COMPRESS_SIZE:
+            self._compress(asset)
+        return asset
+
+    @staticmethod
+    def _compress(asset):
+        with open(asset.path, 'rb') as f:
+            data = f.read()
+        if 'gzip' not in asset.variants:
+            asset.variants['gzip'] = _Variant(data=gzip.compress(data, 9, mtime=0))
+        if brotli is not None and 'br' not in asset.variants:
+            asset.variants['br'] = _Variant(data=brotli.compress(data))
+
+    def lookup(self, path):
+        """The asset for a URL path, index.html for client-side routes, or None without a build"""
+        return self.routes.get(path.lstrip('/'), self.index)
+
+    def response(self, asset):
+        """Serve an asset in the best encoding the client accepts, or 304 if its copy is current"""
+        encoding = 'identity'
+        for candidate, _ in ENCODINGS:
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        variant = asset.variants[encoding]
+        etag = variant.etag if encoding == 'identity' else f'{variant.etag}-{encoding}'
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif variant.data is not None:
+            response = Response(variant.data, content_type=asset.content_type)
+        else:
+            response = send_file(variant.path, mimetype=asset.content_type, conditional=False, etag=False)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = asset.cache_control
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        if encoding != 'identity' and response.status_code == 200:
+            response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,175 @@
+"""
+Time-window coalescing of streamed deltas
+
+Upstream models usually send one token per SSE event. Relaying each one
+as its own frame costs a write per token on the server and a React state
+update per token in the browser. The coalescers here batch deltas into a
+single frame every `interval_ms` or once `max_bytes` are buffered,
+whichever comes first. The first delta is always flushed immediately so
+time-to-first-token is unchanged.
+
+Deltas are read on a background thread (or task) so a stalled upstream
+never holds buffered text past the window.
+"""
+import asyncio
+import queue
+import threading
+import time
+
+from request_errors import number_setting
+
+
+DEFAULT_INTERVAL_MS = 50
+DEFAULT_MAX_BYTES = 1024
+
+_END = object()
+_WINDOW_ELAPSED = object()
+
+
+def coalesce_settings(data, config=None):
+    """Resolve coalescing settings from the request body, then the configuration.
+
+    Request fields `coalesce_ms` / `coalesce_bytes` override the
+    configuration's `settings.coalesceMs` / `settings.coalesceBytes`.
+    Returns None when coalescing is disabled, otherwise a dict with
+    `interval_ms` and `max_bytes`. Non-numeric values raise ChatRequestError.
+    """
+    settings = (config or {}).get('settings') or {}
+    interval_ms = data.get('coalesce_ms', settings.get('coalesceMs'))
+    max_bytes = data.get('coalesce_bytes', settings.get('coalesceBytes'))
+    if not interval_ms and not max_bytes:
+        return None
+    return {
+        'interval_ms': number_setting(interval_ms or DEFAULT_INTERVAL_MS, 'coalesce_ms'),
+        'max_bytes': number_setting(max_bytes or DEFAULT_MAX_BYTES, 'coalesce_bytes', int)
+    }
+
+
+def _size(chunk):
+    return len(chunk) if isinstance(chunk, bytes) else len(chunk.encode('utf-8'))
+
+
+def coalesce_deltas(deltas, interval_ms=DEFAULT_INTERVAL_MS, max_bytes=DEFAULT_MAX_BYTES):
+    """Batch a str or bytes delta iterator into larger chunks.
+
+    The first delta passes straight through. Later deltas are buffered
+    and flushed when the window elapses, the buffer reaches max_bytes,
+    or the source ends.
+    """
+    interval = interval_ms / 1000.0
+    pending = queue.Queue()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for delta in deltas:
+                pending.put(delta)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            pending.put(e)
+        finally:
+            close = getattr(deltas, 'close', None)
+            if close is not None:
+                close()
+            pending.put(_END)
+
+    thread = threading.Thread(target=reader, name='stream-coalescer', daemon=True)
+    thread.start()
+
+    try:
+        first = pending.get()
+        if first is _END:
+            return
+        if isinstance(first, Exception):
+            raise first
+        yield first
+
+        buffer = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = pending.get(timeout=timeout)
+            except queue.Empty:
+                item = _WINDOW_ELAPSED
+
+            if item is _WINDOW_ELAPSED or item is _END or isinstance(item, Exception):
+                # Window elapsed or source finished: flush what we have
+                if buffer:
+                    yield buffer[0][:0].join(buffer)
+                    buffer, size, deadline = [], 0, None
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                continue
+
+            if not buffer:
+                deadline = time.monotonic() + interval
+            buffer.append(item)
+            size += _size(item)
+            if size >= max_bytes:
+                yield buffer[0][:0].join(buffer)
+                buffer, size, deadline = [], 0, None
+    finally:
+        stop.set()
+
+
+async def acoalesce_deltas(deltas, interval_ms=DEFAULT_INTERVAL_MS, max_bytes=DEFAULT_MAX_BYTES):
+    """Async counterpart of coalesce_deltas for async delta iterators"""
+    interval = interval_ms / 1000.0
+    pending = asyncio.Queue()
+
+    async def reader():
+        try:
+            async for delta in deltas:
+                await pending.put(delta)
+        except Exception as e:
+            await pending.put(e)
+        finally:
+            await pending.put(_END)
+
+    task = asyncio.ensure_future(reader())
+    loop = asyncio.get_running_loop()
+
+    try:
+        first = await pending.get()
+        if first is _END:
+            return
+        if isinstance(first, Exception):
+            raise first
+        yield first
+
+        buffer = []
+        size = 0
+        deadline = None
+        while True:
+            try:
+                if deadline is None:
+                    item = await pending.get()
+                else:
+                    item = await asyncio.wait_for(pending.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                item = _WINDOW_ELAPSED
+
+            if item is _WINDOW_ELAPSED or item is _END or isinstance(item, Exception):
+                if buffer:
+                    yield buffer[0][:0].join(buffer)
+                    buffer, size, deadline = [], 0, None
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                continue
+
+            if not buffer:
+                deadline = loop.time() + interval
+            buffer.append(item)
+            size += _size(item)
+            if size >= max_bytes:
+                yield buffer[0][:0].join(buffer)
+                buffer, size, deadline = [], 0, None
+    finally:
+        task.cancel()
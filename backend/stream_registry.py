@@ -0,0 +1,307 @@
+"""
+Registry of cancellable chat streams, shared across worker processes
+
+Every relayed chat stream is registered under an ID that the client can
+pass to /api/chat/stop. The relay loops call `is_cancelled` once per
+upstream event, so that check is a dict lookup (plus one byte read for
+the shared-memory backend) and never takes a lock or makes a syscall.
+
+With a single worker the in-process `LocalStreamRegistry` (the default)
+is enough. With several workers the stop request may reach a different
+process than the one relaying the stream, so STREAM_REGISTRY selects a
+backend that can reach the owner:
+
+- `shm`: fixed-size slots in a memory-mapped file shared by all workers.
+  A slot holds the stream ID, the owner's pid and a cancel byte. Stopping
+  a stream sets the byte in place, and the owner sees it on its next check.
+- `socket`: each worker listens on a Unix socket in a shared directory.
+  A stop for a stream this worker does not own is sent to the other
+  sockets until one of them reports that it owns the stream.
+
+Both shared backends keep their files in STREAM_REGISTRY_DIR.
+"""
+import atexit
+import glob
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the local registry is available
+    fcntl = None
+
+from structured_logging import get_logger
+
+
+log = get_logger('stream')
+
+
+class LocalStreamRegistry:
+    """Cancel flags for the streams relayed by this process"""
+
+    def __init__(self):
+        self._flags = {}
+        self._lock = threading.Lock()
+
+    def register(self, stream_id=None):
+        """Register a stream (under a new ID unless one is given) and return its ID"""
+        stream_id = stream_id or str(uuid.uuid4())
+        with self._lock:
+            self._flags[stream_id] = False
+        return stream_id
+
+    def is_cancelled(self, stream_id):
+        """Check whether a stream was stopped or already released"""
+        # Hot path: a single dict read, atomic under the GIL
+        return self._flags.get(stream_id, True)
+
+    def cancel(self, stream_id):
+        """Mark a stream as cancelled; returns False if it is not registered"""
+        with self._lock:
+            if stream_id not in self._flags:
+                return False
+            self._flags[stream_id] = True
+            return True
+
+    def release(self, stream_id):
+        """Forget a finished stream; returns False if it was already released"""
+        with self._lock:
+            return self._flags.pop(stream_id, None) is not None
+
+    def __contains__(self, stream_id):
+        return stream_id in self._flags
+
+    def close(self):
+        pass
+
+
+class SharedMemoryStreamRegistry:
+    """Stream slots in a memory-mapped file, so any worker can set another's cancel flag"""
+
+    ID_SIZE = 36  # str(uuid4())
+    PID_OFFSET = ID_SIZE
+    FLAG_OFFSET = ID_SIZE + 4
+    SLOT_SIZE = 48
+
+    def __init__(self, path, slots=4096):
+        if fcntl is None:
+            raise RuntimeError('The shm stream registry needs fcntl (POSIX only)')
+        self.path = path
+        self.slots = slots
+        self._offsets = {}  # Streams owned by this process
+        self._next = 0
+        self._lock = threading.Lock()
+        size = slots * self.SLOT_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _locked(self):
+        return _FileLock(self._fd, self._lock)
+
+    def _slot_id(self, stream_id):
+        encoded = stream_id.encode('ascii')
+        if len(encoded) > self.ID_SIZE:
+            raise ValueError(f'Stream ID longer than {self.ID_SIZE} bytes: {stream_id}')
+        return encoded.ljust(self.ID_SIZE, b'\0')
+
+    def register(self, stream_id=None):
+        stream_id = stream_id or str(uuid.uuid4())
+        slot_id = self._slot_id(stream_id)
+        with self._locked():
+            offset = self._free_slot()
+            self._map[offset + self.PID_OFFSET:offset + self.FLAG_OFFSET] = os.getpid().to_bytes(4, 'little')
+            self._map[offset + self.FLAG_OFFSET] = 0
+            self._map[offset:offset + self.ID_SIZE] = slot_id
+            self._offsets[stream_id] = offset
+        return stream_id
+
+    def _free_slot(self):
+        for reclaim in (False, True):
+            for i in range(self.slots):
+                index = (self._next + i) % self.slots
+                offset = index * self.SLOT_SIZE
+                if self._map[offset] == 0 or (reclaim and not self._owner_alive(offset)):
+                    self._next = index + 1
+                    return offset
+        raise RuntimeError(f'Stream registry {self.path} is full ({self.slots} streams)')
+
+    def _owner_alive(self, offset):
+        # Slots left behind by a worker that died mid-stream
+        pid = int.from_bytes(self._map[offset + self.PID_OFFSET:offset + self.FLAG_OFFSET], 'little')
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def is_cancelled(self, stream_id):
+        offset = self._offsets.get(stream_id)
+        return offset is None or self._map[offset + self.FLAG_OFFSET] != 0
+
+    def cancel(self, stream_id):
+        try:
+            slot_id = self._slot_id(stream_id)
+        except (ValueError, UnicodeEncodeError):
+            return False
+        with self._locked():
+            offset = self._map.find(slot_id)
+            while offset != -1 and offset % self.SLOT_SIZE:
+                offset = self._map.find(slot_id, offset + 1)
+            if offset == -1:
+                return False
+            self._map[offset + self.FLAG_OFFSET] = 1
+            return True
+
+    def release(self, stream_id):
+        with self._locked():
+            offset = self._offsets.pop(stream_id, None)
+            if offset is None:
+                return False
+            self._map[offset:offset + self.SLOT_SIZE] = bytes(self.SLOT_SIZE)
+            return True
+
+    def __contains__(self, stream_id):
+        return stream_id in self._offsets
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _FileLock:
+    """Thread lock plus a POSIX record lock, serializing slot changes across workers"""
+
+    def __init__(self, fd, lock):
+        self.fd = fd
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+        return False
+
+
+class SocketStreamRegistry(LocalStreamRegistry):
+    """Local cancel flags plus a Unix socket per worker for stops that land elsewhere"""
+
+    def __init__(self, directory, timeout=0.5):
+        super().__init__()
+        self.directory = directory
+        self.timeout = timeout
+        self._server = None
+        self._server_pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.directory, f'{os.getpid()}.sock')
+
+    def register(self, stream_id=None):
+        self._ensure_listening()
+        return super().register(stream_id)
+
+    def _ensure_listening(self):
+        # Started lazily (and again after fork) so each worker process owns its listener
+        if self._server_pid == os.getpid():
+            return
+        with self._lock:
+            if self._server_pid == os.getpid():
+                return
+            path = self.socket_path
+            if os.path.exists(path):
+                os.remove(path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(64)
+            self._server, self._server_pid = server, os.getpid()
+            threading.Thread(target=self._serve, args=(server,), name='stream-registry', daemon=True).start()
+            atexit.register(self._remove_socket, path)
+
+    def _serve(self, server):
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    conn.settimeout(self.timeout)
+                    stream_id = _read_line(conn)
+                    conn.sendall(b'1' if super().cancel(stream_id) else b'0')
+                except (OSError, UnicodeDecodeError):
+                    pass
+
+    def cancel(self, stream_id):
+        if super().cancel(stream_id):
+            return True
+        own = self.socket_path
+        for path in glob.glob(os.path.join(self.directory, '*.sock')):
+            if path != own and self._cancel_remote(path, stream_id):
+                return True
+        return False
+
+    def _cancel_remote(self, path, stream_id):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.settimeout(self.timeout)
+                conn.connect(path)
+                conn.sendall(stream_id.encode('utf-8') + b'\n')
+                return conn.recv(1) == b'1'
+        except (ConnectionRefusedError, FileNotFoundError):
+            # A worker that exited without removing its socket
+            self._remove_socket(path)
+        except OSError as e:
+            log.warning('⚠️ Could not reach stream registry socket', path=path, error=str(e))
+        return False
+
+    @staticmethod
+    def _remove_socket(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._server is not None and self._server_pid == os.getpid():
+            self._server.close()
+            self._remove_socket(self.socket_path)
+        self._server = self._server_pid = None
+
+
+def _read_line(conn):
+    data = b''
+    while not data.endswith(b'\n') and len(data) < 256:
+        chunk = conn.recv(256)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode('utf-8').strip()
+
+
+def stream_registry_from_env():
+    """Pick the stream registry named by STREAM_REGISTRY (local, shm or socket)"""
+    kind = os.environ.get('STREAM_REGISTRY', 'local')
+    directory = os.environ.get('STREAM_REGISTRY_DIR') or os.path.join(tempfile.gettempdir(), 'michael_chat-streams')
+    if kind == 'shm':
+        os.makedirs(directory, exist_ok=True)
+        return SharedMemoryStreamRegistry(
+            os.path.join(directory, 'streams.shm'),
+            slots=int(os.environ.get('STREAM_REGISTRY_SLOTS', '4096'))
+        )
+    if kind == 'socket':
+        return SocketStreamRegistry(directory)
+    if kind != 'local':
+        raise ValueError(f'Unknown STREAM_REGISTRY: {kind}')
+    return LocalStreamRegistry()
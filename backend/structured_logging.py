@@ -0,0 +1,241 @@
+"""
+Structured, sampled logging that never blocks the request thread
+
+The proxy used to print every request body, upstream payload and
+streamed token to stdout. That meant formatting multi-megabyte base64
+images on the request thread, and it was a large share of CPU and I/O.
+Loggers from `get_logger(category)` instead take a message plus keyword
+fields:
+
+    log = get_logger('request')
+    log.debug('Chat request', data=data)
+
+- Records below the configured level cost one `isEnabledFor` check.
+  LOG_LEVEL sets the default and LOG_LEVELS (`stream=DEBUG,cache=WARNING`)
+  overrides it per category.
+- Below WARNING, a category can be sampled with LOG_SAMPLE
+  (`request=0.1,stream=0.01`). Dropped records are never formatted.
+- Accepted records go on a bounded queue. When the queue is full they are
+  dropped and counted, so logging never waits on I/O.
+- Formatting happens on a listener thread: text lines, or JSON lines with
+  LOG_FORMAT=json. Fields are redacted there. Keys, tokens and auth headers
+  are masked. Images and other large base64 or bytes values are replaced
+  by their size and a SHA-256 prefix, and long strings are truncated.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+ROOT_LOGGER = 'michael_chat'
+
+SECRET_KEYS = frozenset(('api_key', 'apikey', 'authorization', 'x-api-key', 'password', 'token', 'secret'))
+BASE64_CHARS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=_-')
+MAX_STRING = 1000  # Longer strings are truncated; long base64 strings are hashed
+_loggers = {}
+_handler = None
+_configure_lock = threading.Lock()
+
+
+def parse_category_map(spec, convert):
+    """Parse 'category=value,...' into a dict"""
+    result = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            category, value = item.split('=', 1)
+            result[category.strip()] = convert(value.strip())
+    return result
+
+
+def summarize_blob(value):
+    """Size and hash standing in for image data or other large binary-ish values"""
+    data = value.encode('utf-8', 'surrogatepass') if isinstance(value, str) else bytes(value)
+    return {'bytes': len(data), 'sha256': hashlib.sha256(data).hexdigest()[:16]}
+
+
+def _looks_like_blob(text):
+    if text.startswith('data:') and ';base64,' in text[:100]:
+        return True
+    return len(text) > MAX_STRING and BASE64_CHARS.issuperset(text[:256].encode('ascii', 'replace'))
+
+
+def redact(value):
+    """Copy of a log field with secrets masked and image/blob data summarized"""
+    if isinstance(value, dict):
+        return {
+            key: '[redacted]' if isinstance(key, str) and key.lower() in SECRET_KEYS and value[key] else redact(value[key])
+            for key in list(value)
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return summarize_blob(value)
+    if isinstance(value, str):
+        if _looks_like_blob(value):
+            return summarize_blob(value)
+        if len(value) > MAX_STRING:
+            return f'{value[:MAX_STRING]}…(+{len(value) - MAX_STRING} chars)'
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a LOG_SAMPLE fraction of each category's records below WARNING"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'category', None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record, as text or JSON, with redacted fields"""
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        try:
+            fields = redact(getattr(record, 'fields', None) or {})
+        except RuntimeError:
+            # The request mutated a field while it was being redacted
+            fields = {'fields': '[changed while logging]'}
+        if self.json_lines:
+            entry = {
+                'ts': record.created,
+                'level': record.levelname,
+                'category': getattr(record, 'category', record.name),
+                'msg': record.getMessage(),
+                **fields
+            }
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+        line = f"{self.formatTime(record)} {record.levelname} [{getattr(record, 'category', record.name)}] {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f'{key}={json.dumps(value, default=str, ensure_ascii=False)}' for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a listener thread through a bounded queue, dropping them when it is full"""
+
+    def __init__(self, handlers, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target_handlers = handlers
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Formatting and redaction happen on the listener thread
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_listener(self):
+        # Started lazily (and again after fork) so each worker process owns its thread
+        if self._listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener_pid == os.getpid():
+                return
+            if self._listener_pid is not None:
+                self.queue = queue.Queue(self.maxsize)
+            self._listener = _Listener(self.queue, *self.target_handlers, respect_handler_level=True)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def stop(self):
+        """Write out queued records and stop the listener thread"""
+        with self._start_lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+            self._listener = self._listener_pid = None
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Only stop() sends this, so it may wait for room to drain the queue first
+        self.queue.put(self._sentinel)
+
+
+class StructuredLogger:
+    """Logger taking keyword fields, e.g. log.info('Stream started', stream_id=stream_id)"""
+
+    def __init__(self, category):
+        self.category = category
+        self.logger = logging.getLogger(f'{ROOT_LOGGER}.{category}')
+
+    def is_enabled_for(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, exc_info=False, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={'category': self.category, 'fields': fields})
+
+    def debug(self, msg, exc_info=False, **fields):
+        self.log(logging.DEBUG, msg, exc_info=exc_info, **fields)
+
+    def info(self, msg, exc_info=False, **fields):
+        self.log(logging.INFO, msg, exc_info=exc_info, **fields)
+
+    def warning(self, msg, exc_info=False, **fields):
+        self.log(logging.WARNING, msg, exc_info=exc_info, **fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self.log(logging.ERROR, msg, exc_info=exc_info, **fields)
+
+
+def configure_logging(stream=None):
+    """Install the queue handler on the michael_chat logger from LOG_* settings (once per process)"""
+    global _handler
+    with _configure_lock:
+        if _handler is not None:
+            return _handler
+        target = logging.StreamHandler(stream or sys.stdout)
+        target.setFormatter(StructuredFormatter(json_lines=os.environ.get('LOG_FORMAT', 'text') == 'json'))
+        handler = NonBlockingQueueHandler([target], maxsize=int(os.environ.get('LOG_QUEUE_SIZE', '10000')))
+        handler.addFilter(SamplingFilter(parse_category_map(os.environ.get('LOG_SAMPLE'), float)))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        root.addHandler(handler)
+        root.propagate = False
+        for category, level in parse_category_map(os.environ.get('LOG_LEVELS'), str.upper).items():
+            logging.getLogger(f'{ROOT_LOGGER}.{category}').setLevel(level)
+        atexit.register(handler.stop)
+        _handler = handler
+        return handler
+
+
+def get_logger(category):
+    """Structured logger for a category such as 'request', 'upstream' or 'stream'"""
+    logger = _loggers.get(category)
+    if logger is None:
+        logger = _loggers.setdefault(category, StructuredLogger(category))
+    return logger
@@ -0,0 +1,268 @@
+"""
+Pooled keep-alive HTTP sessions for upstream model endpoints
+
+Sessions are keyed by (scheme, host, port) so every request to the same
+endpoint reuses warm TCP/TLS connections instead of paying a fresh
+handshake. UpstreamPool wraps requests sessions for the Flask path and
+AsyncUpstreamPool wraps httpx clients (optionally HTTP/2) for asgi.py.
+"""
+import importlib.util
+import os
+import threading
+import time
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import json_codec
+from structured_logging import get_logger
+
+
+log = get_logger('upstream')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def endpoint_key(url):
+    """Return the (scheme, host, port) pool key for a URL"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    return scheme, (parts.hostname or '').lower(), parts.port or DEFAULT_PORTS.get(scheme)
+
+
+def format_key(key):
+    scheme, host, port = key
+    return f'{scheme}://{host}:{port}'
+
+
+def pool_settings_from_env():
+    """Read pool settings from UPSTREAM_* environment variables"""
+    return {
+        'pool_size': int(os.environ.get('UPSTREAM_POOL_SIZE', '10')),
+        'keep_alive': os.environ.get('UPSTREAM_KEEPALIVE', '1') not in ('0', 'false', 'no'),
+        'idle_timeout': float(os.environ.get('UPSTREAM_IDLE_TIMEOUT', '90')),
+        'http2': os.environ.get('UPSTREAM_HTTP2', '0') in ('1', 'true', 'yes'),
+    }
+
+
+class _PoolEntry:
+    def __init__(self, client, now):
+        self.client = client
+        self.created_at = now
+        self.last_used = now
+        self.hits = 0
+        self.active = 0
+
+
+class _KeyedPool:
+    """Shared bookkeeping: per-endpoint entries, idle eviction and hit/miss stats"""
+
+    def __init__(self, pool_size=10, keep_alive=True, idle_timeout=90.0, http2=False):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.http2 = http2
+        self._entries = {}
+        self._entries_pid = os.getpid()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        settings = pool_settings_from_env()
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def _checkout(self, url):
+        """Return the entry for url's endpoint plus any idle entries to close"""
+        key = endpoint_key(url)
+        now = time.monotonic()
+        with self._lock:
+            if self._entries_pid != os.getpid():
+                # Forked (e.g. a preloading server): the parent's sockets must not be shared, nor closed here
+                self._entries, self._entries_pid = {}, os.getpid()
+            evicted = self._pop_idle(now, exclude=key)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                entry = _PoolEntry(self._create_client(), now)
+                self._entries[key] = entry
+            else:
+                self.hits += 1
+                entry.hits += 1
+            entry.last_used = now
+            entry.active += 1
+        return entry, evicted
+
+    def _checkin(self, entry):
+        with self._lock:
+            entry.active = max(0, entry.active - 1)
+            entry.last_used = time.monotonic()
+
+    def _pop_idle(self, now, exclude=None):
+        if self.idle_timeout is None:
+            return []
+        idle_keys = [
+            key for key, entry in self._entries.items()
+            if key != exclude and entry.active == 0 and now - entry.last_used > self.idle_timeout
+        ]
+        self.evictions += len(idle_keys)
+        return [self._entries.pop(key) for key in idle_keys]
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    def _entry_stats(self, entry):
+        return {}
+
+    def get_stats(self):
+        """Return pool-wide and per-endpoint hit/miss statistics"""
+        now = time.monotonic()
+        with self._lock:
+            endpoints = {}
+            for key, entry in self._entries.items():
+                endpoints[format_key(key)] = {
+                    'hits': entry.hits,
+                    'active': entry.active,
+                    'idle_seconds': round(now - entry.last_used, 3),
+                    'age_seconds': round(now - entry.created_at, 3),
+                    **self._entry_stats(entry)
+                }
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+                'pool_size': self.pool_size,
+                'keep_alive': self.keep_alive,
+                'idle_timeout': self.idle_timeout,
+                'http2': self.http2,
+                'endpoints': endpoints
+            }
+
+
+class UpstreamPool(_KeyedPool):
+    """requests sessions keyed by endpoint, shared by all outbound calls in api.py"""
+
+    def _create_client(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # Sessions are shared between users, so never carry upstream cookies across requests
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def session_for(self, url):
+        """Return the pooled session for url's endpoint"""
+        entry, evicted = self._checkout(url)
+        self._checkin(entry)
+        for stale in evicted:
+            stale.client.close()
+        return entry.client
+
+    def post(self, url, json=None, **kwargs):
+        """POST through the pooled session for url's endpoint"""
+        if json is not None:
+            # Serialized with the fast codec instead of requests' stdlib json
+            headers = dict(kwargs.get('headers') or {})
+            if not any(name.lower() == 'content-type' for name in headers):
+                headers['Content-Type'] = 'application/json'
+            kwargs['headers'] = headers
+            kwargs['data'] = json_codec.dumps_bytes(json)
+        entry, evicted = self._checkout(url)
+        for stale in evicted:
+            stale.client.close()
+        try:
+            response = entry.client.post(url, **kwargs)
+        except BaseException:
+            self._checkin(entry)
+            raise
+        if kwargs.get('stream'):
+            self._hold_until_released(entry, response)
+        else:
+            self._checkin(entry)
+        return response
+
+    def _hold_until_released(self, entry, response):
+        """Keep entry checked out (safe from idle eviction) until a streamed body is read or closed"""
+        raw = getattr(response, 'raw', None)
+        release_conn = getattr(raw, 'release_conn', None)
+        if release_conn is None:
+            self._checkin(entry)
+            return
+        # urllib3 releases the connection when the body is exhausted and when the response is closed
+        checkin = weakref.finalize(response, self._checkin, entry)
+
+        def release():
+            release_conn()
+            checkin()
+        raw.release_conn = release
+
+    def _entry_stats(self, entry):
+        # urllib3 counts every connection it opened and every request it sent
+        connections = requests_sent = 0
+        for adapter in set(entry.client.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+        return {'connections_opened': connections, 'requests_sent': requests_sent}
+
+    def close(self):
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            entry.client.close()
+
+
+class AsyncUpstreamPool(_KeyedPool):
+    """httpx.AsyncClient instances keyed by endpoint, used by the asyncio chat path"""
+
+    def __init__(self, pool_size=100, keep_alive=True, idle_timeout=90.0, http2=False, **client_kwargs):
+        # httpx raises ImportError for every request when HTTP/2 is asked for without h2
+        if http2 and importlib.util.find_spec('h2') is None:
+            log.warning('⚠️ HTTP/2 needs the h2 package (pip install h2); using HTTP/1.1')
+            http2 = False
+        super().__init__(pool_size=pool_size, keep_alive=keep_alive, idle_timeout=idle_timeout, http2=http2)
+        self.client_kwargs = client_kwargs
+
+    def _create_client(self):
+        import httpx
+
+        return httpx.AsyncClient(
+            http2=self.http2,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size if self.keep_alive else 0,
+                keepalive_expiry=self.idle_timeout
+            ),
+            **self.client_kwargs
+        )
+
+    async def acquire(self, url):
+        """Check out the client for url's endpoint; pair every call with release()"""
+        entry, evicted = self._checkout(url)
+        for stale in evicted:
+            await stale.client.aclose()
+        return entry
+
+    def release(self, entry):
+        self._checkin(entry)
+
+    async def aclose(self):
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            await entry.client.aclose()
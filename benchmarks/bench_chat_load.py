@@ -0,0 +1,331 @@
+"""
+End-to-end load benchmark for /api/chat against a local mock upstream
+
+Drives a running chat server with N concurrent streaming chats. The
+upstream is mock_upstream.py, started in a separate process unless
+--upstream points at one, so the numbers measure the proxy rather than a
+model (or the load generator competing with the mock for the GIL).
+Reports client-side time to first token (p50/p95/p99), relayed tokens
+per second, errors, and CPU time and peak RSS of every server process
+(read from /proc, so Linux only).
+
+    # Start the server under test, then:
+    python benchmarks/bench_chat_load.py --concurrency 50 --requests 500 --server-pid $(pgrep -f uvicorn)
+
+    # Or let the benchmark start it:
+    python benchmarks/bench_chat_load.py --server-cmd "uvicorn asgi:app --app-dir backend --port 8000"
+
+--save-baseline writes the results to a JSON file. --baseline compares
+against such a file and exits with status 1 when a latency figure grew,
+or throughput fell, by more than --tolerance (default 20%).
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_upstream import add_profile_arguments, profile_from_args, start_process
+
+# Baseline checks: metric -> 'lower' (latency, may not grow) or 'higher' (throughput, may not fall)
+GATED_METRICS = {
+    'ttft_p50_ms': 'lower',
+    'ttft_p95_ms': 'lower',
+    'ttft_p99_ms': 'lower',
+    'tokens_per_sec': 'higher',
+    'requests_per_sec': 'higher',
+    'cpu_seconds_per_request': 'lower',
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_chat(connection, path, body):
+    """Send one chat request and read the SSE reply; returns a result dict"""
+    started = time.perf_counter()
+    result = {'status': None, 'ttft': None, 'tokens': 0, 'duration': None, 'error': None}
+    try:
+        connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result['status'] = response.status
+        if response.status != 200:
+            response.read()
+            result['error'] = f'HTTP {response.status}'
+            return result
+        event, frames = '', 0
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            line = line.rstrip(b'\r\n')
+            if not line:
+                event = ''
+                continue
+            if line.startswith(b'event:'):
+                event = line[6:].strip().decode()
+                continue
+            if event or not line.startswith(b'data:'):
+                continue  # Metadata events such as the final stage timings
+            frames += 1
+            if frames == 1 or line == b'data: [DONE]':
+                continue  # The stream_id frame, and the end marker passthrough mode relays
+            if line.startswith(b'data: Error:'):
+                result['error'] = 'stream error'
+            if result['ttft'] is None:
+                result['ttft'] = time.perf_counter() - started
+            result['tokens'] += 1
+    except (OSError, http.client.HTTPException) as e:
+        result['error'] = type(e).__name__
+        connection.close()
+    finally:
+        result['duration'] = time.perf_counter() - started
+    return result
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process and its descendants from /proc"""
+
+    def __init__(self, root_pid, interval=0.25):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.start_cpu = {}
+        self.last_cpu = {}
+        self.peak_rss = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pids(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                stat = self._stat(int(entry))
+                if stat:
+                    children.setdefault(int(stat[1]), []).append(int(entry))
+        found, pending = [], [self.root_pid]
+        while pending:
+            pid = pending.pop()
+            found.append(pid)
+            pending.extend(children.get(pid, []))
+        return found
+
+    @staticmethod
+    def _stat(pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # Fields after the parenthesized command name, which may contain spaces
+                return f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            return None
+
+    def _cpu_seconds(self, pid):
+        stat = self._stat(pid)
+        return (int(stat[11]) + int(stat[12])) / self.clock_ticks if stat else None
+
+    @staticmethod
+    def _rss_bytes(pid):
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError):
+            return None
+
+    def sample(self):
+        for pid in self.pids():
+            cpu = self._cpu_seconds(pid)
+            rss = self._rss_bytes(pid)
+            if cpu is None:
+                continue
+            self.start_cpu.setdefault(pid, cpu)
+            self.last_cpu[pid] = cpu
+            self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss or 0)
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return {
+            str(pid): {
+                'cpu_seconds': round(self.last_cpu[pid] - self.start_cpu[pid], 3),
+                'peak_rss_mb': round(self.peak_rss[pid] / 2 ** 20, 1),
+            }
+            for pid in sorted(self.last_cpu)
+        }
+
+
+def wait_for_server(base_url, timeout=30):
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+            connection.request('GET', '/api/health')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f'Server at {base_url} did not become healthy within {timeout}s')
+
+
+def run_load(base_url, upstream_url, concurrency, total, extra=None):
+    """Run `total` chats over `concurrency` keep-alive connections"""
+    parts = urlsplit(base_url)
+    path = (parts.path.rstrip('/') or '') + '/api/chat'
+    body = json.dumps(dict({'api_url': upstream_url, 'model': 'mock', 'message': 'Benchmark'}, **(extra or {})))
+    remaining = iter(range(total))
+    lock = threading.Lock()
+    results = []
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            result = run_chat(connection, path, body)
+            if result['error']:
+                connection.close()
+            with lock:
+                results.append(result)
+        connection.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, processes):
+    ok = [r for r in results if not r['error']]
+    ttfts = [r['ttft'] * 1000 for r in ok if r['ttft'] is not None]
+    tokens = sum(r['tokens'] for r in ok)
+    cpu = sum(p['cpu_seconds'] for p in processes.values())
+    return {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'elapsed_sec': round(elapsed, 3),
+        'requests_per_sec': round(len(ok) / elapsed, 2) if elapsed else None,
+        'tokens_per_sec': round(tokens / elapsed, 1) if elapsed else None,
+        'ttft_p50_ms': _round(percentile(ttfts, 50)),
+        'ttft_p95_ms': _round(percentile(ttfts, 95)),
+        'ttft_p99_ms': _round(percentile(ttfts, 99)),
+        'cpu_seconds_per_request': round(cpu / len(ok), 5) if ok and processes else None,
+        'processes': processes,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def compare(summary, baseline, tolerance):
+    """Regressions of gated metrics against a baseline, as readable messages"""
+    failures = []
+    for name, better in GATED_METRICS.items():
+        current, reference = summary.get(name), baseline.get(name)
+        if current is None or not reference:
+            continue
+        change = (current - reference) / reference
+        if (better == 'lower' and change > tolerance) or (better == 'higher' and -change > tolerance):
+            failures.append(f'{name}: {current} vs baseline {reference} ({change:+.0%})')
+    if summary['errors'] > baseline.get('errors', 0) + tolerance * summary['requests']:
+        failures.append(f"errors: {summary['errors']} vs baseline {baseline.get('errors', 0)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='base URL of the chat server')
+    parser.add_argument('--concurrency', type=int, default=20, help='concurrent streams')
+    parser.add_argument('--requests', type=int, default=200, help='total chat requests')
+    parser.add_argument('--warmup', type=int, default=5, help='requests sent before measuring')
+    parser.add_argument('--upstream', help='chat completions URL of an already running mock upstream')
+    parser.add_argument('--stream-mode', choices=['text', 'passthrough'], default='text')
+    parser.add_argument('--server-cmd', help='command that starts the server under test')
+    parser.add_argument('--server-pid', type=int, help='pid of the server under test (its children are included)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='fail when results regress past this stored result file')
+    parser.add_argument('--save-baseline', help='store the results as a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression as a fraction')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    upstream, upstream_url = None, args.upstream
+    if not upstream_url:
+        upstream, upstream_url = start_process(profile_from_args(args))
+
+    server = None
+    if args.server_cmd:
+        server = subprocess.Popen(shlex.split(args.server_cmd))
+    try:
+        wait_for_server(args.url)
+        extra = {'stream_mode': 'passthrough'} if args.stream_mode == 'passthrough' else {}
+        if args.warmup:
+            run_load(args.url, upstream_url, min(args.concurrency, args.warmup), args.warmup, extra)
+
+        root_pid = server.pid if server else args.server_pid
+        sampler = ProcessSampler(root_pid) if root_pid and os.path.isdir('/proc') else None
+        if sampler:
+            sampler.start()
+        results, elapsed = run_load(args.url, upstream_url, args.concurrency, args.requests, extra)
+        processes = sampler.stop() if sampler else {}
+    finally:
+        if server:
+            server.terminate()
+            server.wait(10)
+        if upstream:
+            upstream.terminate()
+
+    summary = summarize(results, elapsed, processes)
+    summary['settings'] = {
+        'concurrency': args.concurrency, 'stream_mode': args.stream_mode,
+        'upstream': {'ttft_ms': args.ttft_ms, 'token_rate': args.token_rate, 'jitter_ms': args.jitter_ms,
+                     'tokens': args.tokens, 'error_rate': args.error_rate} if upstream else args.upstream,
+    }
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(summary, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f'REGRESSION {failure}', file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark ConfigurationManager lookups as the number of configurations grows
+
+Compares the indexed lookups with the linear scans they replaced (name
+duplicate check, active configuration, (apiUrl, model) match and the
+sorted listing). Indexed lookups should stay flat as the store grows.
+The listing is still O(n), since callers get their own copy, but it is a
+copy of a cached list rather than a sort.
+
+    python benchmarks/bench_config_indexes.py --sizes 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from config_manager import ConfigurationManager
+from config_storage import JsonFileStorage
+
+
+def build_manager(size, directory):
+    """A manager holding `size` configurations, loaded without writing each one"""
+    path = os.path.join(directory, f'configs-{size}.json')
+    manager = ConfigurationManager(config_file=path, storage=JsonFileStorage(path))
+    start = datetime(2024, 1, 1)
+    for i in range(size):
+        config_id = str(uuid.uuid4())
+        created = (start + timedelta(seconds=i)).isoformat()
+        manager.configurations[config_id] = {
+            'id': config_id,
+            'name': f'Config {i}',
+            'apiUrl': f'http://host-{i % 500}.example/v1/chat/completions',
+            'apiKey': '',
+            'model': f'model-{i}',
+            'isActive': i == size // 2,
+            'supportsImages': None,
+            'imageTestAt': None,
+            'settings': {},
+            'createdAt': created,
+            'updatedAt': created
+        }
+    manager._rebuild_indexes()
+    return manager
+
+
+def scan_name(manager, name):
+    return any(c['name'].lower() == name.lower() for c in manager.configurations.values())
+
+
+def scan_active(manager):
+    return next((c for c in manager.configurations.values() if c['isActive']), None)
+
+
+def scan_endpoint(manager, api_url, model):
+    for config in sorted(manager.configurations.values(), key=lambda c: c['createdAt'], reverse=True):
+        if config['apiUrl'] == api_url and (config.get('model') or '') == (model or ''):
+            return config
+    return None
+
+
+def scan_listing(manager):
+    return sorted(manager.configurations.values(), key=lambda c: c['createdAt'], reverse=True)
+
+
+def bench(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--number', type=int, default=200, help='calls per timing sample')
+    args = parser.parse_args()
+
+    print(f"{'configs':>8}  {'operation':<18} {'indexed µs':>12} {'scan µs':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            manager = build_manager(size, directory)
+            last = manager.get_all_configurations()[-1]
+            cases = [
+                ('name check', lambda: 'new config' in manager._by_name, lambda: scan_name(manager, 'New Config')),
+                ('active', manager.get_active_configuration, lambda: scan_active(manager)),
+                ('endpoint match', lambda: manager.find_by_endpoint(last['apiUrl'], last['model']),
+                 lambda: scan_endpoint(manager, last['apiUrl'], last['model'])),
+                ('listing', manager.get_all_configurations, lambda: scan_listing(manager)),
+            ]
+            for label, indexed, scan in cases:
+                number = args.number if label != 'listing' else max(1, args.number // 20)
+                print(f"{size:>8}  {label:<18} {bench(indexed, number):>12.2f} {bench(scan, max(1, number // 10)):>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Micro-benchmarks for the per-request and per-token code paths in the backend
+
+Each case runs on synthetic inputs sized by the command line options:
+
+- build_messages: the upstream messages array from `--history` prior
+  turns, with `--images` images of `--image-kb` KB in the current turn
+- stream_response: SSE parsing and delta extraction for `--deltas`
+  events of `--delta-size` characters (re-framed and passthrough)
+- handle_streaming_response: buffering the same stream into one reply
+- config save/load: JSON snapshot of `--configs` configurations
+
+Every size listed is benchmarked, e.g. `--history 10 100 1000`.
+
+    python benchmarks/bench_hot_paths.py --output hot_paths.json
+    python benchmarks/bench_hot_paths.py --baseline hot_paths.json --tolerance 0.15
+
+Results are JSON: one entry per case and parameter set, with the median
+and best time per call (and per delta for the streaming cases). With
+--baseline the run exits with status 1 when a median got slower by more
+than --tolerance.
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+# Per-stream INFO logs would otherwise dominate the streaming cases
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import api
+from config_manager import ConfigurationManager
+from config_storage import JsonFileStorage
+from flask import Flask
+
+
+class SyntheticResponse:
+    """Stands in for a streaming requests.Response holding a fixed body"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+def sse_body(deltas, delta_size):
+    content = ('x' * (delta_size - 1) + ' ')[:delta_size]
+    event = ('data: ' + json.dumps({'choices': [{'index': 0, 'delta': {'content': content}}]}) + '\n\n').encode()
+    return event * deltas + b'data: [DONE]\n\n'
+
+
+def conversation_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({'sender': 'user', 'content': f'Question {i} ' + 'lorem ipsum ' * 20})
+        history.append({'sender': 'ai', 'content': f'Answer {i} ' + 'dolor sit amet ' * 40})
+    return history
+
+
+def request_images(count, kb):
+    encoded = base64.b64encode(os.urandom(kb * 1024)).decode()
+    return [{'url': f'data:image/png;base64,{encoded}'} for _ in range(count)]
+
+
+def build_configurations(count):
+    start = datetime(2024, 1, 1)
+    configurations = {}
+    for i in range(count):
+        config_id = str(uuid.uuid4())
+        created = (start + timedelta(seconds=i)).isoformat()
+        configurations[config_id] = {
+            'id': config_id, 'name': f'Config {i}', 'apiUrl': f'http://host-{i % 500}.example/v1/chat/completions',
+            'apiKey': 'sk-' + 'k' * 40, 'model': f'model-{i}', 'isActive': i == 0, 'supportsImages': None,
+            'imageTestAt': None, 'settings': {}, 'createdAt': created, 'updatedAt': created
+        }
+    return configurations
+
+
+def measure(fn, repeat):
+    """Median and best seconds per call, auto-scaling calls per sample to ~0.2s"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return statistics.median(samples), min(samples), number
+
+
+def streaming_cases(args):
+    app = Flask(__name__)  # handle_streaming_response builds its reply with jsonify
+    for deltas in args.deltas:
+        for size in args.delta_size:
+            body = sse_body(deltas, size)
+            params = {'deltas': deltas, 'delta_size': size}
+
+            def relay(passthrough):
+                stream_id = api.stream_registry.register()
+                for _ in api.stream_response(SyntheticResponse(body), stream_id, passthrough=passthrough):
+                    pass
+
+            def buffer():
+                with app.app_context():
+                    api.handle_streaming_response(SyntheticResponse(body))
+
+            yield 'stream_response', params, deltas, lambda: relay(False)
+            yield 'stream_response_passthrough', params, deltas, lambda: relay(True)
+            yield 'handle_streaming_response', params, deltas, buffer
+
+
+def message_cases(args):
+    for turns in args.history:
+        history = conversation_history(turns)
+        for count in args.images:
+            images = request_images(count, args.image_kb)
+            params = {'history': turns, 'images': count, 'image_kb': args.image_kb}
+            yield 'build_messages', params, None, lambda: api.build_messages('Hello', images, history)
+
+
+def config_cases(args, directory):
+    for count in args.configs:
+        path = os.path.join(directory, f'configs-{count}.json')
+        storage = JsonFileStorage(path)
+        configurations = build_configurations(count)
+        storage.save(configurations)
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager = ConfigurationManager(config_file=path, storage=storage)
+
+        def load():
+            with contextlib.redirect_stdout(io.StringIO()):
+                manager.load_configurations()
+
+        yield 'config_save', {'configs': count}, None, lambda: storage.save(configurations)
+        yield 'config_load', {'configs': count}, None, load
+
+
+def run(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        groups = {'messages': message_cases(args), 'streaming': streaming_cases(args),
+                  'config': config_cases(args, directory)}
+        for group, cases in groups.items():
+            if args.only and group not in args.only:
+                continue
+            for name, params, per, fn in cases:
+                median, best, number = measure(fn, args.repeat)
+                result = {'name': name, 'params': params, 'median_us': round(median * 1e6, 2),
+                          'best_us': round(best * 1e6, 2), 'calls_per_sample': number}
+                if per:
+                    result['median_us_per_delta'] = round(median * 1e6 / per, 4)
+                results.append(result)
+                print(f"{name:<28} {json.dumps(params):<48} {result['median_us']:>14.2f} µs", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Cases whose median slowed down by more than `tolerance` against a baseline run"""
+    reference = {(r['name'], json.dumps(r['params'], sort_keys=True)): r['median_us'] for r in baseline['results']}
+    failures = []
+    for result in results:
+        before = reference.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if before and (result['median_us'] - before) / before > tolerance:
+            failures.append(f"{result['name']} {json.dumps(result['params'])}: "
+                            f"{result['median_us']} µs vs baseline {before} µs")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', type=int, nargs='+', default=[10, 100, 1000], help='prior turns')
+    parser.add_argument('--images', type=int, nargs='+', default=[0, 4], help='images in the current turn')
+    parser.add_argument('--image-kb', type=int, default=256, help='size of each image')
+    parser.add_argument('--deltas', type=int, nargs='+', default=[1000], help='SSE events per stream')
+    parser.add_argument('--delta-size', type=int, nargs='+', default=[4, 64], help='characters per delta')
+    parser.add_argument('--configs', type=int, nargs='+', default=[100, 1000, 10000], help='stored configurations')
+    parser.add_argument('--only', nargs='+', choices=['messages', 'streaming', 'config'])
+    parser.add_argument('--repeat', type=int, default=5, help='timing samples per case')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown as a fraction')
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'results': run(args)}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(report['results'], json.load(f), args.tolerance)
+        for failure in failures:
+            print(f'REGRESSION {failure}', file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+JSON codec comparison on the payloads the proxy handles per request and per token
+
+For every installed codec (see backend/json_codec.py):
+
+- decode_chat_body: parsing a /api/chat body with `--history` prior turns
+  and `--images` base64 images of `--image-kb` KB
+- encode_upstream_payload: serializing the upstream request built from it
+- delta_content: decoding one upstream streaming chunk into its delta text
+- encode_delta_event: serializing one relayed chunk (passthrough mode)
+
+    python benchmarks/bench_json_codec.py
+    python benchmarks/bench_json_codec.py --history 0 1000 --images 4 --image-kb 1024
+
+Results are JSON with the median time per call of each case and codec,
+plus the speedup over the stdlib codec.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_hot_paths import conversation_history, measure, request_images
+
+import api
+from json_codec import CODECS, _INSTALLED, create_codec
+
+# A chunk as OpenAI-compatible servers send it: the proxy only needs choices[0].delta.content
+STREAM_CHUNK = {
+    'id': 'chatcmpl-9f8e7d6c5b4a', 'object': 'chat.completion.chunk', 'created': 1700000000,
+    'model': 'gpt-4o-mini-2024-07-18', 'system_fingerprint': 'fp_0123456789',
+    'choices': [{'index': 0, 'delta': {'content': ' token'}, 'logprobs': None, 'finish_reason': None}],
+}
+DELTA_EVENT = {'choices': [{'index': 0, 'delta': {'content': ' token'}, 'finish_reason': None}]}
+
+
+def cases(args):
+    chunk = json.dumps(STREAM_CHUNK).encode()
+    for turns in args.history:
+        history = conversation_history(turns)
+        for count in args.images:
+            images = request_images(count, args.image_kb)
+            body = json.dumps({'message': 'Hello', 'model': 'mock', 'images': images,
+                               'conversation_history': history}).encode()
+            payload = {'model': 'mock', 'messages': api.build_messages('Hello', images, history), 'stream': True}
+            params = {'history': turns, 'images': count, 'image_kb': args.image_kb}
+            yield 'decode_chat_body', params, lambda codec: lambda: codec.loads(body)
+            yield 'encode_upstream_payload', params, lambda codec: lambda: codec.dumps_bytes(payload)
+    yield 'delta_content', {}, lambda codec: lambda: codec.delta_content(chunk)
+    yield 'encode_delta_event', {}, lambda codec: lambda: codec.dumps_bytes(DELTA_EVENT)
+
+
+def run(args):
+    codecs = [create_codec(name) for name in args.codecs if _INSTALLED[name]]
+    results = []
+    for name, params, make in cases(args):
+        timings = {}
+        for codec in codecs:
+            median, _, _ = measure(make(codec), args.repeat)
+            timings[codec.name] = round(median * 1e6, 3)
+        result = {'name': name, 'params': params, 'median_us': timings}
+        if 'stdlib' in timings:
+            result['speedup'] = {codec: round(timings['stdlib'] / us, 2) for codec, us in timings.items() if us}
+        results.append(result)
+        print(f"{name:<24} {json.dumps(params):<44} "
+              + '  '.join(f'{codec} {us:.2f} µs' for codec, us in timings.items()), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', type=int, nargs='+', default=[10, 100], help='prior turns')
+    parser.add_argument('--images', type=int, nargs='+', default=[0, 2], help='images in the current turn')
+    parser.add_argument('--image-kb', type=int, default=256, help='size of each image')
+    parser.add_argument('--codecs', nargs='+', choices=sorted(CODECS), default=list(CODECS))
+    parser.add_argument('--repeat', type=int, default=5, help='timing samples per case')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    text = json.dumps({'python': sys.version.split()[0], 'results': run(args)}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
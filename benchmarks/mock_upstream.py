@@ -0,0 +1,185 @@
+"""
+Local OpenAI-compatible upstream for load benchmarks
+
+Answers POST .../chat/completions with a streamed SSE reply (or a single
+JSON reply when the payload has "stream": false). The shape of the reply
+is configurable: time to first token, token rate, per-token jitter, reply
+length and a fraction of requests that fail with an error status.
+
+    python benchmarks/mock_upstream.py --port 9100 --ttft-ms 300 --token-rate 50 --error-rate 0.01
+
+bench_chat_load.py starts one in a child process (see start_process)
+unless --upstream is given.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN = 'token '
+
+
+@dataclass
+class UpstreamProfile:
+    ttft_ms: float = 200.0
+    token_rate: float = 50.0  # Tokens per second after the first one
+    jitter_ms: float = 5.0  # Uniform +/- jitter added to every delay
+    tokens: int = 100
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def delay(self, base_ms):
+        return max(0.0, base_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The proxy dropping an idle keep-alive connection is not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockUpstream:
+    """Threaded HTTP server streaming synthetic chat completions"""
+
+    def __init__(self, profile=None, host='127.0.0.1', port=0):
+        self.profile = profile or UpstreamProfile()
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = _QuietServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1/chat/completions'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                profile = upstream.profile
+                failed = random.random() < profile.error_rate
+                with upstream._lock:
+                    upstream.requests += 1
+                    upstream.errors += failed
+                try:
+                    payload = json.loads(body or b'{}')
+                except ValueError:
+                    payload = {}
+
+                time.sleep(profile.delay(profile.ttft_ms))
+                if failed:
+                    self._send_body(profile.error_status, 'text/plain', b'Injected upstream error')
+                elif payload.get('stream', True):
+                    self._stream(profile, payload.get('model') or 'mock')
+                else:
+                    reply = {'choices': [{'message': {'role': 'assistant', 'content': TOKEN * profile.tokens}}]}
+                    self._send_body(200, 'application/json', json.dumps(reply).encode())
+
+            def _send_body(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, profile, model):
+                # Chunked, so the proxy can keep the connection alive like with a real upstream
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                gap_ms = 1000 / profile.token_rate if profile.token_rate > 0 else 0
+                try:
+                    for i in range(profile.tokens):
+                        if i:
+                            time.sleep(profile.delay(gap_ms))
+                        chunk = {'model': model, 'choices': [{'index': 0, 'delta': {'content': TOKEN}}]}
+                        self._write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode())
+                    self._write_chunk(b'data: [DONE]\n\n')
+                    self._write_chunk(b'')
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # The proxy cancelled the stream
+
+            def _write_chunk(self, data):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+
+def _serve_in_child(profile, ready):
+    upstream = MockUpstream(profile)
+    ready.send(upstream.url)
+    ready.close()
+    upstream.serve_forever()
+
+
+def start_process(profile):
+    """Run a MockUpstream in a child process, off the caller's GIL; returns (process, url)"""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_serve_in_child, args=(profile, sender), name='mock-upstream', daemon=True)
+    process.start()
+    return process, receiver.recv()
+
+
+def add_profile_arguments(parser):
+    defaults = UpstreamProfile()
+    parser.add_argument('--ttft-ms', type=float, default=defaults.ttft_ms, help='delay before the first token')
+    parser.add_argument('--token-rate', type=float, default=defaults.token_rate, help='tokens per second')
+    parser.add_argument('--jitter-ms', type=float, default=defaults.jitter_ms, help='uniform jitter on each delay')
+    parser.add_argument('--tokens', type=int, default=defaults.tokens, help='tokens per reply')
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=defaults.error_status)
+
+
+def profile_from_args(args):
+    return UpstreamProfile(ttft_ms=args.ttft_ms, token_rate=args.token_rate, jitter_ms=args.jitter_ms,
+                           tokens=args.tokens, error_rate=args.error_rate, error_status=args.error_status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(profile_from_args(args), args.host, args.port)
+    print(f'Mock upstream on {upstream.url}')
+    try:
+        upstream.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
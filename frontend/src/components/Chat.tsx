@@ -29,6 +29,8 @@ const Chat = forwardRef((
   const [isLoading, setIsLoading] = useState(false);
   const [images, setImages] = useState<Array<{ id: string; file: File; url: string; name: string; size: number }>>([]);
   const [currentStreamId, setCurrentStreamId] = useState<string | null>(null);
+  // Server-side conversation, so only the new turn is sent with each message
+  const conversationIdRef = useRef<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLInputElement>(null);
 
@@ -42,6 +44,11 @@ const Chat = forwardRef((
 
   const clearChat = () => {
     setMessages([]);
+    // Drop the server-side conversation; the next message starts a new one
+    if (conversationIdRef.current) {
+      fetch(`/api/conversations/${conversationIdRef.current}`, { method: 'DELETE' }).catch(() => {});
+      conversationIdRef.current = null;
+    }
     // Clear images and revoke object URLs
     images.forEach(img => URL.revokeObjectURL(img.url));
     setImages([]);
@@ -129,12 +136,36 @@ const Chat = forwardRef((
     });
   };
 
+  // Upload an image to the server's content-addressed store once; returns its hash
+  const uploadImage = async (file: File): Promise<string | undefined> => {
+    try {
+      if (window.crypto?.subtle) {
+        // Skip the upload entirely if the server already has these bytes
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        const hash = Array.from(new Uint8Array(digest)).map(b => ('0' + b.toString(16)).slice(-2)).join('');
+        const existing = await fetch(`/api/images/${hash}`, { method: 'HEAD' });
+        if (existing.ok) return hash;
+      }
+      const formData = new FormData();
+      formData.append('file', file);
+      const response = await fetch('/api/images', { method: 'POST', body: formData });
+      if (response.ok) return (await response.json()).hash as string;
+    } catch (error) {
+      console.error('Image upload failed, sending it inline instead:', error);
+    }
+    return undefined;
+  };
+
   const sendMessage = async (content: string, messageImages?: Array<{ id: string; file: File; url: string; name: string; size: number }>) => {
     if (!content.trim() && (!messageImages || messageImages.length === 0)) return;
 
-    // Convert image files to base64 data URLs
+    // Send images by blob store hash, falling back to inline base64 data URLs
     const processedImages = messageImages ? await Promise.all(
-      messageImages.map(async (img) => {
+      messageImages.map(async (img): Promise<{ id: string; name: string; size: number; hash?: string; url?: string }> => {
+        const hash = await uploadImage(img.file);
+        if (hash) {
+          return { id: img.id, hash, name: img.name, size: img.size };
+        }
         const base64Url = await convertFileToBase64(img.file);
         return {
           id: img.id,
@@ -151,7 +182,7 @@ const Chat = forwardRef((
       content,
       sender: 'user',
       timestamp: new Date(),
-      images: messageImages
+      images: messageImages?.map((img, index) => ({ ...img, hash: processedImages[index].hash }))
     };
     
     const updatedMessages = [...messages, userMessage];
@@ -171,18 +202,41 @@ const Chat = forwardRef((
             id: img.id,
             name: img.name,
             size: img.size,
+            hash: img.hash, // Lets the backend resend the image from its blob store
             url: 'about:blank' // Don't send user's local object URLs to the backend
           }))
         };
       });
 
+      // Create the server-side conversation on first use, seeded with any existing history
+      let conversationId = conversationIdRef.current;
+      if (!conversationId) {
+        try {
+          const conversationResponse = await fetch('/api/conversations', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ messages: sanitizedHistory })
+          });
+          if (conversationResponse.ok) {
+            conversationId = (await conversationResponse.json()).id as string;
+            conversationIdRef.current = conversationId;
+          }
+        } catch (error) {
+          console.error('Failed to create conversation, sending full history instead:', error);
+        }
+      }
+
       const requestBody = {
         message: content,
         images: processedImages,
         api_url: apiUrl,
         api_key: apiKey,
         model: model,
-        conversation_history: sanitizedHistory  // Send sanitized history
+        configuration_id: activeConfiguration?.id,
+        // The server holds the history once a conversation exists; otherwise send it all
+        ...(conversationId
+          ? { conversation_id: conversationId }
+          : { conversation_history: sanitizedHistory })
       };
       
       console.log('Sending chat request:', requestBody);
@@ -208,6 +262,8 @@ const Chat = forwardRef((
             let aiMessageId = (Date.now() + 1).toString();
             let isFirstStreamChunk = true;
             let buffer = '';
+            // Name of the SSE event being read; named events (e.g. the final `timing` one) carry metadata, not reply text
+            let eventName = '';
             
             // Set a temporary stream ID immediately to show stop button
             const tempStreamId = 'temp-' + Date.now();
@@ -231,8 +287,19 @@ const Chat = forwardRef((
                 const lines = buffer.split('\n');
                 buffer = lines.pop() || ''; // Keep incomplete line in buffer
                 
+                // Collect all content from this read so the message list is updated once per chunk
+                let pendingContent = '';
+                
                 for (const line of lines) {
-                  if (line.trim() === '') continue; // Skip empty lines
+                  if (line.trim() === '') {
+                    eventName = ''; // A blank line ends the event
+                    continue;
+                  }
+                  if (line.startsWith('event: ')) {
+                    eventName = line.substring(7).trim();
+                    continue;
+                  }
+                  if (eventName && eventName !== 'message') continue;
                   
                   // Check for stream ID in the first chunk
                   if (isFirstStreamChunk && line.includes('stream_id')) {
@@ -259,19 +326,24 @@ const Chat = forwardRef((
                       content = "\n";
                     }
                     
-                    // Update the AI message with new content
-                    setMessages(prevMessages => {
-                      return prevMessages.map(msg => {
-                        if (msg.id === aiMessageId) {
-                          // Replace placeholder dots with first real content
-                          const currentContent = msg.content === '...' ? '' : msg.content;
-                          return { ...msg, content: currentContent + content };
-                        }
-                        return msg;
-                      });
-                    });
+                    pendingContent += content;
                   }
                 }
+                
+                if (pendingContent) {
+                  const newContent = pendingContent;
+                  // Update the AI message with new content
+                  setMessages(prevMessages => {
+                    return prevMessages.map(msg => {
+                      if (msg.id === aiMessageId) {
+                        // Replace placeholder dots with first real content
+                        const currentContent = msg.content === '...' ? '' : msg.content;
+                        return { ...msg, content: currentContent + newContent };
+                      }
+                      return msg;
+                    });
+                  });
+                }
               }
             }
             
@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useCallback, FormEvent, useRef } from 'react';
-import { Configuration, ConfigurationInput } from '../types/types';
+import { Configuration, ConfigurationInput, BackgroundJob } from '../types/types';
 import { FaPlus, FaCheckCircle, FaTimesCircle, FaQuestionCircle, FaInfoCircle, FaTrash, FaEdit, FaPlay, FaPowerOff, FaSave, FaEye, FaEyeSlash } from 'react-icons/fa';
 
 interface ConfigurationProps {
@@ -62,6 +62,24 @@ const ConfigurationComponent: React.FC<ConfigurationProps> = ({ onConfigurationC
     loadConfigurations();
   }, [loadConfigurations]);
 
+  // Image support is tested in the background after saving; reload once the job finishes
+  const watchJob = useCallback(async (jobId: string) => {
+    for (let attempt = 0; attempt < 60; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      try {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        if (!response.ok) return;
+        const job: BackgroundJob = await response.json();
+        if (job.status !== 'pending' && job.status !== 'running') {
+          await loadConfigurations();
+          return;
+        }
+      } catch {
+        return;
+      }
+    }
+  }, [loadConfigurations]);
+
   const handleSubmit = async (e: FormEvent) => {
     e.preventDefault();
     if (!formData.name.trim() || !formData.apiUrl.trim()) {
@@ -95,6 +113,10 @@ const ConfigurationComponent: React.FC<ConfigurationProps> = ({ onConfigurationC
         if (!isEditing && configurations.length === 0) {
           onConfigurationChangeRef.current(data);
         }
+
+        if (data.imageTestJob) {
+          watchJob(data.imageTestJob.id);
+        }
       } else {
         throw new Error(data.error || 'Failed to save configuration');
       }
@@ -9,9 +9,41 @@ export interface ChatMessage {
     url: string;
     name: string;
     size: number;
+    hash?: string; // SHA-256 of the image in the server's blob store
   }>;
 }
 
+export interface ConfigurationSettings {
+  coalesceMs?: number;
+  coalesceBytes?: number;
+  contextTokens?: number;
+  contextStrategy?: 'drop' | 'summarize';
+  imageMaxDimension?: number;
+  imageFormat?: 'jpeg' | 'webp';
+  imageQuality?: number;
+  responseCache?: boolean;
+  cacheTtl?: number;
+  cachePaceMs?: number;
+}
+
+export interface ConfigurationHealth {
+  status: 'healthy' | 'unhealthy';
+  checked_at: string;
+  latency_ms: number;
+  avg_latency_ms: number | null;
+  last_success: string | null;
+  consecutive_failures: number;
+  supports_images: boolean | null;
+}
+
+export interface BackgroundJob {
+  id: string;
+  kind?: string;
+  status: 'pending' | 'running' | 'succeeded' | 'failed' | 'superseded';
+  result?: unknown;
+  error?: string | null;
+}
+
 export interface Configuration {
   id: string;
   name: string;
@@ -21,6 +53,9 @@ export interface Configuration {
   isActive: boolean;
   supportsImages?: boolean | null;
   imageTestAt?: string | null;
+  imageTestJob?: BackgroundJob; // Returned by create/update while the image support test runs
+  settings?: ConfigurationSettings;
+  health?: ConfigurationHealth; // Cached result from the backend's health monitor
   createdAt: Date;
   updatedAt: Date;
 }
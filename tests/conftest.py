@@ -5,6 +5,7 @@ This file contains common fixtures used across multiple test files to avoid
 code duplication and ensure consistent test setup.
 """
 
+import asyncio
 import pytest
 import os
 import tempfile
@@ -12,6 +13,8 @@ import sys
 from pathlib import Path
 from unittest.mock import patch
 
+import httpx
+
 # Add backend directory to path to import modules
 backend_path = str(Path(__file__).parent.parent / 'backend')
 sys.path.insert(0, backend_path)
@@ -21,6 +24,8 @@ try:
     from server import create_app
     from config_manager import ConfigurationManager
     import api
+    from asgi import AsyncChatApp
+    from upstream_pool import AsyncUpstreamPool
 except ImportError as e:
     print(f"Import error: {e}")
     print(f"Backend path: {backend_path}")
@@ -70,6 +75,63 @@ def client(app_with_temp_config):
     return app_with_temp_config.test_client()
 
 
+ASGI_SSE_BODY = (
+    'data: {"choices": [{"delta": {"content": "Hello"}}]}\n\n'
+    'data: {"choices": [{"delta": {"content": " world"}}]}\n\n'
+    'data: [DONE]\n\n'
+)
+
+
+def make_asgi_app(handler):
+    """Build an AsyncChatApp whose upstream client uses a mock transport."""
+    return AsyncChatApp(pool=AsyncUpstreamPool(transport=httpx.MockTransport(handler)))
+
+
+def run_asgi_once(app, body, path='/api/chat', method='POST'):
+    """Call the ASGI app once and collect the status, headers and body chunks."""
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'path': path,
+        'root_path': '', 'headers': [], 'query_string': b'', 'server': ('testserver', 80)
+    }
+    request_sent = False
+    result = {'status': None, 'headers': {}, 'chunks': []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            result['headers'] = {k.decode(): v.decode() for k, v in message['headers']}
+        elif message['type'] == 'http.response.body' and message.get('body'):
+            result['chunks'].append(message['body'].decode())
+
+    asyncio.run(app(scope, receive, send))
+    return result
+
+
+@pytest.fixture
+def sse_body():
+    """A two-token upstream SSE reply ending with [DONE]."""
+    return ASGI_SSE_BODY
+
+
+@pytest.fixture
+def make_app():
+    """Factory for AsyncChatApps backed by a mock upstream transport."""
+    return make_asgi_app
+
+
+@pytest.fixture
+def run_asgi():
+    """Helper that calls an ASGI app once and collects its response."""
+    return run_asgi_once
+
+
 def validate_chat_response(response, message_context=""):
     """Helper function to validate chat response structure."""
     context = f" for message: '{message_context}'" if message_context else ""
@@ -18,6 +18,16 @@ sys.path.insert(0, backend_path)
 
 # Import the api module
 import api
+from stream_registry import LocalStreamRegistry
+
+
+def registry_with(stream_id, cancelled=False):
+    """An in-process stream registry holding one registered stream."""
+    registry = LocalStreamRegistry()
+    registry.register(stream_id)
+    if cancelled:
+        registry.cancel(stream_id)
+    return registry
 
 
 class TestChatAPIErrorHandling:
@@ -75,7 +85,7 @@ class TestChatAPIErrorHandling:
         # Should process the conversation history and make request
         assert response.status_code in [200, 500, 502, 503]
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_chat_request_exception_handling(self, mock_post, client):
         """Test chat API request exception handling (lines 164-166)."""
         mock_post.side_effect = requests.RequestException("Connection failed")
@@ -89,7 +99,7 @@ class TestChatAPIErrorHandling:
         assert response.status_code == 500
         assert 'Request failed: Connection failed' in response.json['error']
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_chat_general_exception_handling(self, mock_post, client):
         """Test chat API general exception handling (lines 167-169)."""
         mock_post.side_effect = ValueError("Unexpected error")
@@ -103,7 +113,7 @@ class TestChatAPIErrorHandling:
         assert response.status_code == 500
         assert 'Internal server error: Unexpected error' in response.json['error']
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_chat_api_error_response(self, mock_post, client):
         """Test chat API when external API returns error (lines 157-162)."""
         mock_response = Mock()
@@ -120,6 +130,20 @@ class TestChatAPIErrorHandling:
         assert response.status_code == 404
         assert 'API request failed with status 404' in response.json['error']
         assert 'Model not found' in response.json['details']
+    
+    @patch('api.upstream_pool.post')
+    def test_chat_non_numeric_coalescing_setting(self, mock_post, client):
+        """Test a non-numeric coalescing setting is a 400 raised before the upstream call."""
+        chat_data = {
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Test message',
+            'coalesce_ms': 'fast'
+        }
+        
+        response = client.post('/api/chat', json=chat_data)
+        assert response.status_code == 400
+        assert 'coalesce_ms must be a number' in response.json['error']
+        mock_post.assert_not_called()
 
 
 class TestExternalAPIHealthErrorHandling:
@@ -133,7 +157,7 @@ class TestExternalAPIHealthErrorHandling:
         assert response.json['health_status'] == 'unhealthy'
         assert 'api_url' in response.json['error']
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_external_api_request_exception(self, mock_post, client):
         """Test external API health request exception handling (lines 328-334)."""
         mock_post.side_effect = requests.RequestException("Network error")
@@ -150,7 +174,7 @@ class TestExternalAPIHealthErrorHandling:
         assert 'Request failed: Network error' in response.json['error']
         assert response.json['error_type'] == 'connection_error'
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_external_api_general_exception(self, mock_post, client):
         """Test external API health general exception handling (lines 335-341)."""
         mock_post.side_effect = ValueError("Unexpected error")
@@ -166,7 +190,7 @@ class TestExternalAPIHealthErrorHandling:
         assert 'Unexpected error' in response.json['error']
         assert response.json['error_type'] == 'internal_error'
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_external_api_json_decode_error(self, mock_post, client):
         """Test external API health with JSON decode error (lines 242, 252-253)."""
         mock_response = Mock()
@@ -185,7 +209,7 @@ class TestExternalAPIHealthErrorHandling:
         assert response.json['health_status'] == 'unhealthy'
         assert 'API returned non-JSON response' in response.json['error']
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_external_api_streaming_response_parsing(self, mock_post, client):
         """Test external API health with streaming response parsing (lines 227-236)."""
         mock_response = Mock()
@@ -210,7 +234,7 @@ class TestImageSupportTesting:
     
     @patch('api.open', mock_open(read_data=b'fake_image_data'))
     @patch('api.os.path.join')
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_image_support_with_local_file(self, mock_post, mock_join, client):
         """Test image support testing with local file (lines 358-362)."""
         mock_join.return_value = '/fake/path/chat_favicon_32x32.jpg'
@@ -222,7 +246,7 @@ class TestImageSupportTesting:
         assert result is True
     
     @patch('api.open')
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_image_support_file_not_found(self, mock_post, mock_open_func, client):
         """Test image support testing when image file not found (lines 363-365)."""
         mock_open_func.side_effect = FileNotFoundError("File not found")
@@ -233,7 +257,7 @@ class TestImageSupportTesting:
         result = api.test_image_support('http://test-api.com', 'test-key', 'test-model')
         assert result is True
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_image_support_failure_response(self, mock_post, client):
         """Test image support testing with failure response (lines 400-401)."""
         mock_response = Mock()
@@ -244,7 +268,7 @@ class TestImageSupportTesting:
         result = api.test_image_support('http://test-api.com', 'test-key', 'test-model')
         assert result is False
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_image_support_unexpected_error(self, mock_post, client):
         """Test image support testing with unexpected error (lines 403-405)."""
         mock_response = Mock()
@@ -255,7 +279,7 @@ class TestImageSupportTesting:
         with pytest.raises(Exception, match="Unexpected error during image support test"):
             api.test_image_support('http://test-api.com', 'test-key', 'test-model')
     
-    @patch('api.requests.post')
+    @patch('api.upstream_pool.post')
     def test_image_support_request_exception(self, mock_post, client):
         """Test image support testing with request exception."""
         mock_post.side_effect = requests.RequestException("Network error")
@@ -267,46 +291,46 @@ class TestImageSupportTesting:
 class TestStreamingFunctionality:
     """Test suite for streaming response functionality."""
     
-    @patch('api.active_streams', {'test-stream-id': {'cancelled': False}})
+    @patch('api.stream_registry', registry_with('test-stream-id'))
     def test_stream_response_normal_flow(self, client):
         """Test stream_response generator function (lines 415-454)."""
         from api import stream_response
         
         # Mock response with streaming data
         mock_response = Mock()
-        mock_response.iter_lines.return_value = [
-            'data: {"choices": [{"delta": {"content": "Hello"}}]}',
-            'data: {"choices": [{"delta": {"content": " world"}}]}',
-            'data: [DONE]'
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"delta": {"content": "Hello"}}]}\n\n',
+            b'data: {"choices": [{"delta": {"content": " world"}}]}\n\n',
+            b'data: [DONE]\n\n'
         ]
         
         # Collect streaming content
         content_chunks = list(stream_response(mock_response, 'test-stream-id'))
         assert content_chunks == ['Hello', ' world']
     
-    @patch('api.active_streams', {'test-stream-id': {'cancelled': True}})
+    @patch('api.stream_registry', registry_with('test-stream-id', cancelled=True))
     def test_stream_response_cancelled_stream(self, client):
         """Test stream_response with cancelled stream (lines 422-424)."""
         from api import stream_response
         
         mock_response = Mock()
-        mock_response.iter_lines.return_value = [
-            'data: {"choices": [{"delta": {"content": "Hello"}}]}'
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"delta": {"content": "Hello"}}]}\n\n'
         ]
         
         # Should stop immediately due to cancellation
         content_chunks = list(stream_response(mock_response, 'test-stream-id'))
         assert content_chunks == []
     
-    @patch('api.active_streams', {'stream-id': {'cancelled': False}})
+    @patch('api.stream_registry', registry_with('stream-id'))
     def test_stream_response_json_decode_error(self, client):
         """Test stream_response with JSON decode error (lines 441-443)."""
         from api import stream_response
         
         mock_response = Mock()
-        mock_response.iter_lines.return_value = [
-            'data: invalid-json',
-            'data: {"choices": [{"delta": {"content": "valid"}}]}'
+        mock_response.iter_content.return_value = [
+            b'data: invalid-json\n\n',
+            b'data: {"choices": [{"delta": {"content": "valid"}}]}\n\n'
         ]
         
         # Should skip invalid JSON and continue
@@ -318,7 +342,7 @@ class TestStreamingFunctionality:
         from api import stream_response
         
         mock_response = Mock()
-        mock_response.iter_lines.side_effect = Exception("Network error")
+        mock_response.iter_content.side_effect = Exception("Network error")
         
         # Should yield error message
         content_chunks = list(stream_response(mock_response, 'stream-id'))
@@ -330,9 +354,9 @@ class TestStreamingFunctionality:
         from api import handle_streaming_response
         
         mock_response = Mock()
-        mock_response.iter_lines.return_value = [
-            'data: {"error": "API error occurred"}',
-            'data: [DONE]'
+        mock_response.iter_content.return_value = [
+            b'data: {"error": "API error occurred"}\n\n',
+            b'data: [DONE]\n\n'
         ]
         
         # Need to test within Flask application context
@@ -347,9 +371,9 @@ class TestStreamingFunctionality:
         from api import handle_streaming_response
         
         mock_response = Mock()
-        mock_response.iter_lines.return_value = [
-            'data: invalid-json-content',
-            'data: [DONE]'
+        mock_response.iter_content.return_value = [
+            b'data: invalid-json-content\n\n',
+            b'data: [DONE]\n\n'
         ]
         
         # Need to test within Flask application context
@@ -375,7 +399,7 @@ class TestStreamingFunctionality:
 class TestChatStopEndpoint:
     """Test suite for chat stop functionality."""
     
-    @patch('api.active_streams', {'test-stream-id': {'cancelled': False}})
+    @patch('api.stream_registry', registry_with('test-stream-id'))
     def test_chat_stop_success(self, client):
         """Test successful stream cancellation."""
         response = client.post('/api/chat/stop', json={'stream_id': 'test-stream-id'})
@@ -383,8 +407,7 @@ class TestChatStopEndpoint:
         assert response.json['message'] == 'Stream stopped successfully'
         
         # Check that stream was marked as cancelled
-        from api import active_streams
-        assert active_streams['test-stream-id']['cancelled'] is True
+        assert api.stream_registry.is_cancelled('test-stream-id') is True
     
     def test_chat_stop_missing_stream_id(self, client):
         """Test chat stop without stream_id."""
@@ -0,0 +1,134 @@
+"""
+Tests for the asyncio chat path in asgi.py.
+
+The upstream model is replaced with an httpx.MockTransport (the
+make_app and run_asgi fixtures in conftest.py) so the tests exercise the
+real ASGI handler without any network access.
+"""
+import json
+import sys
+import threading
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+
+
+class TestAsyncChatApp:
+    """Test suite for the async /api/chat handler."""
+
+    def test_streams_sse_with_stream_id_first(self, make_app, run_asgi, sse_body):
+        """Test the async path keeps the Flask SSE framing."""
+        app = make_app(lambda request: httpx.Response(
+            200, headers={'content-type': 'text/event-stream'}, content=sse_body))
+
+        result = run_asgi(app, json.dumps({'api_url': 'http://upstream/v1/chat', 'message': 'Hi'}).encode())
+
+        assert result['status'] == 200
+        assert 'text/event-stream' in result['headers']['content-type']
+        assert result['chunks'][0].startswith('data: {"stream_id": "')
+        assert result['chunks'][1:-1] == ['data: Hello\n\n', 'data:  world\n\n']
+        assert result['chunks'][-1].startswith('event: timing\ndata: {"timing": {"parse": ')
+        # The stream is unregistered once finished
+        stream_id = json.loads(result['chunks'][0][6:])['stream_id']
+        assert stream_id not in api.stream_registry
+
+    def test_request_is_built_off_the_event_loop(self, monkeypatch, make_app, run_asgi, sse_body):
+        """Test configuration, history and request building run on executor threads, not the event loop's."""
+        threads = {}
+
+        def recording(name):
+            original = getattr(api, name)
+
+            def wrapper(*args):
+                threads[name] = threading.current_thread()
+                return original(*args)
+            monkeypatch.setattr(api, name, wrapper)
+
+        for name in ('resolve_configuration', 'prepare_chat_request', 'start_conversation_turn'):
+            recording(name)
+        app = make_app(lambda request: httpx.Response(
+            200, headers={'content-type': 'text/event-stream'}, content=sse_body))
+        result = run_asgi(app, json.dumps({'api_url': 'http://upstream/v1/chat', 'message': 'Hi'}).encode())
+
+        assert result['status'] == 200
+        assert len(threads) == 3
+        assert all(thread is not threading.main_thread() for thread in threads.values())
+
+    def test_forwards_payload_upstream(self, make_app, run_asgi):
+        """Test the upstream request matches the Flask path's payload."""
+        captured = {}
+
+        def handler(request):
+            captured['payload'] = json.loads(request.content)
+            captured['auth'] = request.headers.get('authorization')
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content='data: [DONE]\n\n')
+
+        run_asgi(make_app(handler), json.dumps({
+            'api_url': 'http://upstream/v1/chat',
+            'api_key': 'secret-key',
+            'model': 'test-model',
+            'message': 'Hi'
+        }).encode())
+
+        assert captured['auth'] == 'Bearer secret-key'
+        assert captured['payload']['model'] == 'test-model'
+        assert captured['payload']['stream'] is True
+        assert captured['payload']['messages'][-1] == {'role': 'user', 'content': 'Hi'}
+
+    def test_cancelled_stream_stops_relaying(self, monkeypatch, make_app, run_asgi, sse_body):
+        """Test a stream marked cancelled stops before relaying upstream content."""
+        monkeypatch.setattr(api, 'register_stream', lambda labels=None: 'cancelled-stream')
+        api.stream_registry.register('cancelled-stream')
+        api.stream_registry.cancel('cancelled-stream')
+        app = make_app(lambda request: httpx.Response(
+            200, headers={'content-type': 'text/event-stream'}, content=sse_body))
+
+        result = run_asgi(app, json.dumps({'api_url': 'http://upstream/v1/chat', 'message': 'Hi'}).encode())
+
+        assert result['chunks'][0] == 'data: {"stream_id": "cancelled-stream"}\n\n'
+        assert [chunk.split('\n')[0] for chunk in result['chunks'][1:]] == ['event: timing']
+        assert 'cancelled-stream' not in api.stream_registry
+
+    def test_missing_fields(self, make_app, run_asgi):
+        """Test validation errors match the Flask endpoint."""
+        result = run_asgi(make_app(lambda request: httpx.Response(200)), json.dumps({'message': 'Hi'}).encode())
+        assert result['status'] == 400
+        assert 'Missing required fields' in json.loads(''.join(result['chunks']))['error']
+
+    def test_upstream_error_status(self, make_app, run_asgi):
+        """Test upstream error statuses are passed through with details."""
+        app = make_app(lambda request: httpx.Response(404, text='Model not found'))
+
+        result = run_asgi(app, json.dumps({'api_url': 'http://upstream/v1/chat', 'message': 'Hi'}).encode())
+
+        assert result['status'] == 404
+        body = json.loads(''.join(result['chunks']))
+        assert 'API request failed with status 404' in body['error']
+        assert body['details'] == 'Model not found'
+
+    def test_connection_error(self, make_app, run_asgi):
+        """Test upstream connection failures return a request error."""
+        def handler(request):
+            raise httpx.ConnectError('Connection failed')
+
+        result = run_asgi(make_app(handler), json.dumps({'api_url': 'http://upstream/v1/chat', 'message': 'Hi'}).encode())
+
+        assert result['status'] == 500
+        assert 'Request failed: Connection failed' in json.loads(''.join(result['chunks']))['error']
+
+    def test_other_routes_fall_through_to_flask(self, make_app, run_asgi):
+        """Test non-chat routes are served by the Flask app."""
+        result = run_asgi(make_app(lambda request: httpx.Response(200)), b'', path='/api/health', method='GET')
+        assert result['status'] == 200
+        assert json.loads(''.join(result['chunks']))['status'] == 'healthy'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,75 @@
+"""
+Tests for the result calculations of the /api/chat load benchmark.
+"""
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add benchmarks directory to path to import the benchmark script
+benchmarks_path = str(Path(__file__).parent.parent / 'benchmarks')
+sys.path.insert(0, benchmarks_path)
+
+from bench_chat_load import percentile, run_chat
+
+
+class FakeResponse(io.BytesIO):
+    status = 200
+
+
+class FakeConnection:
+    """Answers every request with a fixed SSE body."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def request(self, method, path, body=None, headers=None):
+        pass
+
+    def getresponse(self):
+        return FakeResponse(self.body)
+
+    def close(self):
+        pass
+
+
+class TestPercentile:
+    """Test suite for the nearest-rank percentile."""
+
+    def test_nearest_rank(self):
+        """Test the rank is ceil(pct / 100 * n), counted from one."""
+        values = list(range(1, 11))
+        assert percentile(values, 50) == 5
+        assert percentile(values, 95) == 10
+        assert percentile(values, 90) == 9
+        assert percentile(list(range(1, 101)), 99) == 99
+        assert percentile(list(range(1, 101)), 50) == 50
+
+    def test_edges(self):
+        """Test empty input, a single value and the extremes."""
+        assert percentile([], 50) is None
+        assert percentile([7], 99) == 7
+        assert percentile([3, 1, 2], 0) == 1
+        assert percentile([3, 1, 2], 100) == 3
+
+
+class TestRunChat:
+    """Test suite for reading one streamed reply."""
+
+    def test_done_marker_is_not_a_token(self):
+        """Test the stream_id frame, timing events and the passthrough end marker are not counted."""
+        body = (
+            b'data: {"stream_id": "s"}\n\n'
+            b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n'
+            b'data: {"choices": [{"delta": {"content": "!"}}]}\n\n'
+            b'data: [DONE]\n\n'
+            b'event: timing\ndata: {"timing": {}}\n\n'
+        )
+        result = run_chat(FakeConnection(body), '/api/chat', b'{}')
+        assert result['error'] is None
+        assert result['tokens'] == 2
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,152 @@
+"""
+Tests for the content-addressed image blob store.
+"""
+import base64
+import hashlib
+import io
+import os
+import sys
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from blob_store import BlobStore, decode_data_url
+
+PNG_BYTES = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg=='
+)
+PNG_URL = 'data:image/png;base64,' + base64.b64encode(PNG_BYTES).decode('ascii')
+PNG_HASH = hashlib.sha256(PNG_BYTES).hexdigest()
+
+
+@pytest.fixture
+def blobs(tmp_path, monkeypatch):
+    """A blob store in a temporary directory, installed in the API module."""
+    store = BlobStore(str(tmp_path / 'blobs'))
+    monkeypatch.setattr(api, 'blob_store', store)
+    return store
+
+
+def mock_json_reply():
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.headers = {'content-type': 'application/json'}
+    mock_response.json.return_value = {'choices': [{'message': {'content': 'ok'}}]}
+    return mock_response
+
+
+class TestBlobStore:
+    """Test suite for BlobStore."""
+
+    def test_put_is_content_addressed(self, blobs):
+        """Test identical bytes are stored once under their SHA-256."""
+        assert blobs.put(PNG_BYTES, 'image/png') == (PNG_HASH, True)
+        assert blobs.put(PNG_BYTES, 'image/png') == (PNG_HASH, False)
+        assert blobs.get(PNG_HASH) == (PNG_BYTES, 'image/png')
+        assert blobs.data_url(PNG_HASH) == PNG_URL
+        assert blobs.get_stats()['blobs'] == 1
+
+    def test_rejects_non_images_and_bad_hashes(self, blobs):
+        """Test unsupported types and malformed hashes are refused."""
+        with pytest.raises(ValueError):
+            blobs.put(b'<html>', 'text/html')
+        with pytest.raises(ValueError):
+            decode_data_url('https://example.com/a.png')
+        assert blobs.get('../../etc/passwd') is None
+
+    def test_lru_eviction(self, tmp_path):
+        """Test the least recently used blob is evicted once over the size bound."""
+        store = BlobStore(str(tmp_path), max_bytes=250)
+        first, _ = store.put(b'a' * 100, 'image/png')
+        second, _ = store.put(b'b' * 100, 'image/png')
+        store.get(first)  # first is now the most recently used
+        store.put(b'c' * 100, 'image/png')
+        assert store.get(second) is None
+        assert store.get(first) is not None
+        assert store.get_stats()['bytes'] == 200
+
+    def test_index_survives_restart(self, tmp_path):
+        """Test a new store finds existing blobs on disk in LRU order."""
+        store = BlobStore(str(tmp_path))
+        old, _ = store.put(b'old' * 10, 'image/jpeg')
+        time.sleep(0.01)
+        new, _ = store.put(b'new' * 10, 'image/webp')
+        reopened = BlobStore(str(tmp_path))
+        assert list(reopened._index) == [old, new]
+        assert reopened.get(new) == (b'new' * 10, 'image/webp')
+
+
+class TestImageEndpoints:
+    """Test suite for /api/images."""
+
+    def test_multipart_upload_and_fetch(self, client, blobs):
+        """Test uploading a file, deduplicating it and fetching it back."""
+        response = client.post('/api/images', data={'file': (io.BytesIO(PNG_BYTES), 'a.png', 'image/png')})
+        assert response.status_code == 201
+        assert response.json == {'hash': PNG_HASH, 'size': len(PNG_BYTES), 'mime': 'image/png', 'deduplicated': False}
+
+        response = client.post('/api/images', json={'url': PNG_URL})
+        assert response.status_code == 200
+        assert response.json['deduplicated'] is True
+
+        response = client.get(f'/api/images/{PNG_HASH}')
+        assert response.data == PNG_BYTES
+        assert 'immutable' in response.headers['Cache-Control']
+        assert client.get(f'/api/images/{PNG_HASH}', headers={'If-None-Match': f'"{PNG_HASH}"'}).status_code == 304
+        assert client.head(f'/api/images/{PNG_HASH}').status_code == 200
+
+    def test_missing_and_invalid(self, client, blobs):
+        """Test unknown hashes are 404 and bad uploads are 400."""
+        assert client.head(f'/api/images/{"0" * 64}').status_code == 404
+        assert client.post('/api/images', json={'url': 'not a data url'}).status_code == 400
+
+
+class TestImageReferencesInChat:
+    """Test suite for hash references in /api/chat."""
+
+    @patch('api.upstream_pool.post')
+    def test_current_and_history_references(self, mock_post, client, blobs):
+        """Test hash references are expanded in the current turn and in history."""
+        blobs.put(PNG_BYTES, 'image/png')
+        mock_post.return_value = mock_json_reply()
+
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'And now?',
+            'images': [{'id': 'b', 'hash': PNG_HASH}],
+            'conversation_history': [
+                {'sender': 'user', 'content': 'Look', 'images': [{'id': 'a', 'hash': PNG_HASH, 'url': 'about:blank'}]},
+                {'sender': 'user', 'content': 'Old', 'images': [{'id': 'c', 'url': 'about:blank'}]},
+                {'sender': 'ai', 'content': 'A pixel'}
+            ]
+        })
+        assert response.status_code == 200
+
+        sent = mock_post.call_args.kwargs['json']['messages']
+        assert sent[1]['content'] == [
+            {'type': 'text', 'text': 'Look'},
+            {'type': 'image_url', 'image_url': {'url': PNG_URL}}
+        ]
+        assert sent[2]['content'] == 'Old [Note: This message originally contained 1 image(s)]'
+        assert sent[-1]['content'][1] == {'type': 'image_url', 'image_url': {'url': PNG_URL}}
+
+    def test_unknown_reference(self, client, blobs):
+        """Test referencing a missing blob is a client error."""
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Hi',
+            'images': [{'id': 'a', 'hash': 'f' * 64}]
+        })
+        assert response.status_code == 400
+        assert response.json['error'] == 'Image not found'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
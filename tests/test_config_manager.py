@@ -1,7 +1,13 @@
+import json
 import os
+import sqlite3
+import sys
+import threading
+import time
 import pytest
 from unittest.mock import MagicMock, patch, mock_open
 from config_manager import ConfigurationManager
+from config_storage import JournalStorage, JsonFileStorage, SqliteStorage
 
 CONFIG_FILE = 'test_configurations.json'
 
@@ -260,3 +266,258 @@ def test_update_image_support_success():
         assert updated['supportsImages'] is True
         assert updated['imageTestAt'] is not None
 
+
+
+def test_snapshot_save_is_atomic(tmp_path):
+    """Test snapshots are written via rename and leave no temporary files."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JsonFileStorage(path))
+    manager.create_configuration('Snapshot Config', 'http://snapshot')
+
+    assert os.listdir(tmp_path) == ['configs.json']
+    assert ConfigurationManager(config_file=path, storage=JsonFileStorage(path)).get_all_configurations()[0]['name'] == 'Snapshot Config'
+
+
+def test_journal_appends_and_replays(tmp_path):
+    """Test journal mode appends one compact record per change and replays it on load."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JournalStorage(path, sync='always'))
+    first = manager.create_configuration('First', 'http://first')
+    second = manager.create_configuration('Second', 'http://second')
+    manager.update_image_support(first['id'], True)
+    manager.activate_configuration(second['id'])
+    manager.delete_configuration(first['id'])
+
+    assert not os.path.exists(path)
+    with open(f'{path}.journal') as f:
+        records = [json.loads(line) for line in f]
+    assert [r['op'] for r in records] == ['put', 'put', 'put', 'put', 'put', 'delete']
+
+    reloaded = ConfigurationManager(config_file=path, storage=JournalStorage(path))
+    assert reloaded.configurations == manager.configurations
+
+
+def test_journal_ignores_torn_record(tmp_path):
+    """Test a partially written final record does not prevent loading."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JournalStorage(path, sync='always'))
+    config = manager.create_configuration('Kept', 'http://kept')
+    with open(f'{path}.journal', 'a') as f:
+        f.write('{"op":"put","id":"torn","con')
+
+    reloaded = ConfigurationManager(config_file=path, storage=JournalStorage(path))
+    assert list(reloaded.configurations) == [config['id']]
+
+
+def test_journal_torn_tail_does_not_swallow_next_append(tmp_path):
+    """Test a record appended after a torn tail survives the following restart."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JournalStorage(path, sync='always'))
+    manager.create_configuration('a', 'http://a')
+    manager.create_configuration('b', 'http://b')
+    journal = f'{path}.journal'
+    with open(journal, 'r+b') as f:
+        f.truncate(os.path.getsize(journal) - 40)
+
+    restarted = ConfigurationManager(config_file=path, storage=JournalStorage(path, sync='always'))
+    restarted.create_configuration('c', 'http://c')
+
+    reloaded = ConfigurationManager(config_file=path, storage=JournalStorage(path))
+    assert sorted(c['name'] for c in reloaded.get_all_configurations()) == ['a', 'c']
+
+
+def test_journal_compaction(tmp_path):
+    """Test the journal is folded into a snapshot after compact_every records."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JournalStorage(path, sync='none', compact_every=3))
+    config = manager.create_configuration('Compacted', 'http://compacted')
+    manager.update_image_support(config['id'], False)
+    manager.update_image_support(config['id'], True)
+
+    assert os.path.getsize(f'{path}.journal') == 0
+    with open(path) as f:
+        assert json.load(f)[config['id']]['supportsImages'] is True
+    manager.update_image_support(config['id'], False)
+    reloaded = ConfigurationManager(config_file=path, storage=JournalStorage(path))
+    assert reloaded.get_configuration(config['id'])['supportsImages'] is False
+
+
+def test_journal_group_commit(tmp_path):
+    """Test batched appends are buffered and written together after the debounce."""
+    path = str(tmp_path / 'configs.json')
+    storage = JournalStorage(path, sync='batch', flush_interval=0.05)
+    manager = ConfigurationManager(config_file=path, storage=storage)
+    manager.create_configuration('One', 'http://one')
+    manager.create_configuration('Two', 'http://two')
+    assert not os.path.exists(f'{path}.journal')
+
+    deadline = time.time() + 2
+    while not os.path.exists(f'{path}.journal') and time.time() < deadline:
+        time.sleep(0.01)
+    storage.flush()
+    with open(f'{path}.journal') as f:
+        assert len(f.readlines()) == 2
+
+
+def test_indexes_follow_mutations(tmp_path):
+    """Test name, active, endpoint and ordering lookups stay consistent across changes."""
+    path = str(tmp_path / 'configs.json')
+    manager = ConfigurationManager(config_file=path, storage=JsonFileStorage(path))
+    first = manager.create_configuration('First', 'http://shared', model='m')
+    second = manager.create_configuration('Second', 'http://shared', model='m')
+    assert manager.find_by_endpoint('http://shared', 'm')['id'] in (first['id'], second['id'])
+    assert manager.find_by_endpoint('http://shared', 'other') is None
+
+    manager.update_configuration(second['id'], 'Renamed', 'http://moved', model='m')
+    assert manager.find_by_endpoint('http://shared', 'm')['id'] == first['id']
+    assert manager.find_by_endpoint('http://moved', 'm')['id'] == second['id']
+    manager.create_configuration('second', 'http://third')  # old name is free again
+    with pytest.raises(ValueError, match='already exists'):
+        manager.create_configuration('RENAMED', 'http://fourth')
+
+    manager.activate_configuration(second['id'])
+    assert manager.get_active_configuration()['id'] == second['id']
+    manager.delete_configuration(second['id'])
+    assert manager.get_active_configuration()['id'] == first['id']
+    assert manager.find_by_endpoint('http://moved', 'm') is None
+
+    reloaded = ConfigurationManager(config_file=path, storage=JsonFileStorage(path))
+    assert [c['id'] for c in reloaded.get_all_configurations()] == [c['id'] for c in manager.get_all_configurations()]
+    assert reloaded.get_active_configuration()['id'] == first['id']
+
+
+def test_concurrent_mutations_keep_indexes_consistent(tmp_path):
+    """Test request threads mutating and refreshing one manager leave its indexes in step."""
+    path = str(tmp_path / 'configs.db')
+    manager = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    other = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+
+    def worker(n):
+        for i in range(20):
+            config = manager.create_configuration(f'Config {n}-{i}', f'http://host{n}', model=str(i))
+            manager.update_configuration(config['id'], f'Renamed {n}-{i}', f'http://moved{n}', model=str(i))
+            other.create_configuration(f'Other {n}-{i}', 'http://other')
+            manager.get_all_configurations()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads often enough to interleave index updates
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    listed = manager.get_all_configurations()
+    assert len(listed) == len(manager._ordered) == len(manager._order_keys) == 160
+    assert sum(len(endpoint) for endpoint in manager._by_endpoint.values()) == 160
+    assert len(manager._by_name) == 160
+    assert len(manager._active_ids) == 1
+
+
+def test_sqlite_managers_share_changes(tmp_path):
+    """Test managers on one SQLite database (as in separate workers) see each other's changes."""
+    path = str(tmp_path / 'configs.db')
+    first = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    second = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    one = first.create_configuration('One', 'http://one')
+    two = second.create_configuration('Two', 'http://two')
+
+    assert {c['name'] for c in first.get_all_configurations()} == {'One', 'Two'}
+    with pytest.raises(ValueError, match='already exists'):
+        second.create_configuration('one', 'http://dup')
+
+    second.activate_configuration(two['id'])
+    assert first.get_active_configuration()['id'] == two['id']
+    first.update_image_support(two['id'], True)
+    assert second.get_configuration(two['id'])['supportsImages'] is True
+    first.delete_configuration(one['id'])
+    assert second.get_configuration(one['id']) is None
+    assert second.storage.poll() == []
+
+
+def test_sqlite_write_rechecks_name_and_active_in_transaction(tmp_path):
+    """Test a worker with a stale view cannot duplicate a name, revive a deleted row or leave two active."""
+    path = str(tmp_path / 'configs.db')
+    first = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    second = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    one = first.create_configuration('One', 'http://one')
+    two = first.create_configuration('Two', 'http://two')
+    gone = first.create_configuration('Gone', 'http://gone')
+    second.get_all_configurations()
+
+    with patch.object(second, '_refresh'):
+        first.create_configuration('Same', 'http://first')
+        with pytest.raises(ValueError, match='already exists'):
+            second.create_configuration('SAME', 'http://second')
+
+    with patch.object(second, '_refresh'):
+        first.delete_configuration(gone['id'])
+        with pytest.raises(ValueError, match='not found'):
+            second.update_configuration(gone['id'], 'Gone', 'http://back')
+
+    with patch.object(second, '_refresh'):
+        first.activate_configuration(two['id'])
+        second.activate_configuration(one['id'])
+
+    fresh = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    assert sorted(c['name'] for c in fresh.get_all_configurations()) == ['One', 'Same', 'Two']
+    assert [c['id'] for c in fresh.get_all_configurations() if c['isActive']] == [one['id']]
+    assert first.get_active_configuration()['id'] == one['id']
+    assert [c['name'] for c in second.get_all_configurations()] == ['Same', 'Two', 'One']
+
+
+def test_sqlite_adds_constraint_columns_to_old_database(tmp_path):
+    """Test a database from before the name and active columns is migrated in place."""
+    path = str(tmp_path / 'configs.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE configurations (id TEXT PRIMARY KEY, config TEXT NOT NULL, rev INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    conn.execute("INSERT INTO meta (key, value) VALUES ('rev', 1)")
+    conn.execute('INSERT INTO configurations VALUES (?, ?, 1)', ('old', json.dumps({
+        'id': 'old', 'name': 'Old', 'apiUrl': 'http://old', 'isActive': True, 'createdAt': '2024-01-01T00:00:00'
+    })))
+    conn.commit()
+    conn.close()
+
+    manager = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    assert manager.get_active_configuration()['id'] == 'old'
+    with patch.object(manager, '_refresh'), patch.dict(manager._by_name, clear=True):
+        with pytest.raises(ValueError, match='already exists'):
+            manager.create_configuration('old', 'http://new')
+
+
+def test_sqlite_imports_json_snapshot(tmp_path):
+    """Test an existing JSON file is copied into an empty SQLite database once."""
+    json_path = str(tmp_path / 'configs.json')
+    db_path = str(tmp_path / 'configs.db')
+    with open(json_path, 'w') as f:
+        json.dump([{'id': 'legacy', 'name': 'Legacy', 'api_url': 'http://legacy'}], f)
+
+    ConfigurationManager(config_file=json_path, storage=SqliteStorage(db_path, json_path=json_path))
+    os.remove(json_path)
+    reloaded = ConfigurationManager(config_file=json_path, storage=SqliteStorage(db_path, json_path=json_path))
+    assert reloaded.get_configuration('legacy')['apiUrl'] == 'http://legacy'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_sqlite_storage_survives_fork(tmp_path):
+    """Test a forked worker opens its own connection instead of reusing the parent's."""
+    path = str(tmp_path / 'configs.db')
+    manager = ConfigurationManager(config_file=path, storage=SqliteStorage(path))
+    manager.create_configuration('Parent', 'http://parent')
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            inherited = manager.storage._local.conn
+            manager.create_configuration('Child', 'http://child')
+            os._exit(0 if manager.storage._local.conn is not inherited else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WEXITSTATUS(status) == 0
+    assert {c['name'] for c in manager.get_all_configurations()} == {'Parent', 'Child'}
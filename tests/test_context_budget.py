@@ -0,0 +1,178 @@
+"""
+Tests for token-budgeted context assembly.
+"""
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from context_budget import (
+    ContextAssembler, HistorySummarizer, TokenCounter, context_settings, estimate_tokens, SUMMARY_PREFIX
+)
+
+
+def conversation(count, words=40):
+    """Build [system, *history, current] with `count` history messages of roughly equal size."""
+    history = [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message {i} ' + 'word ' * words}
+        for i in range(count)
+    ]
+    return [{'role': 'system', 'content': 'system'}] + history + [{'role': 'user', 'content': 'current'}]
+
+
+class TestContextSettings:
+    """Test suite for resolving the context budget."""
+
+    def test_disabled_by_default(self):
+        """Test no budget means no trimming."""
+        assert context_settings({}, None) is None
+        assert context_settings({}, {'settings': {'coalesceMs': 10}}) is None
+
+    def test_configuration_and_request_override(self):
+        """Test request fields take precedence over configuration settings."""
+        config = {'settings': {'contextTokens': 4000, 'contextStrategy': 'summarize'}}
+        assert context_settings({}, config) == {'budget': 4000, 'strategy': 'summarize'}
+        assert context_settings({'context_tokens': 100}, config) == {'budget': 100, 'strategy': 'summarize'}
+        assert context_settings({'context_strategy': 'bogus'}, config)['strategy'] == 'drop'
+
+    def test_non_numeric_budget_is_a_request_error(self):
+        """Test a non-numeric budget raises a 400 ChatRequestError."""
+        with pytest.raises(api.ChatRequestError) as exc_info:
+            context_settings({'context_tokens': 'plenty'}, None)
+        assert exc_info.value.status_code == 400
+        assert 'context_tokens' in exc_info.value.body['error']
+
+
+class TestTokenCounter:
+    """Test suite for cached token counting."""
+
+    def test_counts_are_cached(self):
+        """Test repeated messages are counted once."""
+        counter = TokenCounter()
+        message = {'role': 'user', 'content': 'hello world'}
+        first = counter.count(message)
+        assert counter.count(dict(message)) == first
+        assert counter.get_stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+    def test_multimodal_content(self):
+        """Test image parts count as a fixed cost and text parts are estimated."""
+        counter = TokenCounter()
+        tokens = counter.count({'role': 'user', 'content': [
+            {'type': 'text', 'text': 'abcdefgh'},
+            {'type': 'image_url', 'image_url': {'url': 'data:'}}
+        ]})
+        assert tokens > estimate_tokens('abcdefgh') + 100
+        assert counter.get_stats()['entries'] == 0
+
+
+class TestContextAssembler:
+    """Test suite for ContextAssembler."""
+
+    def test_fits_unchanged(self):
+        """Test a conversation under budget is returned as-is."""
+        messages = conversation(4)
+        assert ContextAssembler().assemble(messages, 100000) is messages
+
+    def test_drops_oldest_turns(self):
+        """Test the newest history that fits is kept with the system prompt and current turn."""
+        messages = conversation(10)
+        assembler = ContextAssembler()
+        per_message = assembler.counter.count(messages[1])
+        fixed = assembler.counter.count(messages[0]) + assembler.counter.count(messages[-1])
+
+        assembled = assembler.assemble(messages, fixed + per_message * 3 + 1)
+        assert assembled[0] is messages[0]
+        assert assembled[-1] is messages[-1]
+        assert assembled[1:-1] == messages[-4:-1]
+
+    def test_summary_replaces_dropped_turns(self):
+        """Test a background summary covers dropped turns on later requests."""
+        calls = []
+
+        def summarize(previous, msgs):
+            calls.append((previous, len(msgs)))
+            return f'summary of {len(msgs)}'
+
+        assembler = ContextAssembler()
+        messages = conversation(10)
+        per_message = assembler.counter.count(messages[1])
+        fixed = assembler.counter.count(messages[0]) + assembler.counter.count(messages[-1])
+        budget = fixed + per_message * 4
+
+        # First request drops turns and schedules a summary without waiting on it
+        first = assembler.assemble(messages, budget, key='conv', summarize=summarize)
+        assert all(not m['content'].startswith(SUMMARY_PREFIX) for m in first)
+        assembler.summarizer._executor.shutdown(wait=True)
+        assembler.summarizer._executor = None
+        covered, text = assembler.summarizer.get('conv')
+        assert calls == [(None, covered)]
+
+        # Next request uses the cached summary and only summarizes newly dropped turns
+        longer = messages[:-1] + conversation(4)[1:5] + [messages[-1]]
+        second = assembler.assemble(longer, budget, key='conv', summarize=summarize)
+        assert second[1] == {'role': 'system', 'content': SUMMARY_PREFIX + text}
+        assembler.summarizer._executor.shutdown(wait=True)
+        assert calls[1][0] == text
+        assert calls[1][1] == assembler.summarizer.get('conv')[0] - covered
+
+    def test_summarizer_errors_are_contained(self):
+        """Test a failing summarizer leaves no summary and allows a retry."""
+        summarizer = HistorySummarizer()
+
+        def failing(previous, msgs):
+            raise RuntimeError('upstream down')
+
+        future = summarizer.request('conv', [{'role': 'user', 'content': 'x'}], 1, failing)
+        assert future.result() is None
+        assert summarizer.get('conv') is None
+        assert summarizer.request('conv', [{'role': 'user', 'content': 'x'}], 1, failing) is not None
+
+
+class TestBudgetedChat:
+    """Test suite for the context budget in /api/chat."""
+
+    @patch('api.upstream_pool.post')
+    def test_chat_trims_history(self, mock_post, client):
+        """Test context_tokens trims the history sent upstream."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'content-type': 'application/json'}
+        mock_response.json.return_value = {'choices': [{'message': {'content': 'ok'}}]}
+        mock_post.return_value = mock_response
+
+        history = [{'sender': 'user', 'content': f'old message {i} ' + 'x' * 400} for i in range(20)]
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Hi',
+            'conversation_history': history,
+            'context_tokens': 1000
+        })
+        assert response.status_code == 200
+
+        sent = mock_post.call_args.kwargs['json']['messages']
+        assert sent[0]['content'] == api.SYSTEM_PROMPT
+        assert sent[-1] == {'role': 'user', 'content': 'Hi'}
+        assert 1 < len(sent) - 1 < 21
+        assert sent[-2]['content'].startswith('old message 19')
+
+    @patch('api.upstream_pool.post')
+    def test_summary_transcript_replaces_images_with_placeholders(self, mock_post):
+        """Test image parts never reach the summary prompt as base64."""
+        mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'summary'}}]}
+        summarize = api.make_history_summarizer('http://localhost:9999/v1/chat/completions', {}, None)
+
+        image = {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,' + 'A' * 1000}}
+        assert summarize(None, [{'role': 'user', 'content': [{'type': 'text', 'text': 'Look'}, image]}]) == 'summary'
+
+        transcript = mock_post.call_args.kwargs['json']['messages'][1]['content']
+        assert transcript == 'user: Look [image]'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,189 @@
+"""
+Tests for the server-side conversation store and delta-only chat turns.
+"""
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from conversation_store import ConversationStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A conversation store in a temporary directory, installed in the API module."""
+    conversation_store = ConversationStore(str(tmp_path / 'conversations'))
+    monkeypatch.setattr(api, 'conversation_store', conversation_store)
+    return conversation_store
+
+
+def mock_stream(*contents):
+    """Build a mock upstream streaming response with the given deltas."""
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.headers = {'content-type': 'text/event-stream'}
+    mock_response.iter_content.return_value = [
+        ('data: {"choices": [{"delta": {"content": "%s"}}]}\n\n' % content).encode()
+        for content in contents
+    ] + [b'data: [DONE]\n\n']
+    return mock_response
+
+
+class TestConversationStore:
+    """Test suite for ConversationStore persistence."""
+
+    def test_append_and_reload(self, store):
+        """Test turns are written behind and survive a fresh store instance."""
+        conversation_id = store.create()
+        store.append(conversation_id, {'sender': 'user', 'content': 'Hi'})
+        store.append(conversation_id, {'sender': 'ai', 'content': 'Hello'})
+        store.flush()
+
+        reloaded = ConversationStore(store.directory)
+        assert [t['content'] for t in reloaded.get_messages(conversation_id)] == ['Hi', 'Hello']
+
+    def test_seeded_messages_are_sanitized(self, store):
+        """Test seed messages keep image metadata but drop image URLs."""
+        conversation_id = store.create([
+            {'id': '1', 'sender': 'user', 'content': 'Look', 'images': [{'id': 'a', 'name': 'x.png', 'size': 3, 'url': 'about:blank'}]}
+        ])
+        turn = store.get_messages(conversation_id)[0]
+        assert turn['images'] == [{'id': 'a', 'name': 'x.png', 'size': 3}]
+
+    def test_unknown_and_invalid_ids(self, store):
+        """Test unknown or malformed IDs are reported as missing."""
+        assert store.get_messages('0' * 32) is None
+        assert store.get_messages('../../etc/passwd') is None
+        assert store.exists('../configurations') is False
+
+    def test_delete(self, store):
+        """Test deleting removes the conversation from memory and disk."""
+        conversation_id = store.create([{'sender': 'user', 'content': 'Hi'}])
+        store.delete(conversation_id)
+        assert store.get_messages(conversation_id) is None
+        with pytest.raises(ValueError, match='Conversation not found'):
+            store.delete(conversation_id)
+
+    def test_cache_eviction_reloads_from_disk(self, tmp_path):
+        """Test evicted conversations are reloaded from their files."""
+        small = ConversationStore(str(tmp_path), max_cached=1)
+        first = small.create([{'sender': 'user', 'content': 'first'}])
+        small.flush()
+        small.create([{'sender': 'user', 'content': 'second'}])
+        small.flush()
+        assert [t['content'] for t in small.get_messages(first)] == ['first']
+
+
+    def test_cache_sees_other_workers_writes(self, tmp_path):
+        """Test a cached conversation is reloaded after another process appends to it."""
+        first = ConversationStore(str(tmp_path))
+        second = ConversationStore(str(tmp_path))
+        conversation_id = first.create([{'sender': 'user', 'content': 'Hi'}])
+        first.flush()
+        assert [t['content'] for t in first.get_messages(conversation_id)] == ['Hi']
+
+        second.append(conversation_id, {'sender': 'ai', 'content': 'Hello'})
+        second.flush()
+        assert [t['content'] for t in first.get_messages(conversation_id)] == ['Hi', 'Hello']
+
+        first.append(conversation_id, {'sender': 'user', 'content': 'Again'})
+        first.flush()
+        assert [t['content'] for t in second.get_messages(conversation_id)] == ['Hi', 'Hello', 'Again']
+
+    def test_append_does_not_recreate_deleted_conversation(self, tmp_path):
+        """Test turns for a conversation deleted here or by another process are dropped."""
+        first = ConversationStore(str(tmp_path))
+        second = ConversationStore(str(tmp_path))
+        conversation_id = first.create([{'sender': 'user', 'content': 'Hi'}])
+        first.flush()
+        recorder = first.recorder(conversation_id)
+        recorder.add('late reply')
+        assert second.get_messages(conversation_id) is not None
+
+        first.delete(conversation_id)
+        recorder.finish()
+        second.append(conversation_id, {'sender': 'ai', 'content': 'Hello'})
+        first.flush()
+        second.flush()
+        assert not (tmp_path / f'{conversation_id}.jsonl').exists()
+        assert first.get_messages(conversation_id) is None
+        assert second.get_messages(conversation_id) is None
+
+class TestConversationChat:
+    """Test suite for delta-only /api/chat turns."""
+
+    @patch('api.upstream_pool.post')
+    def test_chat_uses_stored_history_and_records_turns(self, mock_post, client, store):
+        """Test stored history is sent upstream and both new turns are appended."""
+        conversation_id = store.create([
+            {'sender': 'user', 'content': 'Earlier question'},
+            {'sender': 'ai', 'content': 'Earlier answer'}
+        ])
+        mock_post.return_value = mock_stream('New', ' answer')
+
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'New question',
+            'conversation_id': conversation_id
+        })
+        response.get_data()  # Drain the stream
+
+        sent_messages = mock_post.call_args.kwargs['json']['messages']
+        assert [m['content'] for m in sent_messages[1:]] == ['Earlier question', 'Earlier answer', 'New question']
+
+        turns = store.get_messages(conversation_id)
+        assert [(t['sender'], t['content']) for t in turns[2:]] == [('user', 'New question'), ('ai', 'New answer')]
+
+    @patch('api.upstream_pool.post')
+    def test_passthrough_stream_is_recorded(self, mock_post, client, store):
+        """Test passthrough responses are decoded once for the stored turn."""
+        conversation_id = store.create()
+        mock_post.return_value = mock_stream('Raw', ' reply')
+
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Hi',
+            'conversation_id': conversation_id,
+            'stream_mode': 'passthrough'
+        })
+        response.get_data()
+
+        assert store.get_messages(conversation_id)[-1]['content'] == 'Raw reply'
+
+    def test_chat_unknown_conversation(self, client, store):
+        """Test chatting in a missing conversation returns 404."""
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Hi',
+            'conversation_id': 'f' * 32
+        })
+        assert response.status_code == 404
+        assert response.json['error'] == 'Conversation not found'
+
+    def test_conversation_endpoints(self, client, store):
+        """Test creating, reading and deleting conversations over HTTP."""
+        response = client.post('/api/conversations', json={'messages': [{'sender': 'user', 'content': 'Hi'}]})
+        assert response.status_code == 201
+        conversation_id = response.json['id']
+
+        response = client.get(f'/api/conversations/{conversation_id}')
+        assert response.status_code == 200
+        assert response.json['messages'][0]['content'] == 'Hi'
+
+        assert client.delete(f'/api/conversations/{conversation_id}').status_code == 200
+        assert client.get(f'/api/conversations/{conversation_id}').status_code == 404
+
+    def test_create_conversation_invalid_messages(self, client, store):
+        """Test seed messages must be a list."""
+        response = client.post('/api/conversations', json={'messages': 'nope'})
+        assert response.status_code == 400
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,263 @@
+"""
+Tests for the background health monitor and cached health endpoints.
+"""
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from health_monitor import HealthMonitor
+
+API_URL = 'http://localhost:9999/v1/chat/completions'
+
+
+def alive_response():
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.text = '{"choices": [{"message": {"content": "I\'m alive!"}}]}'
+    mock_response.json.return_value = {'choices': [{'message': {'content': "I'm alive!"}}]}
+    return mock_response
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    """A monitor wired to the API module's probe, installed in the API module."""
+    health_monitor = HealthMonitor(api.probe_configuration, lambda: api.config_manager.get_all_configurations())
+    monkeypatch.setattr(api, 'health_monitor', health_monitor)
+    return health_monitor
+
+
+class TestHealthMonitor:
+    """Test suite for HealthMonitor scheduling and history."""
+
+    def test_records_history_and_summary(self):
+        """Test results are kept per configuration with a summary view."""
+        results = iter([{'healthy': True, 'supports_images': True}, {'healthy': False, 'error': 'down'}])
+        monitor = HealthMonitor(lambda target: next(results), lambda: [])
+        monitor.check({'id': 'a'})
+        monitor.check({'id': 'a'})
+
+        summary = monitor.summary('a')
+        assert summary['status'] == 'unhealthy'
+        assert summary['consecutive_failures'] == 1
+        assert summary['supports_images'] is True
+        assert summary['last_success'] == monitor.history('a')[0]['checked_at']
+        assert len(monitor.history('a')) == 2
+
+    def test_probe_exceptions_are_recorded(self):
+        """Test a probe that raises is recorded as unhealthy."""
+        def failing(target):
+            raise RuntimeError('boom')
+
+        monitor = HealthMonitor(failing, lambda: [])
+        result = monitor.check({'id': 'a'})
+        assert result['healthy'] is False
+        assert result['error'] == 'boom'
+
+    def test_backoff_with_jitter(self):
+        """Test delays double per failure, are capped and stay within the jitter band."""
+        monitor = HealthMonitor(lambda t: {}, lambda: [], interval=10, jitter=0.1, max_backoff=50)
+        for failures, base in [(0, 10), (1, 20), (2, 40), (5, 50)]:
+            delay = monitor._delay(failures)
+            assert base * 0.9 <= delay <= base * 1.1
+
+    def test_latest_max_age(self):
+        """Test stale results are not returned as fresh."""
+        monitor = HealthMonitor(lambda t: {'healthy': True}, lambda: [])
+        monitor.check({'id': 'a'})
+        assert monitor.latest('a', max_age=60) is not None
+        time.sleep(0.02)
+        assert monitor.latest('a', max_age=0.01) is None
+
+    def test_check_many_runs_concurrently_in_completion_order(self):
+        """Test the fan-out overlaps probes and yields the fastest first."""
+        delays = {'slow': 0.3, 'fast': 0.0, 'mid': 0.15}
+        monitor = HealthMonitor(lambda t: time.sleep(delays[t['id']]) or {'healthy': True}, lambda: [])
+        started = time.monotonic()
+        order = [target['id'] for target, _ in monitor.check_many([{'id': k} for k in delays], concurrency=3)]
+        assert order == ['fast', 'mid', 'slow']
+        assert time.monotonic() - started < 0.5
+        assert monitor.summary('slow')['status'] == 'healthy'
+
+    def test_check_many_deadline_and_cap(self):
+        """Test a hung probe is reported as timed out and the cap limits parallelism."""
+        release = threading.Event()
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def probe(target):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            if target['id'] == 'hung':
+                release.wait(2)
+            with lock:
+                running[0] -= 1
+            return {'healthy': True}
+
+        monitor = HealthMonitor(probe, lambda: [])
+        targets = [{'id': 'hung'}, {'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+        results = dict((t['id'], r) for t, r in monitor.check_many(targets, concurrency=2, deadline=0.2))
+        release.set()
+        assert results['hung']['timed_out'] is True
+        assert results['hung']['healthy'] is False
+        assert all(results[k]['healthy'] for k in 'abc')
+        assert peak[0] <= 2
+
+    def test_check_many_shares_a_bounded_pool(self):
+        """Test a client-supplied cap is clamped and every call reuses one pool."""
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def probe(target):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return {'healthy': True}
+
+        monitor = HealthMonitor(probe, lambda: [], max_fanout=2)
+        targets = [{'id': str(i)} for i in range(6)]
+        assert len(list(monitor.check_many(targets, concurrency=1000))) == 6
+        executor = monitor._get_fanout_executor()
+        assert len(list(monitor.check_many(targets, concurrency=1000))) == 6
+        assert monitor._get_fanout_executor() is executor
+        assert peak[0] <= 2
+
+    def test_background_thread_probes_targets(self):
+        """Test the thread probes listed configurations and stops on request."""
+        probed = []
+        monitor = HealthMonitor(lambda t: probed.append(t['id']) or {'healthy': True},
+                                lambda: [{'id': 'a'}, {'id': 'b'}], interval=60, jitter=0)
+        monitor.start()
+        deadline = time.time() + 2
+        while len(probed) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        monitor.stop()
+        assert sorted(probed) == ['a', 'b']
+
+
+class TestCachedHealthEndpoints:
+    """Test suite for health endpoints answering from the monitor."""
+
+    @patch('api.upstream_pool.post')
+    def test_test_external_uses_cache_until_forced(self, mock_post, client, monitor):
+        """Test a stored configuration's fresh result is returned without probing."""
+        config = api.config_manager.create_configuration('Local', API_URL, model='m')
+        mock_post.return_value = alive_response()
+
+        first = client.post('/api/test-external', json={'api_url': API_URL, 'model': 'm'})
+        assert first.status_code == 200
+        assert first.json['cached'] is False
+        calls = mock_post.call_count
+
+        second = client.post('/api/test-external', json={'api_url': API_URL, 'model': 'm'})
+        assert second.json['cached'] is True
+        assert second.json['health_status'] == 'healthy'
+        assert mock_post.call_count == calls
+
+        forced = client.post('/api/test-external', json={'api_url': API_URL, 'model': 'm', 'force': True})
+        assert forced.json['cached'] is False
+        assert mock_post.call_count > calls
+        assert monitor.summary(config['id'])['status'] == 'healthy'
+
+    @patch('api.upstream_pool.post')
+    def test_monitor_probe_only_checks_liveness(self, mock_post, client, monitor):
+        """Test monitor probes send just the health prompt and never rewrite the configuration."""
+        config = api.config_manager.create_configuration('Local', API_URL, model='m')
+        api.config_manager.update_image_support(config['id'], True)
+        updated_at = api.config_manager.get_configuration(config['id'])['updatedAt']
+        mock_post.return_value = alive_response()
+
+        result = monitor.check(api.config_manager.get_configuration(config['id']))
+        assert result['healthy'] is True
+        assert result['supports_images'] is True
+        assert mock_post.call_count == 1
+        assert api.config_manager.get_configuration(config['id'])['updatedAt'] == updated_at
+
+    @patch('api.test_image_support', return_value=True)
+    @patch('api.upstream_pool.post')
+    def test_explicit_test_reruns_image_test(self, mock_post, mock_image, client, monitor):
+        """Test an explicit test of a stored configuration re-runs the image test and stores the result."""
+        config = api.config_manager.create_configuration('Local', API_URL, model='m')
+        assert config.get('supportsImages') is None
+        mock_post.return_value = alive_response()
+
+        response = client.post('/api/test-external', json={'api_url': API_URL, 'model': 'm', 'force': True})
+        assert response.json['supports_images'] is True
+        assert 'image_test_error' in response.json
+        assert mock_image.call_count == 1
+        assert api.config_manager.get_configuration(config['id'])['supportsImages'] is True
+        assert monitor.summary(config['id'])['supports_images'] is True
+
+        client.get(f"/api/configurations/{config['id']}/health?force=1")
+        assert mock_image.call_count == 2
+
+    @patch('api.upstream_pool.post')
+    def test_cache_not_shared_with_other_api_keys(self, mock_post, client, monitor):
+        """Test callers with a different API key always get a fresh probe."""
+        api.config_manager.create_configuration('Local', API_URL, api_key='secret', model='m')
+        mock_post.return_value = alive_response()
+        client.post('/api/test-external', json={'api_url': API_URL, 'api_key': 'secret', 'model': 'm'})
+
+        response = client.post('/api/test-external', json={'api_url': API_URL, 'api_key': 'other', 'model': 'm'})
+        assert 'cached' not in response.json
+
+    @patch('api.upstream_pool.post')
+    def test_configurations_include_health(self, mock_post, client, monitor):
+        """Test listings carry the cached summary and the history endpoint can force a probe."""
+        config = api.config_manager.create_configuration('Local', API_URL)
+        assert 'health' not in client.get('/api/configurations').json[0]
+
+        mock_post.return_value = alive_response()
+        response = client.get(f"/api/configurations/{config['id']}/health?force=1")
+        assert response.json['health']['status'] == 'healthy'
+        assert 'response' not in response.json['history'][0]
+
+        listed = client.get('/api/configurations').json[0]
+        assert listed['health']['status'] == 'healthy'
+        assert client.get('/api/configurations/missing/health').status_code == 404
+
+    @patch('api.upstream_pool.post')
+    def test_bulk_health_streams_ndjson(self, mock_post, client, monitor):
+        """Test the bulk endpoint streams one result per configuration and a summary."""
+        first = api.config_manager.create_configuration('One', API_URL)
+        api.config_manager.create_configuration('Two', 'http://localhost:9998/v1/chat/completions')
+        mock_post.return_value = alive_response()
+
+        response = client.get('/api/configurations/health')
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        results = [line for line in lines if line['type'] == 'result']
+        assert sorted(r['name'] for r in results) == ['One', 'Two']
+        assert all(r['health_status'] == 'healthy' for r in results)
+        assert lines[-1]['type'] == 'summary'
+        assert lines[-1]['healthy'] == 2
+        assert monitor.summary(first['id'])['status'] == 'healthy'
+
+    @patch('api.upstream_pool.post')
+    def test_bulk_health_sse_and_validation(self, mock_post, client, monitor):
+        """Test SSE framing on request and rejection of bad limits."""
+        api.config_manager.create_configuration('One', API_URL)
+        mock_post.return_value = alive_response()
+
+        frames = client.get('/api/configurations/health?format=sse').get_data(as_text=True).split('\n\n')[:-1]
+        assert json.loads(frames[0][6:])['type'] == 'result'
+        assert json.loads(frames[1][6:])['type'] == 'summary'
+        assert frames[-1] == 'data: [DONE]'
+        assert client.get('/api/configurations/health?concurrency=0').status_code == 400
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
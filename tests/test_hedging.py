@@ -0,0 +1,192 @@
+"""
+Tests for hedged upstream requests.
+"""
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from hedging import Hedger, hedge_settings
+from metrics import Metrics
+from request_errors import ChatRequestError
+
+BODY = [b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n', b'data: [DONE]\n\n']
+
+
+class FakeResponse:
+    """A streaming requests response whose first chunk arrives after `first_event_delay` seconds"""
+
+    def __init__(self, name, first_event_delay=0.0, status_code=200):
+        self.name = name
+        self.status_code = status_code
+        self.headers = {'content-type': 'text/event-stream' if status_code == 200 else 'application/json'}
+        self.first_event_delay = first_event_delay
+        self.closed = threading.Event()
+
+    def iter_content(self, chunk_size=1):
+        self.closed.wait(self.first_event_delay)
+        for chunk in BODY:
+            if self.closed.is_set():
+                raise ConnectionError('closed')
+            yield chunk
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeAsyncResponse(FakeResponse):
+    async def aiter_bytes(self, chunk_size=None):
+        await asyncio.sleep(self.first_event_delay)
+        for chunk in BODY:
+            yield chunk
+
+    async def aclose(self):
+        self.closed.set()
+
+
+def sender(*responses):
+    """send() returning the given responses in turn"""
+    queue = list(responses)
+    calls = []
+
+    def send():
+        calls.append(time.perf_counter())
+        return queue.pop(0)
+    send.calls = calls
+    return send
+
+
+SETTINGS = {'initial_delay_ms': 20}
+
+
+class TestHedgeSettings:
+    """Test suite for resolving the hedging opt-in."""
+
+    def test_disabled_by_default(self):
+        """Test hedging is off without request or configuration settings."""
+        assert hedge_settings({}, None) is None
+        assert hedge_settings({}, {'settings': {}}) is None
+
+    def test_request_overrides_configuration(self):
+        """Test request fields take precedence over configuration settings."""
+        config = {'settings': {'hedge': True, 'hedgeDelayMs': 500}}
+        assert hedge_settings({}, config) == {'initial_delay_ms': 500.0}
+        assert hedge_settings({'hedge_delay_ms': 50}, config) == {'initial_delay_ms': 50.0}
+        assert hedge_settings({'hedge': False}, config) is None
+
+    def test_non_numeric_delay_is_a_request_error(self):
+        """Test a non-numeric delay raises a 400 ChatRequestError."""
+        with pytest.raises(ChatRequestError) as exc_info:
+            hedge_settings({'hedge': True, 'hedge_delay_ms': 'soon'})
+        assert exc_info.value.status_code == 400
+
+
+class TestHedger:
+    """Test suite for racing upstream requests."""
+
+    def test_fast_primary_is_not_hedged(self):
+        """Test a request whose first event arrives in time is sent once and relayed whole."""
+        hedger = Hedger()
+        send = sender(FakeResponse('primary'))
+        response = hedger.post(send, 'config-1', SETTINGS)
+        assert len(send.calls) == 1
+        assert list(response.iter_content(16384)) == BODY
+        assert hedger.get_stats()['config-1']['hedged'] == 0
+
+    def test_hedge_wins_and_primary_is_closed(self):
+        """Test a late first event triggers a second request, which wins and closes the first."""
+        metrics = Metrics()
+        hedger = Hedger(metrics)
+        primary, hedge = FakeResponse('primary', first_event_delay=5), FakeResponse('hedge')
+        send = sender(primary, hedge)
+        started = time.perf_counter()
+        response = hedger.post(send, 'config-1', SETTINGS, {'config_id': 'config-1', 'model': 'm'})
+
+        assert time.perf_counter() - started < 1
+        assert response.name == 'hedge'
+        assert list(response.iter_content()) == BODY
+        assert send.calls[1] - send.calls[0] >= 0.02
+        assert primary.closed.is_set()
+        stats = hedger.get_stats()['config-1']
+        assert (stats['requests'], stats['hedged'], stats['hedge_wins']) == (1, 1, 1)
+        assert 'chat_hedge_wins_total{config_id="config-1",model="m"} 1' in metrics.render()
+
+    def test_primary_can_still_win(self):
+        """Test the first request wins when its event arrives before the hedge's."""
+        hedger = Hedger()
+        primary, hedge = FakeResponse('primary', first_event_delay=0.05), FakeResponse('hedge', first_event_delay=5)
+        response = hedger.post(sender(primary, hedge), 'config-1', SETTINGS)
+        assert response.name == 'primary'
+        assert hedge.closed.is_set()
+        assert hedger.get_stats()['config-1']['hedge_wins'] == 0
+
+    def test_early_failure_is_not_retried(self):
+        """Test an error status before the delay is returned without a second request."""
+        hedger = Hedger()
+        send = sender(FakeResponse('primary', status_code=500))
+        response = hedger.post(send, 'config-1', SETTINGS)
+        assert response.status_code == 500
+        assert len(send.calls) == 1
+
+    def test_budget_limits_hedging(self):
+        """Test at most max_rate of recent requests are hedged."""
+        hedger = Hedger(max_rate=0.1)
+        hedger.post(sender(FakeResponse('a', first_event_delay=5), FakeResponse('b')), 'config-1', SETTINGS)
+        send = sender(FakeResponse('c', first_event_delay=0.1), FakeResponse('d'))
+        response = hedger.post(send, 'config-1', SETTINGS)
+        assert response.name == 'c'
+        assert len(send.calls) == 1
+
+    def test_delay_follows_observed_p95(self):
+        """Test the delay switches from the initial value to the observed p95 once enough samples exist."""
+        hedger = Hedger(min_samples=20, min_delay_ms=1)
+        assert hedger.delay('config-1', SETTINGS) == pytest.approx(0.02)
+        hedger._record('config-1').samples.extend([0.1] * 19 + [0.3])
+        assert hedger.delay('config-1', SETTINGS) == pytest.approx(0.1)
+        hedger._record('config-1').samples.extend([0.3] * 5)
+        assert hedger.delay('config-1', SETTINGS) == pytest.approx(0.3)
+        assert hedger.get_stats()['config-1']['delay_ms'] == 300.0
+
+    def test_async_hedge_wins(self):
+        """Test the asyncio path races the same way and closes the loser."""
+        hedger = Hedger()
+        primary, hedge = FakeAsyncResponse('primary', first_event_delay=5), FakeAsyncResponse('hedge')
+        responses = [primary, hedge]
+
+        async def send():
+            return responses.pop(0)
+
+        async def run():
+            response = await hedger.asend(send, 'config-1', SETTINGS)
+            return response, [chunk async for chunk in response.aiter_bytes()]
+
+        response, chunks = asyncio.run(run())
+        assert response.name == 'hedge'
+        assert chunks == BODY
+        assert primary.closed.is_set()
+        assert hedger.get_stats()['config-1']['hedge_wins'] == 1
+
+
+def test_chat_proxy_hedges_slow_upstream(client):
+    """Test /api/chat relays the hedge's stream when the first request stalls."""
+    primary, hedge = FakeResponse('primary', first_event_delay=5), FakeResponse('hedge')
+    with patch('api.upstream_pool.post', side_effect=[primary, hedge]) as mock_post:
+        response = client.post('/api/chat', json={
+            'api_url': 'http://hedge.test/v1/chat/completions', 'model': 'm', 'message': 'Hi',
+            'hedge': True, 'hedge_delay_ms': 20
+        })
+        body = response.get_data(as_text=True)
+
+    assert mock_post.call_count == 2
+    assert 'data: Hi\n\n' in body
+    assert primary.closed.is_set()
+    stats = client.get('/api/upstream/stats').get_json()['hedging']
+    assert stats['http://hedge.test/v1/chat/completions']['hedge_wins'] >= 1
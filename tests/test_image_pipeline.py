@@ -0,0 +1,214 @@
+"""
+Tests for server-side image normalization.
+"""
+import asyncio
+import base64
+import io
+import json
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+import image_pipeline
+from blob_store import BlobStore
+from image_pipeline import ImagePipeline, image_settings, normalize_data_url
+from request_errors import ChatRequestError
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_data_url(width, height, mode='RGB'):
+    """Build a noisy PNG data URL that compresses poorly, like a screenshot."""
+    img = Image.effect_noise((width, height), 64).convert(mode)
+    output = io.BytesIO()
+    img.save(output, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+
+
+def decode(url):
+    return Image.open(io.BytesIO(base64.b64decode(url.split(',', 1)[1])))
+
+
+class TestImageSettings:
+    """Test suite for resolving image settings."""
+
+    def test_disabled_by_default(self):
+        """Test images are left alone without a max dimension."""
+        assert image_settings({}, None) is None
+        assert image_settings({}, {'settings': {'imageFormat': 'webp'}}) is None
+
+    def test_configuration_and_request_override(self):
+        """Test request fields take precedence and values are normalized."""
+        config = {'settings': {'imageMaxDimension': 1024, 'imageFormat': 'WEBP', 'imageQuality': 70}}
+        assert image_settings({}, config) == {'max_dimension': 1024, 'image_format': 'webp', 'quality': 70}
+        assert image_settings({'image_format': 'jpg', 'image_quality': 500}, config) == {
+            'max_dimension': 1024, 'image_format': 'jpeg', 'quality': 100
+        }
+
+    def test_non_numeric_setting_is_a_request_error(self):
+        """Test non-numeric values raise a 400 ChatRequestError naming the field."""
+        with pytest.raises(ChatRequestError) as exc_info:
+            image_settings({'image_quality': 'high'}, {'settings': {'imageMaxDimension': 1024}})
+        assert exc_info.value.status_code == 400
+        assert 'image_quality' in exc_info.value.body['error']
+
+
+class TestNormalizeDataUrl:
+    """Test suite for normalize_data_url."""
+
+    def test_downscales_and_recompresses(self):
+        """Test a large PNG is downscaled and re-encoded as JPEG."""
+        url = png_data_url(800, 400)
+        new_url, original_size, new_size = normalize_data_url(url, 200, 'jpeg', 80)
+        assert new_url.startswith('data:image/jpeg;base64,')
+        assert new_size < original_size
+        assert decode(new_url).size == (200, 100)
+
+    def test_alpha_flattened_for_jpeg_and_kept_for_webp(self):
+        """Test transparent images become RGB JPEGs but keep alpha as WebP."""
+        url = png_data_url(300, 300, 'RGBA')
+        jpeg_url, _, _ = normalize_data_url(url, 100, 'jpeg')
+        webp_url, _, _ = normalize_data_url(url, 100, 'webp')
+        assert decode(jpeg_url).mode == 'RGB'
+        assert decode(webp_url).format == 'WEBP'
+
+    def test_non_data_and_invalid_urls_unchanged(self):
+        """Test remote URLs and undecodable data are passed through."""
+        for url in ['https://example.com/cat.png', 'data:image/png;base64,bm90IGFuIGltYWdl']:
+            assert normalize_data_url(url, 100) == (url, len(url), len(url))
+
+    def test_larger_result_keeps_original(self):
+        """Test a re-encode that would grow the image keeps the original."""
+        img = Image.new('RGB', (8, 8), (255, 0, 0))
+        output = io.BytesIO()
+        img.save(output, 'PNG')
+        url = 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+        assert normalize_data_url(url, 100, 'jpeg', 100)[0] == url
+
+
+class TestImagePipeline:
+    """Test suite for ImagePipeline."""
+
+    def test_normalize_reports_stats(self):
+        """Test images keep their metadata and stats sum across images."""
+        pipeline = ImagePipeline(max_workers=2)
+        images = [{'id': str(i), 'name': f'{i}.png', 'url': png_data_url(600, 600)} for i in range(3)]
+        normalized, stats = pipeline.normalize(images, {'max_dimension': 100, 'image_format': 'jpeg', 'quality': 80})
+        assert [img['id'] for img in normalized] == ['0', '1', '2']
+        assert stats['images'] == 3
+        assert stats['bytes_saved'] == stats['original_bytes'] - stats['normalized_bytes'] > 0
+
+    def test_async_normalize(self):
+        """Test the async path produces the same results."""
+        pipeline = ImagePipeline(max_workers=2)
+        images = [{'id': 'a', 'url': png_data_url(400, 400)}]
+        settings = {'max_dimension': 100, 'image_format': 'jpeg', 'quality': 80}
+        normalized, stats = asyncio.run(pipeline.anormalize(images, settings))
+        assert normalized[0]['url'].startswith('data:image/jpeg')
+        assert stats['bytes_saved'] > 0
+
+    def test_without_pillow_images_pass_through(self):
+        """Test images are forwarded unchanged when Pillow is missing."""
+        images = [{'id': 'a', 'url': png_data_url(100, 100)}]
+        with patch.object(image_pipeline, 'Image', None):
+            normalized, stats = ImagePipeline().normalize(images, {'max_dimension': 10})
+        assert normalized == images
+        assert stats['bytes_saved'] == 0
+
+    def test_normalize_stored_reuses_normalized_copies(self, tmp_path):
+        """Test stored images are normalized once per settings and unknown hashes pass through."""
+        store = BlobStore(str(tmp_path / 'blobs'))
+        original, _ = store.put_data_url(png_data_url(600, 600))
+        settings = {'max_dimension': 100, 'image_format': 'jpeg', 'quality': 80}
+        pipeline = ImagePipeline(max_workers=2)
+
+        (normalized,), stats = pipeline.normalize_stored([original], settings, store)
+        assert normalized != original
+        assert store.info(normalized)['mime'] == 'image/jpeg'
+        assert stats['images'] == 1 and stats['bytes_saved'] > 0
+
+        hashes, stats = pipeline.normalize_stored([original, 'f' * 64], settings, store)
+        assert hashes == [normalized, 'f' * 64]
+        assert stats['images'] == 0
+
+
+class TestImageChat:
+    """Test suite for image normalization in /api/chat."""
+
+    @patch('api.upstream_pool.post')
+    def test_chat_sends_normalized_images(self, mock_post, client):
+        """Test upstream receives the smaller image and the response reports bytes saved."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'content-type': 'application/json'}
+        mock_response.json.return_value = {'choices': [{'message': {'content': 'A cat'}}]}
+        mock_post.return_value = mock_response
+
+        url = png_data_url(800, 800)
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'What is this?',
+            'images': [{'id': 'a', 'url': url}],
+            'image_max_dimension': 256
+        })
+        assert response.status_code == 200
+
+        sent_url = mock_post.call_args.kwargs['json']['messages'][-1]['content'][1]['image_url']['url']
+        assert sent_url.startswith('data:image/jpeg;base64,')
+        assert int(response.headers['X-Image-Bytes-Saved']) == len(url) - len(sent_url)
+
+    @patch('api.upstream_pool.post')
+    def test_chat_normalizes_history_images(self, mock_post, client, tmp_path, monkeypatch):
+        """Test stored history images are sent normalized like the current turn's."""
+        store = BlobStore(str(tmp_path / 'blobs'))
+        monkeypatch.setattr(api, 'blob_store', store)
+        blob_hash, _ = store.put_data_url(png_data_url(800, 800))
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.headers = {'content-type': 'application/json'}
+        mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'ok'}}]}
+
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'And now?',
+            'conversation_history': [{'sender': 'user', 'content': 'Look', 'images': [{'hash': blob_hash}]}],
+            'image_max_dimension': 256
+        })
+        assert response.status_code == 200
+
+        history_url = mock_post.call_args.kwargs['json']['messages'][1]['content'][1]['image_url']['url']
+        assert history_url.startswith('data:image/jpeg;base64,')
+        assert len(history_url) < len(store.data_url(blob_hash))
+
+    def test_async_chat_reports_bytes_saved(self, make_app, run_asgi, sse_body):
+        """Test the asyncio chat path normalizes images and sets the header on the stream."""
+        import httpx
+        
+        sent = {}
+
+        def handler(request):
+            sent['payload'] = json.loads(request.content)
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=sse_body)
+
+        url = png_data_url(800, 800)
+        result = run_asgi(make_app(handler), json.dumps({
+            'api_url': 'http://upstream/v1/chat',
+            'message': 'What is this?',
+            'images': [{'id': 'a', 'url': url}],
+            'image_max_dimension': 256,
+            'image_format': 'webp'
+        }).encode())
+
+        sent_url = sent['payload']['messages'][-1]['content'][1]['image_url']['url']
+        assert sent_url.startswith('data:image/webp;base64,')
+        assert int(result['headers']['x-image-bytes-saved']) == len(url) - len(sent_url)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
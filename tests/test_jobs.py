@@ -0,0 +1,128 @@
+"""
+Tests for the background job queue and non-blocking image support probes.
+"""
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from jobs import JobQueue
+
+API_URL = 'http://localhost:9999/v1/chat/completions'
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """A fresh job queue installed in the API module."""
+    job_queue = JobQueue()
+    monkeypatch.setattr(api, 'job_queue', job_queue)
+    return job_queue
+
+
+class TestJobQueue:
+    """Test suite for JobQueue."""
+
+    def test_success_runs_on_complete(self):
+        """Test a finished job carries its result and applies it."""
+        applied = []
+        queue = JobQueue()
+        job = queue.submit('add', lambda a, b: a + b, 1, 2, on_complete=applied.append)
+        assert job['status'] in ('pending', 'running', 'succeeded')
+
+        finished = queue.wait(job['id'], timeout=2)
+        assert finished['status'] == 'succeeded'
+        assert finished['result'] == 3
+        assert finished['finished_at'] is not None
+        assert applied == [3]
+
+    def test_failure_is_recorded(self):
+        """Test an exception marks the job failed without calling on_complete."""
+        applied = []
+
+        def failing():
+            raise RuntimeError('boom')
+
+        queue = JobQueue()
+        job = queue.wait(queue.submit('fail', failing, on_complete=applied.append)['id'], timeout=2)
+        assert job['status'] == 'failed'
+        assert job['error'] == 'boom'
+        assert applied == []
+
+    def test_newer_job_with_same_key_supersedes(self):
+        """Test a stale job finishing late does not apply its result."""
+        release = threading.Event()
+        applied = []
+        queue = JobQueue(max_workers=2)
+        old = queue.submit('probe', lambda: release.wait(2) and 'old', key='k', on_complete=applied.append)
+        new = queue.submit('probe', lambda: 'new', key='k', on_complete=applied.append)
+        queue.wait(new['id'], timeout=2)
+        release.set()
+
+        assert queue.wait(old['id'], timeout=2)['status'] == 'superseded'
+        assert applied == ['new']
+
+    def test_unknown_job(self):
+        """Test unknown ids return None."""
+        queue = JobQueue()
+        assert queue.get('missing') is None
+        assert queue.wait('missing') is None
+
+
+class TestImageProbeJobs:
+    """Test suite for configuration endpoints probing image support in the background."""
+
+    @patch('api.test_image_support', return_value=True)
+    def test_create_returns_job_and_applies_result(self, mock_probe, client, queue):
+        """Test creating a configuration returns before the probe and stores its result."""
+        response = client.post('/api/configurations', json={'name': 'Local', 'apiUrl': API_URL, 'model': 'm'})
+        assert response.status_code == 201
+        job = response.json['imageTestJob']
+
+        queue.wait(job['id'], timeout=2)
+        status = client.get(f"/api/jobs/{job['id']}")
+        assert status.json['status'] == 'succeeded'
+        assert status.json['result'] is True
+        assert api.config_manager.get_configuration(response.json['id'])['supportsImages'] is True
+        mock_probe.assert_called_once_with(API_URL, '', 'm')
+
+    @patch('api.test_image_support', side_effect=Exception('unreachable'))
+    def test_failed_probe_leaves_support_unknown(self, mock_probe, client, queue):
+        """Test a failing probe is reported by the job and not stored."""
+        response = client.post('/api/configurations', json={'name': 'Local', 'apiUrl': API_URL})
+        job = queue.wait(response.json['imageTestJob']['id'], timeout=2)
+        assert job['status'] == 'failed'
+        assert api.config_manager.get_configuration(response.json['id']).get('supportsImages') is None
+
+    def test_result_discarded_when_endpoint_changed(self, client, queue):
+        """Test a probe for the previous endpoint does not overwrite the new one's support."""
+        release = threading.Event()
+        config = api.config_manager.create_configuration('Local', API_URL, model='m')
+
+        def probe(api_url, api_key, model):
+            if model == 'old':
+                release.wait(2)
+            return model == 'old'
+
+        with patch('api.test_image_support', side_effect=probe):
+            first = client.put(f"/api/configurations/{config['id']}",
+                               json={'name': 'Local', 'apiUrl': API_URL, 'model': 'old'})
+            api.config_manager.update_configuration(config['id'], 'Local', API_URL, '', 'new')
+            release.set()
+            queue.wait(first.json['imageTestJob']['id'], timeout=2)
+
+        assert api.config_manager.get_configuration(config['id']).get('supportsImages') is None
+
+    def test_unknown_job_is_404(self, client, queue):
+        """Test polling an unknown job returns 404."""
+        assert client.get('/api/jobs/missing').status_code == 404
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
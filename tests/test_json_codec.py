@@ -0,0 +1,86 @@
+"""
+Tests for the pluggable JSON codec.
+"""
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import json_codec
+from json_codec import CODECS, DecodeError, create_codec
+
+INSTALLED = [name for name in CODECS if json_codec._INSTALLED[name]]
+
+
+@pytest.fixture(params=INSTALLED)
+def codec(request):
+    return create_codec(request.param)
+
+
+class TestCodecs:
+    """Test suite run against every installed codec."""
+
+    def test_round_trip(self, codec):
+        """Test bytes and str input decode to the same document, and output is compact UTF-8."""
+        document = {'message': 'héllo 👋', 'images': [{'hash': 'abc'}], 'n': 3, 'ok': None}
+        encoded = codec.dumps_bytes(document)
+        assert encoded == '{"message":"héllo 👋","images":[{"hash":"abc"}],"n":3,"ok":null}'.encode('utf-8')
+        assert codec.loads(encoded) == document
+        assert codec.loads(codec.dumps(document)) == document
+
+    def test_invalid_json_raises_decode_error(self, codec):
+        """Test every codec raises the same ValueError subclass."""
+        with pytest.raises(DecodeError):
+            codec.loads(b'{"choices": [')
+        with pytest.raises(DecodeError):
+            codec.delta_content(b'not json')
+
+    def test_default_hook(self, codec):
+        """Test unsupported objects go through the default callback."""
+        assert codec.loads(codec.dumps_bytes({'value': {1, 2}}, default=sorted)) == {'value': [1, 2]}
+
+    @pytest.mark.parametrize('data, expected', [
+        (b'{"id":"c1","model":"m","choices":[{"index":0,"delta":{"content":"Hi"},"finish_reason":null}]}', 'Hi'),
+        (b'{"choices":[{"delta":{"role":"assistant"}}]}', None),
+        (b'{"choices":[{"delta":{"content":null}}]}', None),
+        (b'{"choices":[]}', None),
+        (b'{"error":"overloaded"}', None),
+        (b'{"choices":[{"delta":{"content":5}}]}', 5),
+    ])
+    def test_delta_content(self, codec, data, expected):
+        """Test per-token decoding matches extract_delta_content on the full document."""
+        assert codec.delta_content(data) == expected
+        assert json_codec.extract_delta_content(codec.loads(data)) == expected
+
+
+def test_unknown_codec_is_rejected():
+    """Test a typo in JSON_CODEC fails loudly."""
+    with pytest.raises(ValueError):
+        create_codec('ujson')
+
+
+def test_missing_codec_falls_back_to_stdlib():
+    """Test forcing a codec that is not installed uses the stdlib one."""
+    with patch.dict(json_codec._INSTALLED, {'orjson': False, 'msgspec': False}):
+        assert create_codec('orjson').name == 'stdlib'
+        assert create_codec('auto').name == 'stdlib'
+
+
+class TestFlaskProvider:
+    """Test suite for request.get_json() and jsonify() through the codec."""
+
+    def test_jsonify_is_compact(self, client):
+        """Test JSON responses use the codec's compact output."""
+        response = client.get('/api/health')
+        assert response.status_code == 200
+        assert response.data.startswith(b'{"') and b'": ' not in response.data
+
+    def test_invalid_body_is_rejected(self, client):
+        """Test invalid JSON bodies still get a client error from get_json()."""
+        response = client.post('/api/configurations', data=b'{"name": ', content_type='application/json')
+        assert 400 <= response.status_code < 500
@@ -0,0 +1,124 @@
+"""
+Tests for the Prometheus metrics registry and the /metrics endpoint.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from metrics import Metrics, StreamTimer, chat_labels
+
+LABELS = {'config_id': 'cfg-1', 'model': 'gpt-test'}
+
+
+class TestMetrics:
+    """Test suite for the in-process registry."""
+
+    def test_counters_and_gauges(self):
+        """Test counters add up and gauges go both ways."""
+        metrics = Metrics()
+        metrics.inc('chat_requests_total', **LABELS)
+        metrics.inc('chat_requests_total', **LABELS)
+        metrics.inc('chat_active_streams', **LABELS)
+        metrics.dec('chat_active_streams', **LABELS)
+
+        text = metrics.render()
+        assert '# TYPE chat_requests_total counter' in text
+        assert 'chat_requests_total{config_id="cfg-1",model="gpt-test"} 2' in text
+        assert 'chat_active_streams{config_id="cfg-1",model="gpt-test"} 0' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram output has cumulative buckets, sum and count."""
+        metrics = Metrics()
+        for value in (0.003, 0.2, 0.2, 500):
+            metrics.observe('chat_time_to_first_token_seconds', value, **LABELS)
+
+        text = metrics.render()
+        assert 'chat_time_to_first_token_seconds_bucket{config_id="cfg-1",model="gpt-test",le="0.005"} 1' in text
+        assert 'chat_time_to_first_token_seconds_bucket{config_id="cfg-1",model="gpt-test",le="0.25"} 3' in text
+        assert 'chat_time_to_first_token_seconds_bucket{config_id="cfg-1",model="gpt-test",le="+Inf"} 4' in text
+        assert 'chat_time_to_first_token_seconds_count{config_id="cfg-1",model="gpt-test"} 4' in text
+
+    def test_label_values_are_escaped(self):
+        """Test quotes and backslashes in label values are escaped."""
+        metrics = Metrics()
+        metrics.inc('chat_errors_total', kind='internal', config_id='', model='a"b\\c')
+        assert 'model="a\\"b\\\\c"' in metrics.render()
+
+
+def test_aggregates_worker_files(tmp_path):
+    """Test values from other live workers' files are summed and exited workers' files are skipped."""
+    metrics = Metrics(directory=str(tmp_path))
+    metrics.inc('chat_requests_total', **LABELS)
+    metrics.inc('chat_active_streams', **LABELS)
+
+    exited_pid = 2 ** 22 + 12345  # Above the default pid_max, so never a live process
+    with open(tmp_path / f'metrics-{exited_pid}.json', 'w') as f:
+        json.dump({'pid': exited_pid, 'values': [
+            ['chat_requests_total', LABELS, 3],
+            ['chat_active_streams', LABELS, 5],
+        ]}, f)
+    with open(tmp_path / f'metrics-{os.getppid()}.json', 'w') as f:
+        json.dump({'pid': os.getppid(), 'values': [
+            ['chat_requests_total', LABELS, 2],
+            ['chat_active_streams', LABELS, 2],
+        ]}, f)
+
+    text = metrics.render()
+    assert 'chat_requests_total{config_id="cfg-1",model="gpt-test"} 3' in text
+    assert 'chat_active_streams{config_id="cfg-1",model="gpt-test"} 3' in text
+
+    metrics.flush()
+    with open(tmp_path / f'metrics-{os.getpid()}.json') as f:
+        assert json.load(f)['pid'] == os.getpid()
+    metrics._remove_file(os.getppid())  # Not this process's file
+    metrics._remove_file(os.getpid())
+    assert sorted(os.listdir(tmp_path)) == sorted([f'metrics-{exited_pid}.json', f'metrics-{os.getppid()}.json'])
+
+
+def test_stream_timer():
+    """Test the timer records first-token, inter-token and duration observations."""
+    metrics = Metrics()
+    timer = StreamTimer(metrics, LABELS)
+    timer.token()
+    timer.token()
+    timer.token()
+    timer.finish(cancelled=True)
+
+    totals = metrics.collect()
+    key = lambda name: (name, tuple(sorted(LABELS.items())))
+    assert totals[key('chat_time_to_first_token_seconds')][-1] == 1
+    assert totals[key('chat_inter_token_seconds')][-1] == 2
+    assert totals[key('chat_stream_duration_seconds')][-1] == 1
+    assert totals[key('chat_cancellations_total')] == 1
+
+
+def test_chat_labels():
+    """Test labels use only the stored configuration, never the request's model."""
+    assert chat_labels({'model': 'm1'}, {'id': 'c', 'model': 'm2'}) == {'config_id': 'c', 'model': 'm2'}
+    assert chat_labels({'model': 'anything'}, None) == {'config_id': '', 'model': ''}
+    assert chat_labels({}, {'id': 'c', 'model': 'm2'}) == {'config_id': 'c', 'model': 'm2'}
+    assert chat_labels(None, None) == {'config_id': '', 'model': ''}
+
+
+def test_metrics_endpoint(client, monkeypatch):
+    """Test /metrics reports a streamed chat's latency, bytes and stream gauge."""
+    import api
+    monkeypatch.setattr(api, 'metrics', Metrics())
+    upstream = Mock(status_code=200, headers={'content-type': 'text/event-stream'})
+    upstream.iter_content.return_value = [b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\ndata: [DONE]\n\n']
+    monkeypatch.setattr(api.upstream_pool, 'post', lambda *args, **kwargs: upstream)
+
+    response = client.post('/api/chat', json={'api_url': 'http://upstream/v1', 'model': 'm', 'message': 'Hello'})
+    response.get_data()
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert 'chat_requests_total{config_id="",model=""} 1' in text
+    assert 'chat_time_to_first_token_seconds_count{config_id="",model=""} 1' in text
+    assert 'chat_active_streams{config_id="",model=""} 0' in text
+    assert 'chat_response_bytes_total{config_id="",model=""}' in text
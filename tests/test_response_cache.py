@@ -0,0 +1,211 @@
+"""
+Tests for the exact-match response cache and SSE replay.
+"""
+import json
+import sys
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import httpx
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+import api
+from response_cache import ResponseCache, cache_key, cache_settings, replay_chunks
+
+CHAT_REQUEST = {
+    'api_url': 'http://localhost:9999/v1/chat/completions',
+    'message': 'Tell me a joke',
+    'cache': True
+}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A fresh in-memory response cache installed in the API module."""
+    response_cache = ResponseCache()
+    monkeypatch.setattr(api, 'response_cache', response_cache)
+    return response_cache
+
+
+def mock_stream(*contents):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.headers = {'content-type': 'text/event-stream'}
+    mock_response.iter_content.return_value = [
+        ('data: {"choices": [{"delta": {"content": "%s"}}]}\n\n' % content).encode()
+        for content in contents
+    ] + [b'data: [DONE]\n\n']
+    return mock_response
+
+
+def frames(response):
+    # Without the closing stage timing event, which differs between requests
+    return [frame for frame in response.get_data(as_text=True).split('\n\n')[:-1]
+            if not frame.startswith('event: timing')]
+
+
+class TestCacheKey:
+    """Test suite for cache keys and settings."""
+
+    def test_key_normalizes_whitespace_and_ignores_stream_flag(self):
+        """Test equivalent requests share a key."""
+        payload = {'messages': [{'role': 'user', 'content': 'Hi'}], 'max_tokens': 10, 'stream': True}
+        same = {'messages': [{'role': 'user', 'content': '  Hi\n'}], 'max_tokens': 10, 'stream': False}
+        assert cache_key('http://a', 'k', payload) == cache_key('http://a', 'k', same)
+
+    def test_key_separates_endpoint_key_and_params(self):
+        """Test anything that changes the reply changes the key."""
+        payload = {'messages': [{'role': 'user', 'content': 'Hi'}], 'max_tokens': 10}
+        base = cache_key('http://a', 'k', payload)
+        assert base != cache_key('http://b', 'k', payload)
+        assert base != cache_key('http://a', 'other', payload)
+        assert base != cache_key('http://a', 'k', dict(payload, max_tokens=20))
+
+    def test_settings(self):
+        """Test caching is opt-in and request fields override configuration settings."""
+        assert cache_settings({}, None) is None
+        config = {'settings': {'responseCache': True, 'cacheTtl': 60}}
+        assert cache_settings({}, config) == {'ttl': 60.0, 'pace_ms': 0.0}
+        assert cache_settings({'cache': False}, config) is None
+        assert cache_settings({'cache_pace_ms': 5}, config)['pace_ms'] == 5.0
+
+
+class TestResponseCache:
+    """Test suite for ResponseCache tiers."""
+
+    def test_ttl_expiry(self):
+        """Test entries expire after their TTL."""
+        cache = ResponseCache()
+        cache.set('k', 'value', ttl=0.05)
+        assert cache.get('k') == 'value'
+        time.sleep(0.06)
+        assert cache.get('k') is None
+
+    def test_memory_lru(self):
+        """Test the memory tier evicts the least recently used entry."""
+        cache = ResponseCache(max_entries=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        assert cache.get('b') is None
+        assert cache.get('a') == '1'
+
+    def test_disk_tier_survives_restart_and_is_bounded(self, tmp_path):
+        """Test disk entries are shared with a new instance and evicted by size."""
+        cache = ResponseCache(directory=str(tmp_path))
+        cache.set('a' * 64, 'first')
+        assert ResponseCache(directory=str(tmp_path)).get('a' * 64) == 'first'
+
+        small = ResponseCache(max_entries=1, directory=str(tmp_path / 'small'), max_disk_bytes=100)
+        small.set('x' * 64, 'x' * 40)
+        small.set('y' * 64, 'y' * 40)
+        assert small.get_stats()['disk_entries'] == 1
+        assert small.get('x' * 64) is None
+
+    def test_malformed_disk_entry_is_a_miss(self, tmp_path):
+        """Test a disk entry missing its fields is treated as a miss."""
+        cache = ResponseCache(directory=str(tmp_path))
+        cache.set('a' * 64, 'first')
+        with open(cache._path('a' * 64), 'w') as f:
+            f.write('{"content": "first"}')
+        assert ResponseCache(directory=str(tmp_path)).get('a' * 64) is None
+
+    def test_replay_chunks(self):
+        """Test unpaced replay sends one chunk and paced replay splits it."""
+        assert list(replay_chunks('abc')) == ['abc']
+        assert list(replay_chunks('')) == []
+        assert len(list(replay_chunks('x' * 130, pace_ms=1))) == 3
+
+
+class TestCachedChat:
+    """Test suite for response caching in /api/chat."""
+
+    @patch('api.upstream_pool.post')
+    def test_miss_then_hit_replays_same_frames(self, mock_post, client, cache):
+        """Test a completed reply is cached and replayed without calling upstream."""
+        mock_post.return_value = mock_stream('Why', ' not?')
+
+        first = client.post('/api/chat', json=CHAT_REQUEST)
+        assert first.headers['X-Cache'] == 'MISS'
+        assert frames(first)[1:] == ['data: Why', 'data:  not?']
+
+        second = client.post('/api/chat', json=CHAT_REQUEST)
+        assert second.headers['X-Cache'] == 'HIT'
+        second_frames = frames(second)
+        assert json.loads(second_frames[0][6:])['cache_hit'] is True
+        assert second_frames[1:] == ['data: Why not?']
+        assert mock_post.call_count == 1
+
+    @patch('api.upstream_pool.post')
+    def test_passthrough_hit_emits_openai_events(self, mock_post, client, cache):
+        """Test passthrough replays are OpenAI-format events ending in [DONE]."""
+        mock_post.return_value = mock_stream('Hi')
+        client.post('/api/chat', json=CHAT_REQUEST).get_data()
+
+        response = client.post('/api/chat', json=dict(CHAT_REQUEST, stream_mode='passthrough'))
+        replayed = frames(response)[1:]
+        assert json.loads(replayed[0][6:])['choices'][0]['delta']['content'] == 'Hi'
+        assert replayed[-1] == 'data: [DONE]'
+
+    @patch('api.upstream_pool.post')
+    def test_cancelled_stream_is_not_cached(self, mock_post, client, cache):
+        """Test a stream stopped before the end leaves nothing in the cache."""
+        mock_post.return_value = mock_stream('partial', 'reply')
+        with patch('api.is_stream_cancelled', side_effect=[False, True, True]):
+            client.post('/api/chat', json=CHAT_REQUEST).get_data()
+        assert cache.get_stats()['memory_entries'] == 0
+
+    @patch('api.upstream_pool.post')
+    def test_cache_disabled_by_default(self, mock_post, client, cache):
+        """Test requests without caching do not touch the cache."""
+        mock_post.return_value = mock_stream('Hi')
+        response = client.post('/api/chat', json=dict(CHAT_REQUEST, cache=False))
+        response.get_data()
+        assert 'X-Cache' not in response.headers
+        assert cache.get_stats()['memory_entries'] == 0
+
+    def test_async_hit(self, cache, make_app, run_asgi, sse_body):
+        """Test the asyncio path caches and replays the same way."""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=sse_body)
+
+        app = make_app(handler)
+        body = json.dumps(dict(CHAT_REQUEST, api_url='http://upstream/v1/chat')).encode()
+        first = run_asgi(app, body)
+        second = run_asgi(app, body)
+
+        assert first['headers']['x-cache'] == 'MISS'
+        assert second['headers']['x-cache'] == 'HIT'
+        assert second['chunks'][1:-1] == ['data: Hello world\n\n']
+        assert second['chunks'][-1].startswith('event: timing')
+        assert len(calls) == 1
+
+    @patch('api.upstream_pool.post')
+    def test_non_numeric_ttl_is_rejected(self, mock_post, client, cache, make_app, run_asgi):
+        """Test a non-numeric cache TTL is a 400 on both paths, before any upstream call."""
+        response = client.post('/api/chat', json=dict(CHAT_REQUEST, cache_ttl='soon'))
+        assert response.status_code == 400
+        assert 'cache_ttl must be a number' in response.json['error']
+        mock_post.assert_not_called()
+
+        calls = []
+        app = make_app(lambda request: calls.append(request))
+        body = json.dumps(dict(CHAT_REQUEST, api_url='http://upstream/v1/chat', cache_ttl='soon')).encode()
+        result = run_asgi(app, body)
+
+        assert result['status'] == 400
+        assert 'cache_ttl must be a number' in json.loads(''.join(result['chunks']))['error']
+        assert calls == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,48 @@
+"""
+Tests for the production server settings.
+"""
+import sys
+from pathlib import Path
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from serve import gunicorn_options, parse_settings
+
+
+class TestSettings:
+    """Test suite for environment and command line settings."""
+
+    def test_defaults(self):
+        """Test threaded, preloading workers are the default."""
+        settings = parse_settings([], environ={'SERVER_WORKERS': '2'})
+        assert settings.bind == '0.0.0.0:8000'
+        assert settings.workers == 2
+        assert settings.worker_class == 'gthread'
+        assert settings.preload is True
+        assert parse_settings([], environ={}).workers == 1
+
+    def test_command_line_overrides_environment(self):
+        """Test flags win over SERVER_* variables."""
+        environ = {'SERVER_BIND': '127.0.0.1:9000', 'SERVER_THREADS': '8', 'SERVER_PRELOAD': '0'}
+        settings = parse_settings(['--threads', '64', '--preload'], environ=environ)
+        assert settings.bind == '127.0.0.1:9000'
+        assert settings.threads == 64
+        assert settings.preload is True
+
+    def test_gthread_options(self):
+        """Test gthread workers get a thread count and the worker start hook."""
+        options = gunicorn_options(parse_settings(['--workers', '3', '--timeout', '90'], environ={}))
+        assert options['worker_class'] == 'gthread'
+        assert options['threads'] == 32
+        assert options['workers'] == 3
+        assert options['timeout'] == 90
+        assert options['preload_app'] is True
+        assert callable(options['post_worker_init'])
+
+    def test_uvicorn_options(self):
+        """Test the async worker class runs uvicorn without a thread count."""
+        options = gunicorn_options(parse_settings(['--worker-class', 'uvicorn'], environ={}))
+        assert options['worker_class'] == 'uvicorn.workers.UvicornWorker'
+        assert 'threads' not in options
@@ -0,0 +1,157 @@
+"""
+Tests for the incremental SSE parser and passthrough streaming.
+"""
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from sse import SSEParser, iter_events, iter_response_events, parse_events, format_text_frame
+from stream_registry import LocalStreamRegistry
+
+
+def registry_with(stream_id, cancelled=False):
+    """An in-process stream registry holding one registered stream."""
+    registry = LocalStreamRegistry()
+    registry.register(stream_id)
+    if cancelled:
+        registry.cancel(stream_id)
+    return registry
+
+
+class TestSSEParser:
+    """Test suite for SSEParser."""
+
+    def test_basic_events(self):
+        """Test LF-delimited events are parsed in order."""
+        events = parse_events(b'data: one\n\ndata: two\n\n')
+        assert [e.data for e in events] == ['one', 'two']
+
+    def test_crlf_and_cr_line_endings(self):
+        """Test CRLF and bare CR line endings."""
+        events = parse_events(b'data: one\r\n\r\ndata: two\r\rdata: three\n\n')
+        assert [e.data for e in events] == ['one', 'two', 'three']
+
+    def test_crlf_split_across_chunks(self):
+        """Test a CRLF split between chunks does not end the event early."""
+        events = list(iter_events([b'data: a\r', b'\ndata: b\r', b'\n\r\n']))
+        assert [e.data for e in events] == ['a\nb']
+
+    def test_multiline_data(self):
+        """Test multiple data fields are joined with newlines."""
+        events = parse_events(b'data: first\ndata: second\ndata:third\n\n')
+        assert events[0].data == 'first\nsecond\nthird'
+
+    def test_comments_and_fields(self):
+        """Test comments are ignored and event/id fields are kept."""
+        events = parse_events(b': keep-alive\n\nevent: update\nid: 7\ndata: x\n\n')
+        assert len(events) == 1
+        assert events[0].event == 'update'
+        assert events[0].id == '7'
+        assert events[0].data == 'x'
+
+    def test_byte_at_a_time(self):
+        """Test events survive being fed one byte at a time."""
+        body = 'data: {"choices": [{"delta": {"content": "héllo"}}]}\r\n\r\ndata: [DONE]\r\n\r\n'.encode()
+        parser = SSEParser()
+        events = []
+        for i in range(len(body)):
+            events.extend(parser.feed(body[i:i + 1]))
+        assert events[0].data == '{"choices": [{"delta": {"content": "héllo"}}]}'
+        assert events[1].is_done
+
+    def test_trailing_event_flushed(self):
+        """Test an event without a closing blank line is dispatched at end of stream."""
+        events = parse_events('data: last')
+        assert [e.data for e in events] == ['last']
+
+    def test_raw_bytes(self):
+        """Test raw bytes reproduce the event with normalized line endings."""
+        events = parse_events(b'data: a\r\ndata: b\r\n\r\n')
+        assert events[0].raw == b'data: a\ndata: b\n\n'
+
+
+class TestIterResponseEvents:
+    """Test suite for reading events from a live upstream response."""
+
+    def test_close_delimited_stream_is_not_buffered(self):
+        """Test an HTTP/1.0 upstream without chunking delivers each event as it is sent."""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        second_event = threading.Event()
+
+        def serve():
+            conn, _ = server.accept()
+            conn.recv(65536)
+            conn.sendall(b'HTTP/1.0 200 OK\r\nContent-Type: text/event-stream\r\n\r\n')
+            conn.sendall(b'data: one\n\n')
+            second_event.wait(5)
+            conn.sendall(b'data: two\n\n')
+            conn.close()
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        try:
+            response = requests.get(
+                'http://127.0.0.1:%d/' % server.getsockname()[1], stream=True, timeout=5,
+            )
+            events = iter_response_events(response)
+            # The server holds the second event (and the close) until the first is read
+            started = time.monotonic()
+            assert next(events).data == 'one'
+            assert time.monotonic() - started < 2
+            second_event.set()
+            assert [e.data for e in events] == ['two']
+        finally:
+            second_event.set()
+            thread.join(5)
+            server.close()
+
+
+class TestFormatTextFrame:
+    """Test suite for encoding streamed text as frontend SSE frames."""
+
+    def test_single_line(self):
+        """Test single-line text keeps the historical frame format."""
+        assert format_text_frame('Hello') == 'data: Hello\n\n'
+        assert format_text_frame('\n') == 'data: \n\n'
+
+    def test_multiline_text(self):
+        """Test newlines become empty data lines so no text is lost."""
+        assert format_text_frame('a\nb') == 'data: a\ndata: \ndata: b\n\n'
+        assert format_text_frame('\n\n') == 'data: \ndata: \n\n'
+
+
+class TestPassthroughStreaming:
+    """Test suite for passthrough relaying in stream_response."""
+
+    @patch('api.stream_registry', registry_with('pass-stream'))
+    def test_stream_response_passthrough(self, client):
+        """Test passthrough yields upstream event bytes including [DONE]."""
+        from api import stream_response
+
+        mock_response = Mock()
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\ndata: [DO',
+            b'NE]\n\ndata: ignored\n\n'
+        ]
+
+        chunks = list(stream_response(mock_response, 'pass-stream', passthrough=True))
+        assert chunks == [
+            b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n',
+            b'data: [DONE]\n\n'
+        ]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,105 @@
+"""
+Tests for per-request stage timing, Server-Timing headers and the span file exporter.
+"""
+import json
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from stage_timing import StageTimer, SpanFileExporter
+
+
+class TestStageTimer:
+    """Test suite for stage marks and their reporting."""
+
+    def test_marks_are_consecutive(self):
+        """Test each stage starts where the previous one ended."""
+        timing = StageTimer('chat')
+        timing.mark('parse')
+        timing.mark('build')
+        (_, parse_offset, parse_duration), (_, build_offset, _) = timing.stages
+        assert parse_offset == 0
+        assert build_offset == parse_offset + parse_duration
+
+    def test_server_timing_header(self):
+        """Test the header lists stages in order, summing repeats, with the total last."""
+        timing = StageTimer('chat')
+        timing.mark('parse')
+        timing.mark('store')
+        timing.mark('store')
+        timing.finish()
+        header = timing.server_timing()
+        assert [entry.split(';')[0] for entry in header.split(', ')] == ['parse', 'store', 'total']
+        assert all(';dur=' in entry for entry in header.split(', '))
+
+    def test_metadata_event(self):
+        """Test streams get a named SSE event that clients can tell from reply text."""
+        timing = StageTimer('chat')
+        timing.mark('stream')
+        event = timing.metadata_event()
+        assert event.startswith('event: timing\ndata: ')
+        assert event.endswith('\n\n')
+        assert set(json.loads(event.split('data: ', 1)[1])['timing']) == {'stream', 'total'}
+
+    def test_finish_exports_once(self):
+        """Test repeated finish calls export a single trace."""
+        exporter = Mock()
+        timing = StageTimer('chat', exporter)
+        timing.finish()
+        timing.finish()
+        exporter.export.assert_called_once_with(timing)
+
+
+def test_span_file_exporter(tmp_path):
+    """Test spans are written as OTLP/JSON lines with one child span per stage."""
+    path = tmp_path / 'spans.jsonl'
+    exporter = SpanFileExporter(str(path))
+    timing = StageTimer('configurations.create', exporter)
+    timing.attributes.update({'config_id': 'cfg-1', 'http.status_code': 201})
+    timing.mark('validate')
+    timing.mark('store')
+    timing.finish()
+    exporter.close()
+
+    line, = path.read_text().splitlines()
+    resource_spans = json.loads(line)['resourceSpans'][0]
+    assert resource_spans['resource']['attributes'][0]['value'] == {'stringValue': 'michael_chat'}
+    root, *children = resource_spans['scopeSpans'][0]['spans']
+    assert root['name'] == 'configurations.create'
+    assert {'key': 'http.status_code', 'value': {'intValue': '201'}} in root['attributes']
+    assert [child['name'] for child in children] == ['configurations.create.validate', 'configurations.create.store']
+    assert all(child['parentSpanId'] == root['spanId'] and child['traceId'] == root['traceId'] for child in children)
+    assert int(children[-1]['endTimeUnixNano']) <= int(root['endTimeUnixNano'])
+
+
+def test_server_timing_on_configuration_endpoints(client):
+    """Test JSON responses carry their stages in a Server-Timing header."""
+    response = client.post('/api/configurations', json={'name': 'Timed', 'apiUrl': 'http://localhost:9999/v1'})
+    assert response.status_code == 201
+    assert response.headers['Server-Timing'].startswith('validate;dur=')
+    assert 'store;dur=' in response.headers['Server-Timing']
+
+    listing = client.get('/api/configurations')
+    assert 'load;dur=' in listing.headers['Server-Timing']
+
+
+def test_stream_ends_with_timing_event(client, monkeypatch):
+    """Test a streamed chat has no Server-Timing header and ends with the timing event."""
+    import api
+    upstream = Mock(status_code=200, headers={'content-type': 'text/event-stream'})
+    upstream.iter_content.return_value = [b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\ndata: [DONE]\n\n']
+    monkeypatch.setattr(api.upstream_pool, 'post', lambda *args, **kwargs: upstream)
+
+    response = client.post('/api/chat', json={'api_url': 'http://upstream/v1', 'message': 'Hello'})
+    frames = response.get_data(as_text=True).split('\n\n')[:-1]
+
+    assert 'Server-Timing' not in response.headers
+    assert frames[1] == 'data: Hi'
+    event, data = frames[-1].split('\n')
+    assert event == 'event: timing'
+    stages = json.loads(data[len('data: '):])['timing']
+    assert list(stages) == ['parse', 'resolve', 'images', 'build', 'upstream', 'first_token', 'stream', 'total']
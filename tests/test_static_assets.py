@@ -0,0 +1,87 @@
+"""
+Tests for serving the React build: compression, caching headers and the SPA fallback.
+"""
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from server import create_app
+
+BUNDLE = 'console.log("hello");\n' * 200
+
+
+@pytest.fixture
+def build_dir(tmp_path):
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'index.html').write_text('<!doctype html><div id="root"></div>')
+    (tmp_path / 'manifest.json').write_text('{"name": "chat"}')
+    (tmp_path / 'static' / 'js' / 'main.3f2a1b.js').write_text(BUNDLE)
+    (tmp_path / 'static' / 'js' / 'vendor.9c8d7e.js').write_text(BUNDLE)
+    (tmp_path / 'static' / 'js' / 'vendor.9c8d7e.js.br').write_bytes(b'precompressed brotli')
+    return tmp_path
+
+
+@pytest.fixture
+def static_client(build_dir):
+    return create_app(str(build_dir)).test_client()
+
+
+class TestStaticAssets:
+    """Test suite for the build's static file serving."""
+
+    def test_hashed_assets_are_immutable(self, static_client):
+        """Test /static/ files are cached for a year and gzipped at startup."""
+        response = static_client.get('/static/js/main.3f2a1b.js', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data).decode() == BUNDLE
+
+    def test_precompressed_brotli_is_preferred(self, static_client):
+        """Test a .br file next to an asset is sent to clients accepting br."""
+        response = static_client.get('/static/js/vendor.9c8d7e.js', headers={'Accept-Encoding': 'gzip, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert response.data == b'precompressed brotli'
+        assert response.mimetype in ('application/javascript', 'text/javascript')
+
+    def test_identity_without_accept_encoding(self, static_client):
+        """Test clients that accept no encoding get the plain file."""
+        response = static_client.get('/static/js/main.3f2a1b.js', headers={'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_data(as_text=True) == BUNDLE
+
+    def test_etag_revalidation(self, static_client):
+        """Test a matching If-None-Match gets a 304 with no body."""
+        first = static_client.get('/manifest.json')
+        assert first.headers['Cache-Control'] == 'no-cache'
+        second = static_client.get('/manifest.json', headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 304
+        assert second.data == b''
+
+    def test_etag_differs_per_encoding(self, static_client):
+        """Test compressed and plain variants are not confused by caches."""
+        plain = static_client.get('/static/js/main.3f2a1b.js', headers={'Accept-Encoding': 'identity'})
+        gzipped = static_client.get('/static/js/main.3f2a1b.js', headers={'Accept-Encoding': 'gzip'})
+        assert plain.headers['ETag'] != gzipped.headers['ETag']
+
+    def test_client_routes_fall_back_to_index(self, static_client):
+        """Test unknown paths serve index.html for React Router."""
+        response = static_client.get('/chat/some-conversation')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert b'id="root"' in response.data
+        assert static_client.get('/').data == response.data
+
+
+def test_missing_build_returns_404(tmp_path):
+    """Test the frontend routes 404 when the React app has not been built."""
+    client = create_app(str(tmp_path / 'missing')).test_client()
+    assert client.get('/').status_code == 404
+    assert client.get('/api/health').status_code == 200
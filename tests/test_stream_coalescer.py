@@ -0,0 +1,140 @@
+"""
+Tests for time-window coalescing of streamed deltas.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from request_errors import ChatRequestError
+from stream_coalescer import coalesce_settings, coalesce_deltas, acoalesce_deltas
+
+
+def slow_source(items, delay):
+    """Yield items with a pause before each one after the first."""
+    for i, item in enumerate(items):
+        if i:
+            time.sleep(delay)
+        yield item
+
+
+class TestCoalesceSettings:
+    """Test suite for resolving coalescing settings."""
+
+    def test_disabled_by_default(self):
+        """Test coalescing is off without request or configuration settings."""
+        assert coalesce_settings({}, None) is None
+        assert coalesce_settings({}, {'settings': {}}) is None
+
+    def test_configuration_settings(self):
+        """Test configuration settings enable coalescing with defaults filled in."""
+        settings = coalesce_settings({}, {'settings': {'coalesceMs': 20}})
+        assert settings == {'interval_ms': 20.0, 'max_bytes': 1024}
+
+    def test_request_overrides_configuration(self):
+        """Test request fields take precedence over configuration settings."""
+        settings = coalesce_settings({'coalesce_bytes': 64}, {'settings': {'coalesceMs': 20, 'coalesceBytes': 512}})
+        assert settings == {'interval_ms': 20.0, 'max_bytes': 64}
+
+    def test_non_numeric_setting_is_a_request_error(self):
+        """Test non-numeric values raise a 400 ChatRequestError naming the field."""
+        with pytest.raises(ChatRequestError) as exc_info:
+            coalesce_settings({'coalesce_bytes': 'lots'}, {'settings': {'coalesceMs': 20}})
+        assert exc_info.value.status_code == 400
+        assert 'coalesce_bytes' in exc_info.value.body['error']
+
+
+class TestCoalesceDeltas:
+    """Test suite for coalesce_deltas."""
+
+    def test_first_delta_flushes_immediately(self):
+        """Test the first delta is yielded on its own."""
+        chunks = list(coalesce_deltas(iter(['a', 'b', 'c']), interval_ms=1000, max_bytes=1000))
+        assert chunks == ['a', 'bc']
+
+    def test_flush_on_max_bytes(self):
+        """Test the buffer flushes once it reaches max_bytes."""
+        chunks = list(coalesce_deltas(iter(['a', 'bb', 'cc', 'dd', 'e']), interval_ms=1000, max_bytes=4))
+        assert chunks == ['a', 'bbcc', 'dde']
+
+    def test_flush_on_time_window(self):
+        """Test buffered deltas are flushed when the window elapses during a stall."""
+        started = time.monotonic()
+        received = []
+        for chunk in coalesce_deltas(slow_source(['a', 'b', 'c'], 0.1), interval_ms=20, max_bytes=1000):
+            received.append((chunk, time.monotonic() - started))
+
+        assert [chunk for chunk, _ in received] == ['a', 'b', 'c']
+        # 'b' is flushed by the window, not held until 'c' arrives
+        assert received[1][1] < 0.19
+
+    def test_bytes_chunks(self):
+        """Test passthrough byte chunks are joined as bytes."""
+        chunks = list(coalesce_deltas(iter([b'x', b'y', b'z']), interval_ms=1000, max_bytes=1000))
+        assert chunks == [b'x', b'yz']
+
+    def test_source_exception_propagates(self):
+        """Test errors from the source surface after buffered content."""
+        def failing():
+            yield 'a'
+            yield 'b'
+            raise RuntimeError('boom')
+
+        gen = coalesce_deltas(failing(), interval_ms=1000, max_bytes=1000)
+        assert next(gen) == 'a'
+        assert next(gen) == 'b'
+        with pytest.raises(RuntimeError):
+            next(gen)
+
+    def test_async_coalescing(self):
+        """Test the async coalescer batches deltas the same way."""
+        async def source():
+            for item in ['a', 'b', 'c']:
+                yield item
+
+        async def collect():
+            return [chunk async for chunk in acoalesce_deltas(source(), interval_ms=1000, max_bytes=1000)]
+
+        assert asyncio.run(collect()) == ['a', 'bc']
+
+
+class TestCoalescedChat:
+    """Test suite for coalescing in the /api/chat endpoint."""
+
+    @patch('api.upstream_pool.post')
+    def test_chat_coalesces_frames(self, mock_post, client):
+        """Test coalesce_bytes batches deltas into fewer SSE frames."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'content-type': 'text/event-stream'}
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n',
+            b'data: {"choices": [{"delta": {"content": "lo"}}]}\n\n',
+            b'data: {"choices": [{"delta": {"content": " wo"}}]}\n\n',
+            b'data: {"choices": [{"delta": {"content": "rld\\n!"}}]}\n\n',
+            b'data: [DONE]\n\n'
+        ]
+        mock_post.return_value = mock_response
+
+        response = client.post('/api/chat', json={
+            'api_url': 'http://localhost:9999/v1/chat/completions',
+            'message': 'Hi',
+            'coalesce_ms': 1000,
+            'coalesce_bytes': 4096
+        })
+
+        frames = response.get_data(as_text=True).split('\n\n')[:-1]
+        assert frames[0].startswith('data: {"stream_id"')
+        assert frames[1:-1] == ['data: Hel', 'data: lo world\ndata: \ndata: !']
+        assert frames[-1].startswith('event: timing')
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,91 @@
+"""
+Tests for the cancellable stream registries.
+"""
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from stream_registry import LocalStreamRegistry, SharedMemoryStreamRegistry, SocketStreamRegistry
+
+
+def make_registry(kind, tmp_path):
+    if kind == 'local':
+        return LocalStreamRegistry()
+    if kind == 'shm':
+        return SharedMemoryStreamRegistry(str(tmp_path / 'streams.shm'), slots=8)
+    return SocketStreamRegistry(str(tmp_path))
+
+
+@pytest.mark.parametrize('kind', ['local', 'shm', 'socket'])
+class TestStreamRegistry:
+    """Behaviour shared by every backend."""
+
+    def test_register_cancel_release(self, kind, tmp_path):
+        """Test a stream's flag from registration to release."""
+        registry = make_registry(kind, tmp_path)
+        try:
+            stream_id = registry.register()
+            assert stream_id in registry
+            assert registry.is_cancelled(stream_id) is False
+            assert registry.cancel(stream_id) is True
+            assert registry.is_cancelled(stream_id) is True
+            registry.release(stream_id)
+            assert stream_id not in registry
+            assert registry.is_cancelled(stream_id) is True
+        finally:
+            registry.close()
+
+    def test_cancel_unknown_stream(self, kind, tmp_path):
+        """Test stopping a stream nobody owns reports it as not found."""
+        registry = make_registry(kind, tmp_path)
+        try:
+            assert registry.cancel('missing-stream') is False
+        finally:
+            registry.close()
+
+
+def test_shm_reuses_released_slots(tmp_path):
+    """Test released slots are handed out again once the file is full."""
+    registry = SharedMemoryStreamRegistry(str(tmp_path / 'streams.shm'), slots=2)
+    first = registry.register()
+    registry.register()
+    with pytest.raises(RuntimeError, match='full'):
+        registry.register()
+    registry.release(first)
+    assert registry.is_cancelled(registry.register()) is False
+
+
+def owner_process(kind, directory, ready, result):
+    """Register a stream, report its ID and wait until another process cancels it."""
+    registry = make_registry(kind, Path(directory))
+    stream_id = registry.register()
+    ready.put(stream_id)
+    deadline = time.time() + 5
+    while not registry.is_cancelled(stream_id) and time.time() < deadline:
+        time.sleep(0.001)
+    result.put(registry.is_cancelled(stream_id))
+    registry.close()
+
+
+@pytest.mark.parametrize('kind', ['shm', 'socket'])
+def test_cancel_reaches_other_process(kind, tmp_path):
+    """Test a stop handled by one worker cancels a stream relayed by another."""
+    context = multiprocessing.get_context('fork')
+    ready, result = context.Queue(), context.Queue()
+    owner = context.Process(target=owner_process, args=(kind, str(tmp_path), ready, result))
+    owner.start()
+    try:
+        stream_id = ready.get(timeout=5)
+        registry = make_registry(kind, tmp_path)
+        assert registry.cancel(stream_id) is True
+        assert result.get(timeout=5) is True
+        registry.close()
+    finally:
+        owner.join(timeout=5)
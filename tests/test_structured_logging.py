@@ -0,0 +1,106 @@
+"""
+Tests for structured, sampled, queue-based logging.
+"""
+import io
+import json
+import logging
+import sys
+import threading
+from pathlib import Path
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from structured_logging import (
+    NonBlockingQueueHandler, SamplingFilter, StructuredFormatter, parse_category_map, redact
+)
+
+
+def make_record(category='request', level=logging.INFO, msg='Chat request', **fields):
+    record = logging.LogRecord(f'michael_chat.{category}', level, __file__, 1, msg, None, None)
+    record.category = category
+    record.fields = fields
+    return record
+
+
+class TestRedact:
+    """Test suite for field redaction."""
+
+    def test_masks_secrets(self):
+        """Test keys and auth headers are masked, whatever their case."""
+        redacted = redact({'api_key': 'sk-secret', 'headers': {'Authorization': 'Bearer sk-secret'}, 'apiKey': ''})
+        assert redacted == {'api_key': '[redacted]', 'headers': {'Authorization': '[redacted]'}, 'apiKey': ''}
+
+    def test_summarizes_images(self):
+        """Test data URLs and long base64 strings become a size and hash."""
+        image = 'data:image/png;base64,' + 'A' * 5000
+        redacted = redact({'images': [image, 'B' * 5000], 'message': 'hi'})
+        assert redacted['message'] == 'hi'
+        assert [item['bytes'] for item in redacted['images']] == [len(image), 5000]
+        assert all(len(item['sha256']) == 16 for item in redacted['images'])
+
+    def test_truncates_long_text(self):
+        """Test long non-base64 text is truncated rather than hashed."""
+        redacted = redact('word ' * 1000)
+        assert redacted.startswith('word word') and redacted.endswith('(+4000 chars)')
+
+    def test_leaves_input_untouched(self):
+        """Test redaction copies instead of modifying the request data."""
+        data = {'api_key': 'sk-secret'}
+        redact(data)
+        assert data == {'api_key': 'sk-secret'}
+
+
+def test_sampling_filter():
+    """Test sampled categories drop records below WARNING only."""
+    sampler = SamplingFilter(parse_category_map('stream=0,request=1', float))
+    assert sampler.filter(make_record('stream')) is False
+    assert sampler.filter(make_record('stream', level=logging.WARNING)) is True
+    assert sampler.filter(make_record('request')) is True
+    assert sampler.filter(make_record('health')) is True
+
+
+def test_json_formatter():
+    """Test JSON lines carry the category, message and redacted fields."""
+    line = StructuredFormatter(json_lines=True).format(make_record(api_url='http://x', data={'api_key': 'k'}))
+    entry = json.loads(line)
+    assert entry['category'] == 'request'
+    assert entry['msg'] == 'Chat request'
+    assert entry['data'] == {'api_key': '[redacted]'}
+
+
+def test_queue_handler_writes_on_listener_thread():
+    """Test records are formatted off the calling thread."""
+    threads = []
+
+    class RecordingFormatter(StructuredFormatter):
+        def format(self, record):
+            threads.append(threading.current_thread())
+            return super().format(record)
+
+    out = io.StringIO()
+    target = logging.StreamHandler(out)
+    target.setFormatter(RecordingFormatter())
+    handler = NonBlockingQueueHandler([target])
+    handler.handle(make_record(api_url='http://x'))
+    handler.stop()
+
+    assert 'Chat request api_url="http://x"' in out.getvalue()
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_queue_handler_drops_when_full():
+    """Test a full queue drops records instead of blocking the caller."""
+    release = threading.Event()
+
+    class BlockingHandler(logging.Handler):
+        def emit(self, record):
+            release.wait(5)
+
+    handler = NonBlockingQueueHandler([BlockingHandler()], maxsize=1)
+    for _ in range(5):
+        handler.handle(make_record())
+    assert handler.dropped >= 3
+    release.set()
+    handler.stop()
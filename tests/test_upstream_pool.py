@@ -0,0 +1,142 @@
+"""
+Tests for the keyed upstream session pool.
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+# Add backend directory to path to import modules
+backend_path = str(Path(__file__).parent.parent / 'backend')
+sys.path.insert(0, backend_path)
+
+from upstream_pool import AsyncUpstreamPool, UpstreamPool, endpoint_key
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a one-event SSE body"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'data: [DONE]\n\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestEndpointKey:
+    """Test suite for endpoint key normalization."""
+
+    def test_default_ports(self):
+        """Test default ports are filled in per scheme."""
+        assert endpoint_key('https://api.example.com/v1/chat') == ('https', 'api.example.com', 443)
+        assert endpoint_key('http://localhost/v1/chat') == ('http', 'localhost', 80)
+
+    def test_explicit_port_and_case(self):
+        """Test host case is normalized and explicit ports are kept."""
+        assert endpoint_key('HTTP://LocalHost:10001/v1/chat') == ('http', 'localhost', 10001)
+
+
+class TestUpstreamPool:
+    """Test suite for UpstreamPool session reuse and stats."""
+
+    def test_reuses_session_per_endpoint(self):
+        """Test requests to the same endpoint share one session."""
+        pool = UpstreamPool()
+        first = pool.session_for('http://localhost:10001/v1/chat/completions')
+        second = pool.session_for('http://localhost:10001/v1/models')
+        other = pool.session_for('http://localhost:10002/v1/chat/completions')
+
+        assert first is second
+        assert first is not other
+        stats = pool.get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert set(stats['endpoints']) == {'http://localhost:10001', 'http://localhost:10002'}
+
+    def test_idle_sessions_are_evicted(self):
+        """Test sessions idle past the timeout are closed and replaced."""
+        pool = UpstreamPool(idle_timeout=0.01)
+        stale = pool.session_for('http://first-host/v1/chat')
+        time.sleep(0.02)
+        pool.session_for('http://second-host/v1/chat')
+
+        assert pool.get_stats()['evictions'] == 1
+        assert pool.session_for('http://first-host/v1/chat') is not stale
+
+    def test_keep_alive_disabled(self):
+        """Test disabling keep-alive asks the upstream to close connections."""
+        session = UpstreamPool(keep_alive=False).session_for('http://localhost/v1/chat')
+        assert session.headers['Connection'] == 'close'
+
+    def test_sessions_do_not_keep_cookies(self):
+        """Test shared sessions refuse upstream cookies."""
+        session = UpstreamPool().session_for('http://localhost/v1/chat')
+        assert session.cookies.get_policy().allowed_domains() == ()
+
+    def test_forked_pool_starts_fresh(self):
+        """Test a pool inherited through fork opens its own sessions and leaves the parent's open."""
+        pool = UpstreamPool()
+        inherited = pool.session_for('http://localhost/v1/chat')
+        pool._entries_pid = -1  # As seen from a forked worker
+
+        with patch.object(inherited, 'close') as close:
+            assert pool.session_for('http://localhost/v1/chat') is not inherited
+        close.assert_not_called()
+
+    def test_http2_without_h2_falls_back(self):
+        """Test asking for HTTP/2 without the h2 package uses HTTP/1.1 clients instead of failing."""
+        with patch('upstream_pool.importlib.util.find_spec', return_value=None):
+            pool = AsyncUpstreamPool(http2=True)
+        assert pool.http2 is False
+        assert pool.get_stats()['http2'] is False
+        pool._create_client()
+
+    def test_post_uses_pooled_session(self):
+        """Test post() delegates to the endpoint's session, with the JSON body pre-encoded."""
+        pool = UpstreamPool()
+        session = pool.session_for('http://localhost/v1/chat')
+        with patch.object(session, 'post', return_value=Mock(status_code=200)) as mock_post:
+            response = pool.post('http://localhost/v1/chat', json={'a': 1}, timeout=5)
+
+        assert response.status_code == 200
+        mock_post.assert_called_once_with('http://localhost/v1/chat', data=b'{"a":1}', timeout=5,
+                                          headers={'Content-Type': 'application/json'})
+
+    def test_streamed_response_holds_session(self):
+        """Test a session relaying a stream stays checked out, so idle eviction cannot close it."""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StreamHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/v1/chat'
+        try:
+            pool = UpstreamPool(idle_timeout=0.01)
+            response = pool.post(url, json={'a': 1}, stream=True, timeout=5)
+            assert pool.get_stats()['endpoints'][f'http://127.0.0.1:{server.server_address[1]}']['active'] == 1
+            time.sleep(0.02)
+            pool.session_for('http://other-host/v1/chat')
+            assert pool.get_stats()['evictions'] == 0
+
+            assert b''.join(response.iter_content(1024)) == b'data: [DONE]\n\n'
+            assert pool.get_stats()['endpoints'][f'http://127.0.0.1:{server.server_address[1]}']['active'] == 0
+        finally:
+            server.shutdown()
+
+    def test_stats_endpoint(self, client):
+        """Test the stats endpoint reports both pools."""
+        response = client.get('/api/upstream/stats')
+        assert response.status_code == 200
+        assert 'hits' in response.json['sync']
+        assert 'misses' in response.json['async']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])